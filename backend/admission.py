@@ -0,0 +1,168 @@
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Chat requests per second allowed per user and across the worker, each
+# with a burst allowance; a rate of 0 turns that limit off
+CHAT_RATE_PER_USER = float(os.getenv("CHAT_RATE_PER_USER", "1"))
+CHAT_BURST_PER_USER = float(os.getenv("CHAT_BURST_PER_USER", "10"))
+CHAT_RATE_GLOBAL = float(os.getenv("CHAT_RATE_GLOBAL", "0"))
+CHAT_BURST_GLOBAL = float(os.getenv("CHAT_BURST_GLOBAL", "100"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))
+
+# The breaker opens when at least LLM_BREAKER_FAILURE_RATIO of the last
+# LLM_BREAKER_WINDOW calls failed (once LLM_BREAKER_MIN_CALLS were made),
+# then lets a single probe through after the cooldown
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.25"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "2"))
+
+# HTTP statuses worth retrying; google.api_core errors carry them as .code
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_seconds(self):
+        # How long until a whole token is available; 0 when one is now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    # Per-key token buckets plus an optional global one. A request only
+    # spends tokens when every bucket it needs has one, so a request turned
+    # away by the global limit doesn't count against its user.
+    def __init__(self, rate=CHAT_RATE_PER_USER, burst=CHAT_BURST_PER_USER, global_rate=CHAT_RATE_GLOBAL,
+                 global_burst=CHAT_BURST_GLOBAL, max_keys=RATE_LIMIT_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.stats = {"allowed": 0, "limited_user": 0, "limited_global": 0}
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            # Evicting an idle user only forgets a bucket that had refilled
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, key):
+        # Returns 0 if the request may go ahead, else seconds until it could
+        now = time.monotonic()
+        buckets = []
+        if self.rate > 0:
+            buckets.append(("limited_user", self._bucket(key)))
+        if self._global is not None:
+            buckets.append(("limited_global", self._global))
+        wait = 0.0
+        for stat, bucket in buckets:
+            bucket.refill(now)
+            bucket_wait = bucket.wait_seconds()
+            if bucket_wait:
+                self.stats[stat] += 1
+                wait = max(wait, bucket_wait)
+        if wait:
+            return wait
+        for _, bucket in buckets:
+            bucket.tokens -= 1
+        self.stats["allowed"] += 1
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "rate_per_user": self.rate,
+            "burst_per_user": self.burst,
+            "rate_global": self._global.rate if self._global else 0,
+            "tracked_users": len(self._buckets),
+            **self.stats
+        }
+
+
+class CircuitBreaker:
+    # closed: calls go through and outcomes are recorded.
+    # open: calls are refused until the cooldown has passed.
+    # half_open: one probe call goes through; its outcome closes or reopens.
+    def __init__(self, window=LLM_BREAKER_WINDOW, min_calls=LLM_BREAKER_MIN_CALLS,
+                 failure_ratio=LLM_BREAKER_FAILURE_RATIO, cooldown=LLM_BREAKER_COOLDOWN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probe_at = None
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self._opened_at < self.cooldown:
+                self.stats["rejected"] += 1
+                return False
+            self.state = "half_open"
+            self._probe_at = None
+        if self.state == "half_open":
+            # A probe that never reported back (shed, abandoned) expires
+            if self._probe_at is not None and now - self._probe_at < self.cooldown:
+                self.stats["rejected"] += 1
+                return False
+            self._probe_at = now
+        return True
+
+    def record(self, ok):
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self._outcomes.clear()
+                logger.info("LLM circuit breaker closed")
+            else:
+                self._open()
+            return
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                and failures >= self.failure_ratio * len(self._outcomes)):
+            self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.stats["opened"] += 1
+        logger.warning(f"LLM circuit breaker opened for {self.cooldown}s")
+
+    def snapshot(self):
+        return {"state": self.state, "recent_calls": len(self._outcomes), **self.stats}
+
+
+def is_transient_error(error):
+    return getattr(error, "code", None) in TRANSIENT_STATUS_CODES
+
+
+def backoff_delay(attempt, base=LLM_RETRY_BASE_SECONDS, cap=LLM_RETRY_MAX_SECONDS):
+    # Full jitter: uniform over [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
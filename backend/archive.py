@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+# Conversations idle for this many days have their messages moved out of
+# the messages table into one compressed row each; 0 turns archiving off
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "6"))
+
+
+def pack_messages(messages):
+    # messages: rows with id, role, content and created_at, oldest first
+    payload = [
+        [msg.id, msg.role, msg.content, msg.created_at.isoformat() if msg.created_at else None]
+        for msg in messages
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, ARCHIVE_COMPRESSION_LEVEL), len(raw)
+
+
+def unpack_messages(data):
+    # Inverse of pack_messages; oldest first
+    if not data:
+        return []
+    return [
+        SimpleNamespace(
+            id=msg_id, role=role, content=content,
+            created_at=datetime.fromisoformat(created_at) if created_at else None
+        )
+        for msg_id, role, content, created_at in json.loads(zlib.decompress(data))
+    ]
+
+
+class ArchiveWorker:
+    # Runs archive_batch(after_id) in a background task until it returns
+    # None, then sleeps for interval seconds and starts over. Each batch
+    # commits on its own, and which conversations need archiving is read
+    # from the database, so a run cut short by a restart or an error
+    # carries on from where it stopped next time.
+    def __init__(self, archive_batch, interval=ARCHIVE_INTERVAL_SECONDS,
+                 enabled=ARCHIVE_AFTER_DAYS > 0, initial_delay=60.0):
+        self.archive_batch = archive_batch
+        self.interval = interval
+        self.enabled = enabled
+        self.initial_delay = initial_delay
+        self._task = None
+        self.stats = {
+            "runs": 0, "batches": 0, "conversations": 0, "messages": 0, "raw_bytes": 0,
+            "compressed_bytes": 0, "errors": 0, "last_run_seconds": 0.0
+        }
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Archiving conversations idle for {ARCHIVE_AFTER_DAYS} days every {self.interval}s")
+
+    async def _run(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Archive run failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        started_at = time.perf_counter()
+        after_id = 0
+        while True:
+            result = await self.archive_batch(after_id)
+            if result is None:
+                break
+            after_id, archived = result
+            self.stats["batches"] += 1
+            for key, value in archived.items():
+                self.stats[key] += value
+        self.stats["runs"] += 1
+        self.stats["last_run_seconds"] = time.perf_counter() - started_at
+
+    async def close(self):
+        # A batch cut off here rolls back and is redone on the next run
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "interval_seconds": self.interval,
+            **self.stats
+        }
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Load test for the backend with the offline Gemini and Stream stand-ins.
+#
+#   python bench.py --requests 500 --concurrency 50
+#   python bench.py --database-url postgresql://localhost/ai_coach_bench --users 2000 --seed-messages 40
+#   python bench.py --scenarios chat --llm-latency-ms 800 --llm-error-rate 0.02 --fail-p95-ms 1500
+#
+# Runs the app in-process through httpx's ASGI transport, against a
+# seeded SQLite file by default or any DATABASE_URL. Pass --url to drive an
+# already running server instead (started with FAKE_BACKENDS=true).
+
+SCENARIOS = ["chat", "token", "channel", "memory"]
+BENCH_DATABASE_URL = "sqlite:///./bench.db"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AI coach backend with fake Gemini and Stream backends")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", BENCH_DATABASE_URL))
+    parser.add_argument("--users", type=int, default=100, help="users in the seeded dataset")
+    parser.add_argument("--conversations", type=int, default=3, help="conversations per seeded user")
+    parser.add_argument("--seed-messages", type=int, default=20, help="messages per seeded conversation")
+    parser.add_argument("--no-seed", action="store_true", help="use the database as it is")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--stream-latency-ms", type=float, default=40)
+    parser.add_argument("--stream-jitter-ms", type=float, default=10)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--check-plans", action="store_true", help="fail if hot queries don't use their indexes")
+    parser.add_argument("--fail-p95-ms", type=float, help="exit non-zero if any scenario's p95 is above this")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    # Must run before main is imported; main reads these at import time
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["FAKE_BACKENDS"] = "true"
+    os.environ["FAKE_GEMINI_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["FAKE_GEMINI_JITTER_MS"] = str(args.llm_jitter_ms)
+    os.environ["FAKE_GEMINI_ERROR_RATE"] = str(args.llm_error_rate)
+    os.environ["FAKE_STREAM_LATENCY_MS"] = str(args.stream_latency_ms)
+    os.environ["FAKE_STREAM_JITTER_MS"] = str(args.stream_jitter_ms)
+    os.environ["FAKE_STREAM_ERROR_RATE"] = str(args.stream_error_rate)
+    # Load comes from a few simulated users; per-user rate limits would turn
+    # most of it away. Set CHAT_RATE_PER_USER to benchmark with them on.
+    os.environ.setdefault("CHAT_RATE_PER_USER", "0")
+
+
+def bench_user_id(index):
+    return f"bench_user_{index}"
+
+
+def seed_dataset(main, args):
+    # Users with a few conversations each, written in bulk straight through
+    # the engine. Rerunning replaces the previous bench rows.
+    from sqlalchemy import or_, select
+    from fingerprint import simhash
+
+    engine = main.engine
+    users = main.UserModel.__table__
+    conversations = main.ConversationModel.__table__
+    messages = main.MessageModel.__table__
+    archives = main.ConversationArchiveModel.__table__
+    channels = main.ChannelModel.__table__
+    claims = main.TurnClaimModel.__table__
+    user_ids = [bench_user_id(i) for i in range(args.users)]
+    started_at = time.perf_counter()
+    now = datetime.utcnow()
+
+    with engine.begin() as conn:
+        old_conversations = [row[0] for row in conn.execute(
+            select(conversations.c.id).where(conversations.c.user_id.in_(user_ids))
+        )] if user_ids else []
+        # Children first, for databases that enforce the foreign keys
+        for chunk in _chunks(old_conversations, 500):
+            conn.execute(messages.delete().where(messages.c.conversation_id.in_(chunk)))
+            conn.execute(archives.delete().where(archives.c.conversation_id.in_(chunk)))
+            conn.execute(claims.delete().where(claims.c.conversation_id.in_(chunk)))
+            conn.execute(conversations.delete().where(conversations.c.id.in_(chunk)))
+        for chunk in _chunks(user_ids, 500):
+            conn.execute(channels.delete().where(or_(channels.c.learner_id.in_(chunk), channels.c.coach_id.in_(chunk))))
+            conn.execute(users.delete().where(users.c.id.in_(chunk)))
+
+        conn.execute(users.insert(), [
+            {"id": user_id, "name": f"Bench User {i}", "role": "learner",
+             "goals": ["learn python", "run a marathon"], "preferences": {"tone": "friendly"}, "created_at": now}
+            for i, user_id in enumerate(user_ids)
+        ])
+        for user_id in user_ids:
+            for c in range(args.conversations):
+                conversation_id = conn.execute(conversations.insert().values(
+                    user_id=user_id, channel_id=f"bench-channel-{c}", created_at=now, updated_at=now
+                )).inserted_primary_key[0]
+                rows = []
+                for m in range(args.seed_messages):
+                    role = "user" if m % 2 == 0 else "assistant"
+                    content = f"{role} message {m} about topic {random.randint(0, 50)} in conversation {c}"
+                    rows.append({
+                        "conversation_id": conversation_id, "role": role, "content": content,
+                        "fingerprint": simhash(content),
+                        "created_at": now - timedelta(minutes=args.seed_messages - m)
+                    })
+                if rows:
+                    conn.execute(messages.insert(), rows)
+
+    return {
+        "users": len(user_ids),
+        "conversations": len(user_ids) * args.conversations,
+        "messages": len(user_ids) * args.conversations * args.seed_messages,
+        "seconds": time.perf_counter() - started_at,
+    }
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def make_request(scenario, n, args):
+    # (method, path, params, json body) for the nth request of a scenario
+    user_id = bench_user_id(random.randrange(max(1, args.users)))
+    if scenario == "chat":
+        body = {
+            "user_id": user_id,
+            "message": f"How should I practise topic {n}?",
+            "channel_id": f"bench-channel-{random.randrange(max(1, args.conversations))}",
+        }
+        return "POST", "/chat/message/", None, body
+    if scenario == "token":
+        return "POST", "/chat/token/", {"user_id": user_id}, None
+    if scenario == "channel":
+        return "POST", "/chat/channel/", {"learner_id": user_id, "coach_id": "ai_coach_1"}, None
+    if scenario == "memory":
+        return "GET", f"/memory/{user_id}", None, None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(scenario, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "scenario": scenario,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+async def drive(client, scenario, requests, args, first=0):
+    # Sends requests from a shared counter with args.concurrency workers;
+    # returns (latencies of successful requests, error count)
+    counter = iter(range(first, first + requests))
+    latencies = []
+    errors = [0]
+
+    async def worker():
+        for n in counter:
+            method, path, params, body = make_request(scenario, n, args)
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started_at)
+            else:
+                errors[0] += 1
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return latencies, errors[0]
+
+
+async def run_scenario(client, scenario, args):
+    if args.warmup:
+        await drive(client, scenario, args.warmup, args)
+    started_at = time.perf_counter()
+    latencies, errors = await drive(client, scenario, args.requests, args, first=args.warmup)
+    return summarize(scenario, latencies, errors, time.perf_counter() - started_at)
+
+
+async def run_benchmark(args, app=None):
+    import httpx
+
+    if app is not None:
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+    else:
+        transport = None
+        base_url = args.url
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, limits=limits) as client:
+        for scenario in args.scenarios.split(","):
+            results.append(await run_scenario(client, scenario.strip(), args))
+    return results
+
+
+async def run_in_process(main, args):
+    # Run the app's startup and shutdown hooks around the benchmark
+    async with main.app.router.lifespan_context(main.app):
+        results = await run_benchmark(args, app=main.app)
+        stats = {
+            "llm": await main.get_llm_stats(),
+            "db": await main.get_db_stats(),
+        }
+    return results, stats
+
+
+def print_results(results):
+    header = f"{'scenario':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<10}{r['requests']:>10}{r['errors']:>8}{r['throughput_rps']:>10.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}"
+        )
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    report = {"config": vars(args)}
+
+    if args.url:
+        results = asyncio.run(run_benchmark(args))
+    else:
+        configure_environment(args)
+        import main
+        # main turns on debug logging; keep the benchmark output readable
+        logging.disable(logging.INFO)
+
+        main.setup_schema()
+        if args.check_plans:
+            from migrations import check_query_plans
+            failures = check_query_plans(main.engine)
+            report["plan_failures"] = [name for name, _ in failures]
+            for name, plan in failures:
+                print(f"Query plan check failed for {name}:\n{plan}", file=sys.stderr)
+            if failures:
+                return 1
+        if not args.no_seed:
+            report["dataset"] = seed_dataset(main, args)
+        results, report["stats"] = asyncio.run(run_in_process(main, args))
+
+    report["results"] = results
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        if "dataset" in report:
+            d = report["dataset"]
+            print(f"Seeded {d['users']} users, {d['conversations']} conversations, {d['messages']} messages in {d['seconds']:.1f}s")
+        print_results(results)
+
+    if args.fail_p95_ms is not None:
+        slow = [r["scenario"] for r in results if r["p95_ms"] > args.fail_p95_ms]
+        if slow:
+            print(f"p95 above {args.fail_p95_ms} ms: {', '.join(slow)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,53 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    # Stands in for an API client that is built on first use instead of at
+    # import time. Attribute access is forwarded to the real client, so
+    # callers use it exactly like the client itself. Building can block, so
+    # async code calls get() on the threadpool first. A failed build is
+    # retried on the first use after retry_seconds; until then get() fails
+    # at once with the same error.
+    def __init__(self, name, factory, retry_seconds=30.0):
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        self._failed_at = None
+        self.retry_seconds = retry_seconds
+        self.status = "pending"
+        self.error = None
+        self.init_seconds = None
+
+    def get(self):
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                started_at = time.perf_counter()
+                if self._failed_at is not None and started_at - self._failed_at < self.retry_seconds:
+                    raise RuntimeError(f"{self._name} client is not initialized: {self.error}")
+                try:
+                    self._client = self._factory()
+                except Exception as e:
+                    self._failed_at = time.perf_counter()
+                    self.status = "error"
+                    self.error = str(e)
+                    logger.error(f"Error initializing {self._name} client: {str(e)}")
+                    raise
+                self.init_seconds = time.perf_counter() - started_at
+                self.status = "ready"
+                self.error = None
+                logger.info(f"{self._name} client initialized in {self.init_seconds:.3f}s")
+            return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def snapshot(self):
+        return {"status": self.status, "error": self.error, "init_seconds": self.init_seconds}
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+def advisory_lock_key(*parts):
+    # Signed 64-bit key for pg_advisory_xact_lock
+    digest = hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def message_digest(normalized_text):
+    # Identifies identical messages in turn claims
+    return hashlib.blake2b(normalized_text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ConversationGate:
+    # Serializes turns per conversation within this worker and lets
+    # identical in-flight requests share one result. Across workers, turns
+    # are serialized and shared through a claim row in the database (see
+    # TurnClaimModel in main.py); this gate keeps requests to one worker
+    # from polling it.
+    def __init__(self):
+        self._locks = {}
+        self._in_flight = {}
+        self.stats = {"turns": 0, "waited": 0, "coalesced": 0}
+
+    async def serialize(self, key, run):
+        # Runs the async callable with conversation `key` locked in this worker
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            self.stats["waited"] += 1
+        try:
+            async with entry[0]:
+                return await run()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def _finished(self, request_key, task):
+        if self._in_flight.get(request_key) is task:
+            del self._in_flight[request_key]
+        if not task.cancelled():
+            # Marks the error as retrieved when every waiter has gone
+            task.exception()
+
+    async def run(self, key, request_key, run):
+        # run is an async callable for one turn of conversation `key`;
+        # concurrent calls with the same request_key get the same result
+        task = self._in_flight.get(request_key)
+        if task is None:
+            self.stats["turns"] += 1
+            task = asyncio.ensure_future(self.serialize(key, run))
+            self._in_flight[request_key] = task
+            task.add_done_callback(lambda done: self._finished(request_key, done))
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded so a disconnecting client doesn't cancel the turn for
+        # the requests sharing it
+        return await asyncio.shield(task)
+
+    def snapshot(self):
+        return {
+            "locked_conversations": len(self._locks),
+            "in_flight": len(self._in_flight),
+            **self.stats
+        }
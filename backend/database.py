@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings, shared by the sync and async engines
+DB_ASYNC = os.getenv("DB_ASYNC", "true").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Connections opened at startup so the first requests don't pay for them
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))
+
+# Drivers used for the async engine, by sync URL scheme
+ASYNC_DRIVERS = {
+    "postgresql": ("postgresql+asyncpg", "asyncpg"),
+    "sqlite": ("sqlite+aiosqlite", "aiosqlite"),
+}
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self):
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+        }
+
+
+pool_stats = PoolStats()
+
+
+def _timed(pool_class):
+    # Times how long each checkout waits for a free connection
+    class TimedPool(pool_class):
+        def _do_get(self):
+            started_at = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except Exception:
+                pool_stats.record(time.perf_counter() - started_at, timed_out=True)
+                raise
+            pool_stats.record(time.perf_counter() - started_at)
+            return connection
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+TimedQueuePool = _timed(QueuePool)
+TimedAsyncAdaptedQueuePool = _timed(AsyncAdaptedQueuePool)
+
+
+def engine_options(url, use_async=False):
+    options = {
+        "poolclass": TimedAsyncAdaptedQueuePool if use_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.startswith("sqlite") and not use_async:
+        # Sessions are used from threadpool workers
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def async_database_url(url):
+    # Returns the async driver URL, or None when async mode is off or the
+    # driver isn't installed
+    if not DB_ASYNC:
+        return None
+    scheme, rest = url.split("://", 1)
+    base_scheme = scheme.split("+", 1)[0]
+    if base_scheme not in ASYNC_DRIVERS:
+        return None
+    async_scheme, module = ASYNC_DRIVERS[base_scheme]
+    try:
+        __import__(module)
+    except ImportError:
+        logger.warning(f"{module} is not installed, using sync database sessions on the threadpool")
+        return None
+    return f"{async_scheme}://{rest}"
+
+
+def create_async_sessions(url):
+    # Returns (async_engine, session_factory), or (None, None) to fall back
+    # to sync sessions
+    async_url = async_database_url(url)
+    if not async_url:
+        return None, None
+    try:
+        # Needs greenlet, which isn't available on every platform
+        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+    except ImportError as e:
+        logger.warning(f"SQLAlchemy asyncio support unavailable ({str(e)}), using sync database sessions")
+        return None, None
+
+    async_engine = create_async_engine(async_url, **engine_options(async_url, use_async=True))
+    session_factory = sessionmaker(
+        bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+    logger.info(f"Using async database sessions ({async_url.split('://', 1)[0]})")
+    return async_engine, session_factory
+
+
+async def run_db(db, fn, *args, **kwargs):
+    # Runs sync session code without blocking the event loop: through the
+    # async driver when db is an AsyncSession, otherwise on the threadpool
+    if hasattr(db, "run_sync"):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def warm_pool(engine, connections=DB_POOL_WARM):
+    # Opens up to `connections` pooled connections at once and returns them
+    # to the pool. Works with a sync or an async engine; raises if the
+    # database is unreachable.
+    if hasattr(engine, "sync_engine"):
+        async def check():
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+    else:
+        def check_sync():
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+
+        async def check():
+            await run_in_threadpool(check_sync)
+
+    await asyncio.gather(*(check() for _ in range(max(1, connections))))
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    return status
@@ -0,0 +1,129 @@
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Offline stand-ins for the Gemini and Stream Chat clients, for load tests
+# and local runs without credentials. Each call sleeps for a sampled
+# latency and fails at a configurable rate, so the server's concurrency
+# limits and fallbacks see realistic timings.
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+class InjectedFailure(RuntimeError):
+    # Carries a 503 like google.api_core's ServiceUnavailable, so injected
+    # failures are retried and counted by the breaker like real outages
+    code = 503
+
+
+class LatencyProfile:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, prefix, latency_ms="0", jitter_ms="0", error_rate="0"):
+        # e.g. FAKE_GEMINI_LATENCY_MS, FAKE_GEMINI_JITTER_MS, FAKE_GEMINI_ERROR_RATE
+        return cls(
+            latency_ms=_env_float(f"{prefix}_LATENCY_MS", latency_ms),
+            jitter_ms=_env_float(f"{prefix}_JITTER_MS", jitter_ms),
+            error_rate=_env_float(f"{prefix}_ERROR_RATE", error_rate),
+        )
+
+    def sample(self):
+        # Returns (seconds to sleep, whether the call fails)
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            failed = self._random.random() < self.error_rate
+        return max(0.0, delay) / 1000.0, failed
+
+    def wait(self, operation):
+        delay, failed = self.sample()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise InjectedFailure(f"Injected {operation} failure")
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    # Mimics genai.GenerativeModel.generate_content for the calls llm.py makes
+    def __init__(self, profile=None, chunks=4):
+        self.profile = profile or LatencyProfile.from_env("FAKE_GEMINI", latency_ms="300", jitter_ms="100")
+        self.chunks = chunks
+        self.calls = 0
+
+    def _reply(self, contents):
+        question = contents.rsplit("User's latest question:", 1)[-1].split("\n", 2)[0].strip()
+        return f"Here is a short answer about {question or 'that'}. Start small and practise every day."
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        self.calls += 1
+        if not stream:
+            self.profile.wait("Gemini")
+            return FakeResponse(self._reply(contents))
+        return self._stream(contents)
+
+    def _stream(self, contents):
+        # Latency spread across chunks, so the first token arrives early
+        delay, failed = self.profile.sample()
+        words = self._reply(contents).split(" ")
+        size = max(1, len(words) // self.chunks)
+        for start in range(0, len(words), size):
+            time.sleep(delay / self.chunks)
+            if failed and start:
+                raise InjectedFailure("Injected Gemini failure")
+            yield FakeResponse(" ".join(words[start:start + size]) + " ")
+
+
+class FakeChannel:
+    def __init__(self, client, channel_type, channel_id, data=None):
+        self.client = client
+        self.channel_type = channel_type
+        self.id = channel_id
+        self.data = data or {}
+
+    def create(self, user_id):
+        self.client.profile.wait("Stream channel create")
+        self.client.channels[self.id] = self.data
+        return {"channel": {"id": self.id, "type": self.channel_type, "created_by": {"id": user_id}}}
+
+
+class FakeStreamChat:
+    # Mimics the parts of stream_chat.StreamChat the backend uses
+    def __init__(self, profile=None):
+        self.profile = profile or LatencyProfile.from_env("FAKE_STREAM", latency_ms="40", jitter_ms="10")
+        self.users = {}
+        self.channels = {}
+
+    def upsert_user(self, user):
+        return self.upsert_users([user])
+
+    def upsert_users(self, users):
+        self.profile.wait("Stream upsert")
+        for user in users:
+            self.users[user["id"]] = user
+        return {"users": {user["id"]: user for user in users}}
+
+    def create_token(self, user_id, exp=None, iat=None):
+        # Unsigned, token-shaped; only good against this fake
+        payload = base64.urlsafe_b64encode(json.dumps({"user_id": user_id}).encode("utf-8")).decode("ascii")
+        return f"fake.{payload.rstrip('=')}.unsigned"
+
+    def channel(self, channel_type, channel_id=None, data=None):
+        return FakeChannel(self, channel_type, channel_id, data)
@@ -0,0 +1,68 @@
+import hashlib
+import re
+
+import numpy as np
+
+# Near-duplicate detection for chat messages. Each message gets a 64-bit
+# SimHash over its word shingles when it is written, so spotting a
+# repeated reply is a popcount on two stored integers instead of a string
+# comparison on every turn.
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+# Replies whose fingerprints differ in at most this many bits count as repeats
+NEAR_DUPLICATE_DISTANCE = 3
+
+_MASK = (1 << FINGERPRINT_BITS) - 1
+_WORD = re.compile(r"\w+")
+
+# Phrases that show the user is echoing the coach back, matched in one pass
+LOOP_PHRASES = [
+    "AI coach", "support you", "dive into", "let's focus", "break the cycle",
+    "What specific", "what you're hoping", "I'm here to help",
+]
+_LOOP_PHRASE_PATTERN = re.compile("|".join(re.escape(phrase) for phrase in LOOP_PHRASES), re.IGNORECASE)
+
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+
+
+_BIT_POSITIONS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+
+def simhash(text):
+    # Returned as a signed 64-bit integer so it fits a BIGINT column. The
+    # per-bit votes are counted with numpy, since this runs on every save.
+    shingles = _shingles(text or "")
+    if not shingles:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    ones = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).sum(axis=0)
+    # A bit is set when more shingles have it set than not
+    bits = (2 * ones > len(shingles)).astype(np.uint64) << _BIT_POSITIONS
+    return int(np.bitwise_or.reduce(bits).astype(np.int64))
+
+
+def message_fingerprint(message):
+    # Stored fingerprint, or computed for rows written before the column existed
+    fingerprint = getattr(message, "fingerprint", None)
+    return fingerprint if fingerprint is not None else simhash(message.content)
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & _MASK).count("1")
+
+
+def is_near_duplicate(a, b, max_distance=NEAR_DUPLICATE_DISTANCE):
+    return hamming_distance(a, b) <= max_distance
+
+
+def loop_phrases(text):
+    return {match.lower() for match in _LOOP_PHRASE_PATTERN.findall(text or "")}
@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+# Low levels compress JSON nearly as well as 9 at a fraction of the CPU
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+
+try:
+    # Optional; several times faster than json.dumps on large payloads
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def make_etag(*parts):
+    # Weak, since the same entity may be sent gzipped or not
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def http_date(dt):
+    # dt is naive UTC, as stored
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def not_modified(request, etag, last_modified=None):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison: W/"x" matches "x"
+        return "*" in tags or etag.lstrip("W/") in (tag.lstrip("W/") for tag in tags)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+def json_response(request, payload, headers=None, status_code=200):
+    # Serializes once, straight to bytes, skipping FastAPI's encoder pass
+    body = dump_json(payload)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
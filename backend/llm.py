@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import llm_seconds, llm_output_chars
+from admission import CircuitBreaker, is_transient_error, backoff_delay, LLM_RETRY_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Concurrency settings for outbound LLM calls
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "100"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+# Callers waiting for a slot beyond this are turned away at once
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+
+GENERATION_CONFIG = {
+    "max_output_tokens": 1000,
+    "temperature": 0.7,
+    "top_p": 0.9
+}
+
+
+_STREAM_DONE = object()
+
+
+class LLMBusyError(Exception):
+    pass
+
+
+class LLMTimeoutError(Exception):
+    pass
+
+
+class LLMUnavailableError(LLMBusyError):
+    # The circuit breaker is open
+    pass
+
+
+class LLMGate:
+    # Runs blocking SDK calls on a dedicated thread pool so the event loop
+    # stays free, and bounds how many of them may be in flight at once.
+    # Calls are refused up front when max_queue callers are already waiting
+    # or the circuit breaker is open.
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT_SECONDS,
+                 queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS, max_queue=LLM_MAX_QUEUE, breaker=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        # Created lazily so it binds to the running loop
+        self._semaphore = None
+        self.stats = {
+            "in_flight": 0,
+            "waiting": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "queue_timeouts": 0,
+            "shed": 0,
+            "short_circuited": 0,
+            "retries": 0,
+            "queue_wait_seconds_total": 0.0,
+            "call_seconds_total": 0.0,
+        }
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _acquire(self):
+        semaphore = self._get_semaphore()
+        if self.stats["waiting"] >= self.max_queue:
+            self.stats["shed"] += 1
+            raise LLMBusyError(f"{self.stats['waiting']} LLM calls already waiting")
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise LLMUnavailableError("LLM circuit breaker is open")
+
+        # Wait for a free slot, but never longer than the queue timeout
+        self.stats["waiting"] += 1
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["queue_timeouts"] += 1
+            raise LLMBusyError(f"No LLM slot free after {self.queue_timeout}s")
+        finally:
+            self.stats["waiting"] -= 1
+            self.stats["queue_wait_seconds_total"] += time.perf_counter() - queued_at
+        return semaphore
+
+    def _submit(self, semaphore, fn):
+        # The slot is held until the executor thread returns, not until the
+        # caller stops waiting: a timed out SDK call keeps its thread busy,
+        # and admitting another call in its place would only queue it
+        # behind the stuck one
+        loop = asyncio.get_running_loop()
+
+        def _release():
+            self.stats["in_flight"] -= 1
+            semaphore.release()
+
+        def _finished(_):
+            try:
+                loop.call_soon_threadsafe(_release)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+        self.stats["in_flight"] += 1
+        try:
+            future = self._executor.submit(fn)
+        except Exception:
+            _release()
+            raise
+        future.add_done_callback(_finished)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        semaphore = await self._acquire()
+
+        started_at = time.perf_counter()
+        try:
+            future = self._submit(semaphore, lambda: fn(*args, **kwargs))
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            self.stats["completed"] += 1
+            self.breaker.record(True)
+            return result
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record(False)
+            raise LLMTimeoutError(f"LLM call exceeded {self.timeout}s")
+        except Exception as e:
+            self.stats["errors"] += 1
+            # Only errors that say the service is struggling count against
+            # it; a rejected request (bad prompt, safety block) got an answer
+            self.breaker.record(not is_transient_error(e))
+            raise
+        finally:
+            self.stats["call_seconds_total"] += time.perf_counter() - started_at
+
+    async def stream(self, open_stream):
+        # Iterates a blocking chunk iterator on the executor and hands each
+        # chunk back to the event loop. The timeout applies between chunks.
+        semaphore = await self._acquire()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def _put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed
+                stop.set()
+
+        def _produce():
+            try:
+                for chunk in open_stream():
+                    if stop.is_set():
+                        break
+                    _put(chunk)
+                _put(_STREAM_DONE)
+            except Exception as e:
+                _put(e)
+
+        started_at = time.perf_counter()
+        try:
+            self._submit(semaphore, _produce)
+            while True:
+                item = await asyncio.wait_for(queue.get(), timeout=self.timeout)
+                if item is _STREAM_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            self.stats["completed"] += 1
+            self.breaker.record(True)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record(False)
+            raise LLMTimeoutError(f"No LLM chunk received within {self.timeout}s")
+        except Exception as e:
+            self.stats["errors"] += 1
+            # Only errors that say the service is struggling count against
+            # it; a rejected request (bad prompt, safety block) got an answer
+            self.breaker.record(not is_transient_error(e))
+            raise
+        finally:
+            # Also reached when the consumer goes away mid-stream; the
+            # producer frees its slot once it sees stop
+            stop.set()
+            self.stats["call_seconds_total"] += time.perf_counter() - started_at
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def snapshot(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "queue_timeout_seconds": self.queue_timeout,
+            "max_queue": self.max_queue,
+            **self.stats,
+            "breaker": self.breaker.snapshot()
+        }
+
+
+llm_gate = LLMGate()
+
+
+async def generate_text(client, prompt):
+    if client is None:
+        raise ValueError("Gemini client is not initialized")
+
+    def _call():
+        response = client.generate_content(
+            contents=prompt,
+            generation_config=GENERATION_CONFIG
+        )
+        return response.text
+
+    started_at = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            text = await llm_gate.run(_call)
+            break
+        except Exception as e:
+            # Timeouts aren't retried: the timed out call still holds its slot
+            if attempt < LLM_RETRY_ATTEMPTS and is_transient_error(e):
+                llm_gate.stats["retries"] += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            llm_seconds.observe(time.perf_counter() - started_at, ("generate", "error"))
+            raise
+    llm_seconds.observe(time.perf_counter() - started_at, ("generate", "ok"))
+    llm_output_chars.observe(len(text or ""), ("generate",))
+    return text
+
+
+async def stream_text(client, prompt):
+    if client is None:
+        raise ValueError("Gemini client is not initialized")
+
+    def _open_stream():
+        response = client.generate_content(
+            contents=prompt,
+            generation_config=GENERATION_CONFIG,
+            stream=True
+        )
+        for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
+
+    started_at = time.perf_counter()
+    size = 0
+    outcome = "error"
+    attempt = 0
+    try:
+        while True:
+            try:
+                async for text in llm_gate.stream(_open_stream):
+                    size += len(text)
+                    yield text
+                break
+            except Exception as e:
+                # Only retried before anything has reached the client
+                if not size and attempt < LLM_RETRY_ATTEMPTS and is_transient_error(e):
+                    llm_gate.stats["retries"] += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                raise
+        outcome = "ok"
+    finally:
+        # Streams the client abandoned count as errors
+        llm_seconds.observe(time.perf_counter() - started_at, ("stream", outcome))
+        llm_output_chars.observe(size, ("stream",))
@@ -1,18 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from stream_chat import StreamChat
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List, Dict, Any
 import os
+import time
+import asyncio
+import anyio
 from dotenv import load_dotenv
 import logging
-import google.generativeai as genai
 import re
 import json
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, JSON
-from sqlalchemy.dialects.postgresql import JSONB
+import base64
+import math
+import uuid
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, JSON, LargeBinary, Index, func, case, and_, or_, bindparam, text, exists, select, distinct
+from sqlalchemy.dialects.postgresql import JSONB, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from collections import Counter
+from contextlib import asynccontextmanager
+from llm import llm_gate, generate_text, stream_text
+from migrations import run_migrations, get_schema_version, build_search_index, LATEST_SCHEMA_VERSION
+from response_cache import response_cache, make_cache_key, normalize_text
+from registry import ProvisionRegistry, KNOWN_CHANNEL_CACHE_SIZE
+from admission import RateLimiter, backoff_delay
+from coalescing import ConversationGate, advisory_lock_key, message_digest
+from write_behind import WriteBehindQueue
+from prompt_builder import build_prompt, build_summary_prompt
+from retrieval import memory_index, RETRIEVAL_MAX_MESSAGES
+from fingerprint import simhash, message_fingerprint, is_near_duplicate, loop_phrases
+from database import engine_options, create_async_sessions, run_db, pool_stats, pool_status, warm_pool, DB_POOL_WARM
+from clients import LazyClient
+from metrics import MetricsMiddleware, stage, instrument_engine, register_collector, render_metrics
+from search import search_messages, format_snippet
+from http_cache import make_etag, http_date, not_modified, json_response
+from archive import ArchiveWorker, pack_messages, unpack_messages, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -37,8 +64,18 @@ if SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("postgres://")
 # Determine if we're using SQLite
 is_sqlite = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# The sync engine handles schema setup, and requests when no async driver
+# is available. Pool settings come from DB_POOL_* env vars (see database.py).
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Requests use the async engine (asyncpg / aiosqlite) when it's available
+async_engine, AsyncSessionLocal = create_async_sessions(SQLALCHEMY_DATABASE_URL)
+
+# Count queries per request on both engines
+instrument_engine(engine, "sync")
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
 Base = declarative_base()
 
 # Helper functions for JSON in SQLite
@@ -69,34 +106,193 @@ class UserModel(Base):
 
 class ConversationModel(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # One conversation per channel; also what concurrent creators race on
+        Index("ux_conversations_user_channel", "user_id", "channel_id", unique=True),
+        Index("ix_conversations_user_updated", "user_id", "updated_at"),
+        Index("ix_conversations_updated", "updated_at"),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(String, ForeignKey("users.id"))
     channel_id = Column(String)
+    # Rolling summary of every message up to and including summarized_through_id
+    summary = Column(Text, nullable=True)
+    summarized_through_id = Column(Integer, nullable=True)
+    # Set once older messages have been moved to conversation_archives
+    archived_through_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class ConversationArchiveModel(Base):
+    __tablename__ = "conversation_archives"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), primary_key=True)
+    message_count = Column(Integer)
+    # History previews, so listing conversations never decompresses data
+    title = Column(String, nullable=True)
+    last_message = Column(JSON, nullable=True)
+    # zlib-compressed JSON list of the archived messages, oldest first
+    data = Column(LargeBinary)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ChannelModel(Base):
+    __tablename__ = "channels"
+    
+    # Stream channel ID, coach-{coach_id}-learner-{learner_id}
+    id = Column(String, primary_key=True)
+    learner_id = Column(String, ForeignKey("users.id"))
+    # No foreign key: only the AI coach is provisioned in users, other
+    # coaches exist in Stream alone
+    coach_id = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class MessageModel(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+        # Ids are high-water marks (summaries, archives, retrieval, memory
+        # sync), so SQLite must never hand out a deleted one again
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     role = Column(String)  # "user" or "assistant"
     content = Column(Text)
+    # SimHash of the content, computed once at write time for loop detection
+    fingerprint = Column(BigInteger, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+class TurnClaimModel(Base):
+    __tablename__ = "turn_claims"
+
+    # The chat turn in progress in each conversation, whichever worker runs
+    # it. Keyed on the conversation, so only one turn of it runs at a time
+    # across workers; an identical message sent meanwhile waits for this
+    # turn's reply instead of calling the LLM again. Finished claims are
+    # taken over by the next turn.
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), primary_key=True)
+    message_hash = Column(String)
+    # Identifies one claim, so a turn only finishes or releases its own
+    token = Column(String)
+    started_at = Column(DateTime)
+    # Set with the reply once the turn is saved
+    completed_at = Column(DateTime, nullable=True)
+    response = Column(Text, nullable=True)
+
+def setup_schema():
+    # Create tables, then bring existing databases up to the current schema.
+    # Once a database is current this is a single query, so only the first
+    # worker after a deploy does the real work. New tables need a migration
+    # entry too (even an empty one) so create_all runs on existing databases.
+    if get_schema_version(engine) >= LATEST_SCHEMA_VERSION:
+        return []
+    Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
+# Session for one unit of work. DB code is written against the sync
+# Session API and run through run_db, so it works with either engine.
+@asynccontextmanager
+async def db_session():
+    if AsyncSessionLocal:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with db_session() as db:
         yield db
-    finally:
-        db.close()
 
-app = FastAPI()
+def commit_session(db: Session):
+    db.commit()
+
+# /ready re-checks the database at most this often, so a probe notices an
+# outage (and the recovery) without a query on every call
+READY_DB_CHECK_SECONDS = float(os.getenv("READY_DB_CHECK_SECONDS", "5"))
+READY_DB_CHECK_TIMEOUT_SECONDS = float(os.getenv("READY_DB_CHECK_TIMEOUT_SECONDS", "2"))
+
+class Readiness:
+    def __init__(self):
+        self.schema = False
+        self.database = None
+        self.database_checked_at = None
+        self.warmed_up = False
+        self.started_at = time.perf_counter()
+        self.ready_seconds = None
+
+readiness = Readiness()
+
+async def warm_up():
+    # Runs after the app has started serving: brings the schema up to date,
+    # builds the API clients concurrently and opens pooled connections ahead
+    # of the first requests
+    async def init_client(client):
+        if isinstance(client, LazyClient):
+            try:
+                await run_in_threadpool(client.get)
+            except Exception:
+                pass
+
+    async def check_database():
+        # Retried with backoff, so a database that comes up after the app
+        # still gets its schema checked and pool warmed, and /ready turns green
+        attempt = 0
+        while True:
+            try:
+                if not readiness.schema:
+                    applied = await run_in_threadpool(setup_schema)
+                    if applied:
+                        logger.info(f"Applied schema migrations {applied}")
+                    readiness.schema = True
+                    run_in_background(finish_search_index())
+                    archive_worker.start()
+                await warm_pool(async_engine or engine, DB_POOL_WARM)
+                readiness.database = "ok"
+                readiness.database_checked_at = time.perf_counter()
+                return
+            except Exception as e:
+                readiness.database = f"error: {str(e)}"
+                logger.error(f"Database warm-up failed (attempt {attempt + 1}): {str(e)}")
+            await asyncio.sleep(backoff_delay(attempt, base=1.0, cap=30.0))
+            attempt += 1
+
+    await asyncio.gather(init_client(stream_client), init_client(gemini_client), check_database())
+    readiness.warmed_up = True
+    readiness.ready_seconds = time.perf_counter() - readiness.started_at
+    logger.info(f"Warm-up finished {readiness.ready_seconds:.3f}s after startup")
+
+async def finish_search_index():
+    # Fills in search vectors and builds the Postgres search index (see
+    # build_search_index) while the app serves; retried on the next start
+    # if it fails
+    try:
+        await run_in_threadpool(build_search_index, engine)
+    except Exception as e:
+        logger.error(f"Building the message search index failed: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing here touches the database, so the app starts serving (and
+    # /ready reports why it isn't ready) even while the database is down
+    message_writer.start()
+    warm_up_task = asyncio.ensure_future(warm_up())
+    yield
+    warm_up_task.cancel()
+    await archive_worker.close()
+    # Flush buffered messages before anything they depend on goes away
+    await message_writer.close()
+    llm_gate.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware configuration
 app.add_middleware(
@@ -105,45 +301,95 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Request latency, per-stage timings and query counts for /metrics
+app.add_middleware(MetricsMiddleware)
 
-# Add a root endpoint for health checks
+# Add a root endpoint for health checks (liveness; no dependencies touched)
 @app.get("/")
 async def root():
     return {"status": "OK", "message": "AI Coach Backend is running"}
 
-# Initialize StreamChat client
-try:
+# Readiness: the schema is current, the database answers and warm-up is done.
+# Clients that failed to initialize show up as "degraded" but don't block
+# traffic, since chat falls back without them.
+async def check_database_live():
+    # One SELECT 1 through the pool, at most every READY_DB_CHECK_SECONDS
+    now = time.perf_counter()
+    if readiness.database_checked_at is not None and now - readiness.database_checked_at < READY_DB_CHECK_SECONDS:
+        return
+    readiness.database_checked_at = now
+    try:
+        await asyncio.wait_for(warm_pool(async_engine or engine, 1), timeout=READY_DB_CHECK_TIMEOUT_SECONDS)
+        readiness.database = "ok"
+    except Exception as e:
+        if readiness.database == "ok":
+            logger.error(f"Database readiness check failed: {str(e) or type(e).__name__}")
+        readiness.database = f"error: {str(e) or type(e).__name__}"
+
+@app.get("/ready")
+async def ready():
+    if readiness.warmed_up:
+        await check_database_live()
+    clients = {
+        name: client.snapshot() if isinstance(client, LazyClient) else {"status": "ready"}
+        for name, client in (("stream", stream_client), ("gemini", gemini_client))
+    }
+    is_ready = readiness.schema and readiness.warmed_up and readiness.database == "ok"
+    degraded = any(client["status"] != "ready" for client in clients.values())
+    body = {
+        "status": ("degraded" if degraded else "ready") if is_ready else "starting",
+        "schema": readiness.schema,
+        "database": readiness.database,
+        "clients": clients,
+        "ready_seconds": readiness.ready_seconds
+    }
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+# FAKE_BACKENDS=true swaps in the offline Gemini and Stream stand-ins from
+# fakes.py, for load tests and local runs without credentials
+USE_FAKE_BACKENDS = os.getenv("FAKE_BACKENDS", "false").lower() in ("1", "true", "yes")
+
+# The SDKs are slow to import, so clients are built on first use or by
+# warm_up, never at import time
+def create_stream_client():
+    if USE_FAKE_BACKENDS:
+        from fakes import FakeStreamChat
+        logger.warning("FAKE_BACKENDS is set, using the offline Stream Chat stand-in")
+        return FakeStreamChat()
+
     stream_api_key = os.getenv("STREAM_API_KEY")
     stream_api_secret = os.getenv("STREAM_API_SECRET")
-    
     if not stream_api_key or not stream_api_secret:
         logger.error("Stream Chat API credentials are not set")
         raise ValueError("STREAM_API_KEY and STREAM_API_SECRET are required")
-    
-    stream_client = StreamChat(
+
+    from stream_chat import StreamChat
+    return StreamChat(
         api_key=stream_api_key,
         api_secret=stream_api_secret
     )
-    logger.info("Stream Chat client initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing Stream Chat client: {str(e)}")
-    # Continue with initialization, but Stream Chat calls will fail
-    stream_client = None
-
-# Gemini configuration
-try:
+
+def create_gemini_client():
+    if USE_FAKE_BACKENDS:
+        from fakes import FakeGeminiModel
+        logger.warning("FAKE_BACKENDS is set, using the offline Gemini stand-in")
+        return FakeGeminiModel()
+
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     if not gemini_api_key:
         logger.error("GEMINI_API_KEY environment variable is not set")
         raise ValueError("GEMINI_API_KEY is required")
-        
+
+    import google.generativeai as genai
     genai.configure(api_key=gemini_api_key)
-    gemini_client = genai.GenerativeModel('gemini-2.0-flash')
-    logger.info("Gemini API configured successfully")
-except Exception as e:
-    logger.error(f"Error configuring Gemini API: {str(e)}")
-    # Continue with initialization, but Gemini calls will fail
+    return genai.GenerativeModel('gemini-2.0-flash')
+
+stream_client = LazyClient("Stream Chat", create_stream_client)
+gemini_client = LazyClient("Gemini", create_gemini_client)
+
+FALLBACK_AI_RESPONSE = "I'm having trouble processing your request right now. Could you try asking in a different way?"
 
 class User(BaseModel):
     id: str
@@ -169,70 +415,245 @@ async def create_user(user: User, db: Session = Depends(get_db)):
             "id": user.id,
             "name": user.name
         }
-        stream_client.upsert_user(user_data)
+        await run_in_threadpool(lambda: stream_client.upsert_user(user_data))
         
         # Create user in database
-        db_user = UserModel(
-            id=user.id,
-            name=user.name,
-            role=user.role,
-            goals=[],
-            preferences={}
-        )
-        db.add(db_user)
-        db.commit()
+        await run_db(db, insert_user, user.id, user.name, user.role)
+        known_users.add(user.id)
         
         return {"message": "User created successfully"}
     except Exception as e:
         logger.error(f"Error creating user: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
+AI_COACH_ID = "ai_coach_1"
+AI_COACH_IMAGE = "https://ui-avatars.com/api/?name=AI+Coach&background=007bff&color=fff"
+
+known_users = ProvisionRegistry()
+known_channels = ProvisionRegistry(max_size=KNOWN_CHANNEL_CACHE_SIZE)
+
+def default_user_name(user_id: str) -> str:
+    # Extract name from user_id (fallback method)
+    return user_id.replace('user_', '').replace('_', ' ').title()
+
+def insert_user(db: Session, user_id: str, name: str, role: str):
+    db.add(UserModel(
+        id=user_id,
+        name=name,
+        role=role,
+        goals=[],
+        preferences={}
+    ))
+    db.commit()
+
+def create_user_if_missing(db: Session, user_id: str, name: str, role: str) -> bool:
+    # Returns True when this call created the user
+    if db.query(UserModel.id).filter(UserModel.id == user_id).first():
+        return False
+    logger.info(f"User {user_id} not found, creating automatically")
+    try:
+        insert_user(db, user_id, name, role)
+    except IntegrityError:
+        # Created concurrently by another worker
+        db.rollback()
+        return False
+    return True
+
+async def provision_user(user_id: str, name: str, role: str, image: Optional[str] = None):
+    # Creates the user in the database and Stream.io if missing. Uses its
+    # own session so it commits independently of the caller.
+    async with db_session() as db:
+        created = await run_db(db, create_user_if_missing, user_id, name, role)
+    if not created:
+        return
+
+    # Create user in Stream.io (building the client first, off the event loop)
+    await run_in_threadpool(stream_client.get)
+    user_data = {
+        "id": user_id,
+        "name": name
+    }
+    if image:
+        user_data["image"] = image
+    with stage("stream_upsert"):
+        await run_in_threadpool(stream_client.upsert_user, user_data)
+    logger.info(f"Successfully created user in Stream: {user_id}")
+
+async def ensure_user(user_id: str, name: Optional[str] = None, role: str = "learner", image: Optional[str] = None):
+    # Already-provisioned users are a dict lookup; everyone else is
+    # provisioned once, shared by concurrent callers
+    async def provision():
+        await provision_user(user_id, name or default_user_name(user_id), role, image)
+    await known_users.ensure(user_id, provision)
+
+# Bulk provisioning. Stream accepts at most 100 users per upsert_users call.
+BULK_USER_MAX = int(os.getenv("BULK_USER_MAX", "50000"))
+BULK_USER_DB_BATCH = int(os.getenv("BULK_USER_DB_BATCH", "500"))
+BULK_USER_STREAM_BATCH = 100
+BULK_USER_CONCURRENCY = int(os.getenv("BULK_USER_CONCURRENCY", "4"))
+
+def upsert_user_rows(db: Session, users: List[User]) -> Dict[str, str]:
+    # One INSERT ... ON CONFLICT for the batch; returns id -> created/updated.
+    # Goals and preferences of existing users are kept.
+    ids = [user.id for user in users]
+    existing = {row[0] for row in db.query(UserModel.id).filter(UserModel.id.in_(ids))}
+    rows = [
+        {"id": user.id, "name": user.name, "role": user.role, "goals": [], "preferences": {}}
+        for user in users
+    ]
+    insert = UPSERT_INSERTS.get(engine.dialect.name)
+    try:
+        if insert is None:
+            for row in rows:
+                if row["id"] in existing:
+                    db.query(UserModel).filter(UserModel.id == row["id"]).update(
+                        {"name": row["name"], "role": row["role"]}, synchronize_session=False
+                    )
+                else:
+                    db.add(UserModel(**row))
+        else:
+            statement = insert(UserModel.__table__)
+            db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={"name": statement.excluded.name, "role": statement.excluded.role}
+                ),
+                rows
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {user_id: "updated" if user_id in existing else "created" for user_id in ids}
+
+async def provision_user_batch(users: List[User], results: Dict[str, dict], limit: asyncio.Semaphore):
+    # Database and Stream upserts for one batch run side by side
+    async def save():
+        try:
+            async with db_session() as db:
+                for user_id, status in (await run_db(db, upsert_user_rows, users)).items():
+                    results[user_id]["status"] = status
+        except Exception as e:
+            logger.error(f"Bulk user database upsert failed: {str(e)}")
+            for user in users:
+                results[user.id].update({"status": "error", "error": str(e)})
+
+    async def sync_stream(chunk: List[User]):
+        try:
+            await run_in_threadpool(stream_client.get)
+            with stage("stream_upsert"):
+                await run_in_threadpool(stream_client.upsert_users, [{"id": u.id, "name": u.name} for u in chunk])
+            for user in chunk:
+                results[user.id]["stream"] = "ok"
+        except Exception as e:
+            logger.error(f"Bulk Stream upsert of {len(chunk)} users failed: {str(e)}")
+            for user in chunk:
+                results[user.id].update({"stream": "error", "stream_error": str(e)})
+
+    async with limit:
+        await asyncio.gather(save(), *(
+            sync_stream(users[start:start + BULK_USER_STREAM_BATCH])
+            for start in range(0, len(users), BULK_USER_STREAM_BATCH)
+        ))
+    for user in users:
+        if results[user.id].get("stream") == "ok" and results[user.id]["status"] in ("created", "updated"):
+            known_users.add(user.id)
+
+async def iter_user_records(request: Request):
+    # A JSON list, {"users": [...]}, or NDJSON with one user per line
+    # (Content-Type application/x-ndjson), read as it arrives
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+
+    body = json.loads(await request.body() or b"null")
+    if isinstance(body, dict):
+        body = body.get("users")
+    if not isinstance(body, list):
+        raise ValueError('Expected a JSON list of users or {"users": [...]}')
+    for record in body:
+        yield record
+
+@app.post("/users/bulk/")
+async def create_users_bulk(request: Request):
+    results: Dict[str, dict] = {}
+    invalid = []
+    users: List[User] = []
+    # The whole request is read and checked against BULK_USER_MAX before
+    # any user is written, so a rejected request leaves nothing half done
+    try:
+        async for record in iter_user_records(request):
+            if len(results) + len(invalid) >= BULK_USER_MAX:
+                raise HTTPException(status_code=413, detail=f"At most {BULK_USER_MAX} users per request")
+            try:
+                if isinstance(record, bytes):
+                    record = json.loads(record)
+                user = User(**record)
+            except (ValueError, TypeError, ValidationError) as e:
+                invalid.append({"id": record.get("id") if isinstance(record, dict) else None,
+                                "status": "invalid", "error": str(e)})
+                continue
+            if user.id in results:
+                invalid.append({"id": user.id, "status": "duplicate", "error": "Repeated in this request"})
+                continue
+            results[user.id] = {"id": user.id, "status": "pending", "stream": "pending"}
+            users.append(user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in bulk user import: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    limit = asyncio.Semaphore(BULK_USER_CONCURRENCY)
+    await asyncio.gather(*(
+        provision_user_batch(users[start:start + BULK_USER_DB_BATCH], results, limit)
+        for start in range(0, len(users), BULK_USER_DB_BATCH)
+    ))
+
+    # created + updated + failed adds up to total; a user whose Stream sync
+    # failed is still saved, so it is counted in stream_failed instead
+    counts = Counter(result["status"] for result in results.values())
+    return {
+        "total": len(results) + len(invalid),
+        "created": counts["created"],
+        "updated": counts["updated"],
+        "failed": counts["error"] + len(invalid),
+        "stream_failed": sum(1 for result in results.values() if result["stream"] == "error"),
+        "results": list(results.values()) + invalid
+    }
+
 @app.post("/chat/token/")
-async def get_chat_token(user_id: str, db: Session = Depends(get_db)):
+async def get_chat_token(user_id: str):
     try:
         logger.info(f"Received token request for user_id: {user_id}")
         
         # Check if user exists, create if not
-        user = db.query(UserModel).filter(UserModel.id == user_id).first()
-        if not user:
-            logger.info(f"User {user_id} not found when getting token, creating automatically")
-            # Extract name from user_id (fallback method)
-            user_name = user_id.replace('user_', '').replace('_', ' ').title()
-            
-            # Create user in database
-            user = UserModel(
-                id=user_id,
-                name=user_name,
-                role="learner",
-                goals=[],
-                preferences={}
-            )
-            db.add(user)
-            db.commit()
-            
-            # Create user in Stream.io
-            try:
-                if stream_client:
-                    user_data = {
-                        "id": user_id,
-                        "name": user_name
-                    }
-                    stream_client.upsert_user(user_data)
-                    logger.info(f"Successfully created user in Stream: {user_id}")
-                else:
-                    logger.error("Stream client is not initialized")
-                    raise ValueError("Stream client is not initialized")
-            except Exception as e:
-                logger.error(f"Error creating user in Stream: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Failed to create user in Stream: {str(e)}")
+        try:
+            with stage("user"):
+                await ensure_user(user_id)
+        except Exception as e:
+            logger.error(f"Error creating user in Stream: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to create user in Stream: {str(e)}")
         
         # Generate token
-        if not stream_client:
+        try:
+            await run_in_threadpool(stream_client.get)
+        except Exception:
             logger.error("Stream client is not initialized, cannot generate token")
             raise HTTPException(status_code=500, detail="Stream client is not initialized")
         
         logger.info(f"Generating token for user: {user_id}")
-        token = stream_client.create_token(user_id)
+        with stage("token"):
+            token = stream_client.create_token(user_id)
         logger.info(f"Token generated successfully: {token[:20]}... (masked)")
         
         return {"token": token}
@@ -240,237 +661,835 @@ async def get_chat_token(user_id: str, db: Session = Depends(get_db)):
         logger.error(f"Error creating chat token: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
+def channel_exists(db: Session, channel_id: str) -> bool:
+    return db.query(ChannelModel.id).filter(ChannelModel.id == channel_id).first() is not None
+
+def record_channel(db: Session, channel_id: str, learner_id: str, coach_id: str):
+    db.add(ChannelModel(id=channel_id, learner_id=learner_id, coach_id=coach_id))
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # Fine if another worker recorded it concurrently; anything else
+        # (a missing learner or coach row) is a real failure
+        if channel_exists(db, channel_id):
+            return
+        logger.error(f"Error recording channel {channel_id}: {str(e)}")
+        raise
+
+def create_stream_channel(channel_id: str, learner_id: str, coach_id: str):
+    # Blocking Stream call; run on the threadpool
+    channel = stream_client.channel(
+        "messaging",
+        channel_id,
+        {
+            "members": [learner_id, coach_id],
+            "name": "AI Coach Chat"
+        }
+    )
+    channel.create(coach_id)
+
+async def provision_channel(channel_id: str, learner_id: str, coach_id: str):
+    # Creates the Stream channel unless it is already recorded
+    async with db_session() as db:
+        if await run_db(db, channel_exists, channel_id):
+            return
+        with stage("stream_channel"):
+            await run_in_threadpool(create_stream_channel, channel_id, learner_id, coach_id)
+        await run_db(db, record_channel, channel_id, learner_id, coach_id)
+
 @app.post("/chat/channel/")
-async def create_channel(learner_id: str, coach_id: str, db: Session = Depends(get_db)):
+async def create_channel(learner_id: str, coach_id: str):
     try:
-        # Check if learner exists, create if not
-        learner = db.query(UserModel).filter(UserModel.id == learner_id).first()
-        if not learner:
-            logger.info(f"Learner {learner_id} not found when creating channel, creating automatically")
-            # Extract name from user_id (fallback method)
-            learner_name = learner_id.replace('user_', '').replace('_', ' ').title()
-            
-            # Create learner in database
-            learner = UserModel(
-                id=learner_id,
-                name=learner_name,
-                role="learner",
-                goals=[],
-                preferences={}
-            )
-            db.add(learner)
-            
-            # Create learner in Stream.io
+        # The channel ID is deterministic, so known channels return at once
+        channel_id = f"coach-{coach_id}-learner-{learner_id}"
+
+        async def provision():
+            # Check if learner exists, create if not
             try:
-                if stream_client:
-                    user_data = {
-                        "id": learner_id,
-                        "name": learner_name
-                    }
-                    stream_client.upsert_user(user_data)
+                await ensure_user(learner_id)
             except Exception as e:
                 logger.error(f"Error creating learner in Stream: {str(e)}")
-        
-        # Check if coach exists, create if not (for AI coach)
-        coach = db.query(UserModel).filter(UserModel.id == coach_id).first()
-        if not coach and coach_id == "ai_coach_1":
-            logger.info("AI coach not found, creating automatically")
-            # Create coach in database
-            coach = UserModel(
-                id=coach_id,
-                name="AI Coach",
-                role="coach",
-                goals=[],
-                preferences={}
-            )
-            db.add(coach)
             
-            # Create coach in Stream.io
-            try:
-                if stream_client:
-                    coach_data = {
-                        "id": coach_id,
-                        "name": "AI Coach",
-                        "image": "https://ui-avatars.com/api/?name=AI+Coach&background=007bff&color=fff"
-                    }
-                    stream_client.upsert_user(coach_data)
-            except Exception as e:
-                logger.error(f"Error creating coach in Stream: {str(e)}")
-        
-        db.commit()
-        
-        channel = stream_client.channel(
-            "messaging",
-            f"coach-{coach_id}-learner-{learner_id}",
-            {
-                "members": [learner_id, coach_id],
-                "name": "AI Coach Chat"
-            }
-        )
-        channel.create(coach_id)
-        return {"channel_id": channel.id}
+            # Check if coach exists, create if not (for AI coach)
+            if coach_id == AI_COACH_ID:
+                try:
+                    await ensure_user(coach_id, name="AI Coach", role="coach", image=AI_COACH_IMAGE)
+                except Exception as e:
+                    logger.error(f"Error creating coach in Stream: {str(e)}")
+
+            await provision_channel(channel_id, learner_id, coach_id)
+
+        with stage("provision"):
+            await known_channels.ensure(channel_id, provision)
+        return {"channel_id": channel_id}
     except Exception as e:
         logger.error(f"Error creating channel: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/chat/message/")
-async def handle_message(message: ChatMessage, db: Session = Depends(get_db)):
+# Recent turns kept out of the rolling summary; older ones are folded into it
+RECENT_MESSAGE_LIMIT = int(os.getenv("PROMPT_RECENT_MESSAGES", "10"))
+LOOP_CHECK_WINDOW = 5
+# Fold this many messages that have aged out of the recent window into
+# the rolling summary at a time
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "10"))
+SUMMARY_MAX_MESSAGES = 50
+# Every message not yet in the summary is loaded for the prompt builder, so
+# nothing drops out of context while a batch builds up; the token budget
+# decides how many of them fit
+CONTEXT_MESSAGE_LIMIT = RECENT_MESSAGE_LIMIT + SUMMARY_MAX_MESSAGES
+
+class ChatContext:
+    def __init__(self, user, conversation, recent_messages):
+        self.user = user
+        self.conversation = conversation
+        # Newest first
+        self.recent_messages = recent_messages
+
+def load_archived_messages(db: Session, conversation_id: int):
+    # Archived messages of a conversation, oldest first
+    data = db.query(ConversationArchiveModel.data).filter(
+        ConversationArchiveModel.conversation_id == conversation_id
+    ).scalar()
+    return unpack_messages(data)
+
+def load_context_messages(db: Session, conversation_id: int, archived: bool = False,
+                          summarized_through_id: Optional[int] = None):
+    # Messages of this conversation that the summary doesn't cover yet,
+    # newest first. Always includes the recent window, since only older
+    # messages are summarized.
+    # Read-your-writes: include this conversation's messages still waiting
+    # in the write-behind queue. The snapshot is taken before the query, so
+    # a row flushed in between is in one or both, never in neither.
+    pending = message_writer.pending(lambda row: row["conversation_id"] == conversation_id)
+    rows = db.query(
+        MessageModel.id,
+        MessageModel.conversation_id,
+        MessageModel.role,
+        MessageModel.content,
+        MessageModel.fingerprint,
+        MessageModel.created_at
+    ).filter(
+        MessageModel.conversation_id == conversation_id,
+        MessageModel.id > (summarized_through_id or 0)
+    ).order_by(
+        MessageModel.created_at.desc(), MessageModel.id.desc()
+    ).limit(CONTEXT_MESSAGE_LIMIT).all()
+    # A row flushed after the snapshot is in both; keep the committed copy
+    committed = Counter((row.role, row.created_at, row.content) for row in rows)
+    unsaved = []
+    for row in pending:
+        key = (row["role"], row["created_at"], row["content"])
+        if committed[key]:
+            committed[key] -= 1
+        else:
+            unsaved.append(SimpleNamespace(id=None, **row))
+    newest_first = lambda row: (row.created_at, row.id if row.id is not None else float("inf"))
+    recent = sorted(list(rows) + unsaved, key=newest_first, reverse=True)[:CONTEXT_MESSAGE_LIMIT]
+    if archived and len(recent) < RECENT_MESSAGE_LIMIT:
+        # A conversation picked up again after archiving; everything in the
+        # archive is older than what's left in the messages table
+        tail = load_archived_messages(db, conversation_id)[-(RECENT_MESSAGE_LIMIT - len(recent)):]
+        recent += [
+            SimpleNamespace(conversation_id=conversation_id, fingerprint=None, **vars(msg))
+            for msg in reversed(tail)
+        ]
+    return recent
+
+def load_user_message_history(db: Session, user_id: str, after_id: int = 0):
+    # (id, conversation_id, role, content) of the user's latest messages
+    # after after_id, oldest first, for their retrieval index
+    rows = db.query(
+        MessageModel.id, MessageModel.conversation_id, MessageModel.role, MessageModel.content
+    ).join(
+        ConversationModel, ConversationModel.id == MessageModel.conversation_id
+    ).filter(
+        ConversationModel.user_id == user_id,
+        MessageModel.id > after_id
+    ).order_by(MessageModel.id.desc()).limit(RETRIEVAL_MAX_MESSAGES).all()
+    return list(reversed(rows))
+
+async def load_memory_index(user_id: str):
+    # Builds the user's retrieval index on first use, and afterwards adds
+    # the messages saved since it was last brought up to date, whichever
+    # worker saved them. The history is read in its own short session, and
+    # the CPU-heavy indexing runs on the threadpool, outside any session or
+    # conversation lock.
+    if not memory_index.enabled:
+        return
+    after_id = memory_index.high_water(user_id)
     try:
-        # Check if user exists, create if not
-        user = db.query(UserModel).filter(UserModel.id == message.user_id).first()
-        if not user:
-            logger.info(f"User {message.user_id} not found, creating automatically")
-            # Extract name from user_id (fallback method)
-            user_name = message.user_id.replace('user_', '').replace('_', ' ').title()
-            
-            # Create user in Stream.io
+        async with db_session() as db:
+            rows = await run_db(db, load_user_message_history, user_id, after_id or 0)
+        if after_id is None:
+            await run_in_threadpool(memory_index.build, user_id, rows)
+        elif rows:
+            await run_in_threadpool(memory_index.extend, user_id, rows)
+    except Exception as e:
+        logger.warning(f"Error loading retrieval index for {user_id}: {str(e)}")
+
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+def create_conversation(db: Session, user_id: str, channel_id: str):
+    # Committed before the LLM call (see run_chat_turn). If another worker
+    # creates the same conversation first, the unique index turns this into
+    # a no-op and both use that row.
+    insert = UPSERT_INSERTS.get(engine.dialect.name)
+    if insert is None:
+        conversation = ConversationModel(user_id=user_id, channel_id=channel_id)
+        db.add(conversation)
+        # Flush for the id
+        db.flush()
+        return conversation
+    db.execute(
+        insert(ConversationModel.__table__).values(
+            user_id=user_id, channel_id=channel_id
+        ).on_conflict_do_nothing(index_elements=["user_id", "channel_id"])
+    )
+    return db.query(ConversationModel).filter(
+        ConversationModel.user_id == user_id,
+        ConversationModel.channel_id == channel_id
+    ).one()
+
+def build_chat_context(db: Session, user_id: str, channel_id: str) -> ChatContext:
+    # The user is provisioned by ensure_user before this runs; load it with
+    # their conversation on this channel in one query
+    row = db.query(UserModel, ConversationModel).outerjoin(
+        ConversationModel,
+        and_(ConversationModel.user_id == UserModel.id, ConversationModel.channel_id == channel_id)
+    ).filter(UserModel.id == user_id).first()
+    user, conversation = row if row else (None, None)
+
+    if not conversation:
+        conversation = create_conversation(db, user_id, channel_id)
+
+    return ChatContext(user, conversation, load_context_messages(
+        db, conversation.id, archived=conversation.archived_through_id is not None,
+        summarized_through_id=conversation.summarized_through_id
+    ))
+
+class ChatTurn:
+    def __init__(self, conversation, prompt=None, canned_response=None, cache_key=None, needs_summary=False,
+                 claim="run", claim_token=None):
+        # Plain id, so nothing lazy-loads outside the session
+        self.conversation_id = conversation.id
+        self.prompt = prompt
+        # Set when loop recovery short-circuits the LLM call
+        self.canned_response = canned_response
+        self.cache_key = cache_key
+        # Set when messages older than the recent window aren't summarized yet
+        self.needs_summary = needs_summary
+        # Outcome of claim_turn; only "run" turns have a prompt
+        self.claim = claim
+        self.claim_token = claim_token
+
+# A claimed turn not finished within this long is taken to belong to a
+# worker that died mid-turn, and the next turn takes it over
+TURN_CLAIM_TIMEOUT_SECONDS = float(os.getenv("TURN_CLAIM_TIMEOUT_SECONDS", "120"))
+TURN_CLAIM_POLL_SECONDS = float(os.getenv("TURN_CLAIM_POLL_SECONDS", "0.2"))
+turn_claim_stats = {"claimed": 0, "taken_over": 0, "waited": 0, "shared": 0}
+
+def claim_turn(db: Session, conversation_id: int, message_hash: str):
+    # Returns ("run", token) when this turn may go ahead, ("share", token)
+    # when an identical message is in flight in another worker, and
+    # ("wait", None) when a different turn of the conversation is. Each
+    # write only succeeds against the claim that was read, so concurrent
+    # claimers can't both win even without the advisory lock.
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    claim = db.query(
+        TurnClaimModel.token, TurnClaimModel.message_hash, TurnClaimModel.started_at, TurnClaimModel.completed_at
+    ).filter(TurnClaimModel.conversation_id == conversation_id).first()
+    values = {"message_hash": message_hash, "token": token, "started_at": now, "completed_at": None, "response": None}
+    if claim is None:
+        insert = UPSERT_INSERTS.get(engine.dialect.name)
+        if insert is None:
             try:
-                if stream_client:
-                    user_data = {
-                        "id": message.user_id,
-                        "name": user_name
-                    }
-                    stream_client.upsert_user(user_data)
-            except Exception as e:
-                logger.error(f"Error creating user in Stream: {str(e)}")
-            
-            # Create user in database
-            user = UserModel(
-                id=message.user_id,
-                name=user_name,
-                role="learner",
-                goals=[],
-                preferences={}
-            )
-            db.add(user)
-            db.commit()
+                with db.begin_nested():
+                    db.execute(TurnClaimModel.__table__.insert().values(conversation_id=conversation_id, **values))
+                claimed = True
+            except IntegrityError:
+                claimed = False
+        else:
+            claimed = db.execute(
+                insert(TurnClaimModel.__table__).values(conversation_id=conversation_id, **values)
+                .on_conflict_do_nothing(index_elements=["conversation_id"])
+            ).rowcount == 1
+        if claimed:
+            turn_claim_stats["claimed"] += 1
+            return "run", token
+        return "wait", None
+    if claim.completed_at is None and claim.started_at > now - timedelta(seconds=TURN_CLAIM_TIMEOUT_SECONDS):
+        return ("share", claim.token) if claim.message_hash == message_hash else ("wait", None)
+    if db.query(TurnClaimModel).filter(
+        TurnClaimModel.conversation_id == conversation_id, TurnClaimModel.token == claim.token
+    ).update(values, synchronize_session=False) != 1:
+        return "wait", None
+    turn_claim_stats["claimed"] += 1
+    if claim.completed_at is None:
+        turn_claim_stats["taken_over"] += 1
+        logger.warning(f"Took over the unfinished turn claim of conversation {conversation_id}")
+    return "run", token
+
+def load_turn_claim(db: Session, conversation_id: int):
+    return db.query(
+        TurnClaimModel.token, TurnClaimModel.started_at, TurnClaimModel.completed_at, TurnClaimModel.response
+    ).filter(TurnClaimModel.conversation_id == conversation_id).first()
+
+def finish_turn_claim(db: Session, conversation_id: int, token: str, response: Optional[str]):
+    # In the transaction that saves the turn, so a finished claim means the
+    # turn's messages are committed (or queued, with write-behind)
+    db.query(TurnClaimModel).filter(
+        TurnClaimModel.conversation_id == conversation_id, TurnClaimModel.token == token
+    ).update({"completed_at": datetime.utcnow(), "response": response}, synchronize_session=False)
+
+def release_turn_claim(db: Session, conversation_id: int, token: str):
+    # For a turn that failed before it was saved; identical messages
+    # waiting on it then run their own turn
+    db.query(TurnClaimModel).filter(
+        TurnClaimModel.conversation_id == conversation_id, TurnClaimModel.token == token
+    ).delete(synchronize_session=False)
+    db.commit()
+
+# Shared by the buffered and streaming chat endpoints. Nothing is committed
+# here; callers commit before calling the LLM.
+def lock_conversation(db: Session, user_id: str, channel_id: str):
+    # Serializes reads and writes of this conversation across workers until
+    # the transaction ends. Only held for short transactions, never across
+    # the LLM call.
+    if engine.dialect.name == "postgresql":
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"),
+            {"key": advisory_lock_key(user_id, channel_id)}
+        )
+
+def prepare_chat_turn(db: Session, message: ChatMessage, message_hash: Optional[str] = None) -> ChatTurn:
+    # With message_hash, the turn is claimed (see claim_turn) before the
+    # prompt is built, and only built if the claim is this turn's
+    lock_conversation(db, message.user_id, message.channel_id)
+    context = build_chat_context(db, message.user_id, message.channel_id)
+    conversation = context.conversation
+
+    recent_messages = context.recent_messages[:LOOP_CHECK_WINDOW]
+    
+    # Check for conversation loops
+    if len(recent_messages) >= 3:
+        # Check for repetitive AI responses
+        ai_messages = [msg for msg in recent_messages if msg.role == "assistant"]
+        if len(ai_messages) >= 2:
+            # Check if the last two AI responses are near duplicates
+            if is_near_duplicate(message_fingerprint(ai_messages[0]), message_fingerprint(ai_messages[1])):
+                logger.warning("Detected repetitive AI responses, providing a different response")
+                return ChatTurn(conversation, canned_response="I notice I've been repeating myself, which isn't helpful. Let me address your question differently. What specific aspect of this topic would you like me to explore further?")
         
-        # Get or create conversation
-        conversation = db.query(ConversationModel).filter(
-            ConversationModel.user_id == message.user_id,
-            ConversationModel.channel_id == message.channel_id
-        ).first()
+        # Check user message patterns: any loop phrase in two or more messages
+        phrase_counts = Counter()
+        for msg in recent_messages:
+            if msg.role == "user":
+                phrase_counts.update(loop_phrases(msg.content))
+        loop_detected = any(count >= 2 for count in phrase_counts.values())
         
-        if not conversation:
-            conversation = ConversationModel(
-                user_id=message.user_id,
-                channel_id=message.channel_id
-            )
-            db.add(conversation)
+        if loop_detected:
+            return ChatTurn(conversation, canned_response="I've noticed we seem to be in a conversation loop. Let's talk about something specific. Tell me about your day or a specific topic you'd like to learn about. For example, you could say 'I want to learn Python' or 'Help me understand machine learning'.")
+    
+    if message_hash is not None:
+        claim, claim_token = claim_turn(db, conversation.id, message_hash)
+        if claim != "run":
+            return ChatTurn(conversation, claim=claim, claim_token=claim_token)
+    else:
+        claim_token = None
+
+    # The most relevant messages from the user's other conversations
+    # (the index is built or brought up to date beforehand by load_memory_index)
+    memories = memory_index.search(
+        message.user_id,
+        message.message,
+        exclude_conversation_id=conversation.id
+    )
+
+    # Fill the token budget with goals, rolling summary, memories and recent turns
+    user = context.user
+    prompt = build_prompt(
+        message.message,
+        context.recent_messages,
+        summary=conversation.summary,
+        goals=user.goals if user else None,
+        preferences=user.preferences if user else None,
+        memories=[(role, content) for _, role, content in memories]
+    )
+
+    # The recent window is full and its oldest loaded message isn't summarized yet
+    oldest = context.recent_messages[-1] if context.recent_messages else None
+    needs_summary = (
+        len(context.recent_messages) >= RECENT_MESSAGE_LIMIT
+        and oldest.id is not None
+        and oldest.id > (conversation.summarized_through_id or 0)
+    )
+    return ChatTurn(
+        conversation,
+        prompt=prompt.text,
+        cache_key=make_cache_key(message.message, prompt.context_lines),
+        needs_summary=needs_summary,
+        claim_token=claim_token
+    )
+
+def load_messages_to_summarize(db: Session, conversation_id: int):
+    # Unsummarized messages older than the recent window, oldest first
+    conversation = db.query(ConversationModel).filter(ConversationModel.id == conversation_id).first()
+    if not conversation:
+        return None, []
+    window_start = db.query(MessageModel.id).filter(
+        MessageModel.conversation_id == conversation_id
+    ).order_by(MessageModel.id.desc()).offset(RECENT_MESSAGE_LIMIT - 1).limit(1).scalar()
+    if window_start is None:
+        return conversation.summary, []
+    messages = db.query(MessageModel.id, MessageModel.role, MessageModel.content).filter(
+        MessageModel.conversation_id == conversation_id,
+        MessageModel.id > (conversation.summarized_through_id or 0),
+        MessageModel.id < window_start
+    ).order_by(MessageModel.id).limit(SUMMARY_MAX_MESSAGES).all()
+    return conversation.summary, messages
+
+def store_summary(db: Session, conversation_id: int, summary: str, through_id: int):
+    db.query(ConversationModel).filter(ConversationModel.id == conversation_id).update(
+        {"summary": summary, "summarized_through_id": through_id}, synchronize_session=False
+    )
+    db.commit()
+
+summaries_in_progress = set()
+background_tasks = set()
+
+async def update_conversation_summary(conversation_id: int):
+    # Runs after the reply has been sent; one at a time per conversation
+    if conversation_id in summaries_in_progress:
+        return
+    summaries_in_progress.add(conversation_id)
+    try:
+        async with db_session() as db:
+            previous_summary, messages = await run_db(db, load_messages_to_summarize, conversation_id)
+        if len(messages) < SUMMARY_BATCH_MESSAGES:
+            return
+        summary = await generate_text(gemini_client, build_summary_prompt(previous_summary, messages))
+        async with db_session() as db:
+            await run_db(db, store_summary, conversation_id, summary.strip(), messages[-1].id)
+        logger.debug(f"Summarized {len(messages)} messages of conversation {conversation_id}")
+    except Exception as e:
+        logger.warning(f"Error updating summary for conversation {conversation_id}: {str(e)}")
+    finally:
+        summaries_in_progress.discard(conversation_id)
+
+def run_in_background(coro):
+    # Keep a reference so the task isn't garbage collected mid-flight
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def insert_messages(db: Session, rows: List[dict]):
+    # Bulk insert, then one executemany to bump each conversation's
+    # activity time for history ordering
+    if not rows:
+        return
+    db.execute(MessageModel.__table__.insert(), rows)
+    touched = {}
+    for row in rows:
+        touched[row["conversation_id"]] = max(row["created_at"], touched.get(row["conversation_id"], row["created_at"]))
+    conversations = ConversationModel.__table__
+    db.execute(
+        conversations.update().where(conversations.c.id == bindparam("touched_id")).values(updated_at=bindparam("touched_at")),
+        [{"touched_id": conv_id, "touched_at": touched_at} for conv_id, touched_at in touched.items()]
+    )
+
+def insert_and_commit_messages(db: Session, rows: List[dict]):
+    try:
+        insert_messages(db, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+async def flush_messages(rows: List[dict]):
+    # Write-behind flush, with its own session
+    async with db_session() as db:
+        await run_db(db, insert_and_commit_messages, rows)
+
+message_writer = WriteBehindQueue(flush_messages)
+
+def archive_conversation(db: Session, conversation, cutoff: datetime) -> Optional[dict]:
+    # Moves every message of an idle conversation into its archive row,
+    # merging with what an earlier run archived. The conversation keeps its
+    # summary, so a chat picked up later still has the gist of it.
+    if not is_sqlite:
+        # Skip conversations with a turn in progress (see prepare_chat_turn)
+        if not db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"),
+            {"key": advisory_lock_key(conversation.user_id, conversation.channel_id)}
+        ).scalar():
+            return None
+    # A turn may have landed since the batch was selected
+    updated_at = db.query(ConversationModel.updated_at).filter(ConversationModel.id == conversation.id).scalar()
+    if updated_at is None or updated_at >= cutoff:
+        return None
+    messages = db.query(
+        MessageModel.id, MessageModel.role, MessageModel.content, MessageModel.created_at
+    ).filter(MessageModel.conversation_id == conversation.id).order_by(MessageModel.id).all()
+    if not messages:
+        return None
+
+    archive = db.query(ConversationArchiveModel).filter(
+        ConversationArchiveModel.conversation_id == conversation.id
+    ).first()
+    if archive is None:
+        archive = ConversationArchiveModel(conversation_id=conversation.id)
+        db.add(archive)
+        archived = []
+    else:
+        archived = unpack_messages(archive.data)
+    all_messages = archived + list(messages)
+    first_user = next((msg for msg in all_messages if msg.role == "user"), None)
+    last = messages[-1]
+    archive.data, raw_bytes = pack_messages(all_messages)
+    archive.message_count = len(all_messages)
+    archive.title = first_user.content[:100] if first_user else None
+    archive.last_message = {
+        "role": last.role,
+        "content": last.content[:200],
+        "created_at": last.created_at.isoformat() if last.created_at else None
+    }
+    archive.archived_at = datetime.utcnow()
+
+    db.query(MessageModel).filter(
+        MessageModel.conversation_id == conversation.id, MessageModel.id <= last.id
+    ).delete(synchronize_session=False)
+    # updated_at is set to itself so archiving doesn't count as activity
+    db.query(ConversationModel).filter(ConversationModel.id == conversation.id).update(
+        {"archived_through_id": last.id, "updated_at": ConversationModel.updated_at}, synchronize_session=False
+    )
+    return {
+        "conversations": 1, "messages": len(messages), "raw_bytes": raw_bytes,
+        "compressed_bytes": len(archive.data)
+    }
+
+def archive_conversation_batch(db: Session, after_id: int, cutoff: datetime, batch_size: int):
+    # One batch of conversations idle since before cutoff that still have
+    # messages in the hot table, in id order after after_id, archived in a
+    # single transaction. Returns (last id, counts), or None when there are
+    # no more.
+    candidates = db.query(
+        ConversationModel.id, ConversationModel.user_id, ConversationModel.channel_id
+    ).filter(
+        ConversationModel.id > after_id,
+        ConversationModel.updated_at < cutoff,
+        exists().where(MessageModel.conversation_id == ConversationModel.id)
+    ).order_by(ConversationModel.id).limit(batch_size).all()
+    if not candidates:
+        return None
+
+    totals = {"conversations": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+    try:
+        for conversation in candidates:
+            counts = archive_conversation(db, conversation, cutoff)
+            for key, value in (counts or {}).items():
+                totals[key] += value
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return candidates[-1].id, totals
+
+async def archive_idle_conversations(after_id: int):
+    cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    async with db_session() as db:
+        return await run_db(db, archive_conversation_batch, after_id, cutoff, ARCHIVE_BATCH_SIZE)
+
+archive_worker = ArchiveWorker(archive_idle_conversations)
+
+def chat_turn_rows(conversation_id: int, user_text: str, ai_text: Optional[str],
+                   user_created_at: Optional[datetime] = None) -> List[dict]:
+    # Message rows for the user message, and AI response if there is one.
+    # Fingerprinting a long reply takes a few milliseconds of CPU, so this
+    # runs on the threadpool rather than inside run_db, which an async
+    # session runs on the event loop.
+    rows = [{
+        "conversation_id": conversation_id,
+        "role": "user",
+        "content": user_text,
+        "fingerprint": simhash(user_text),
+        "created_at": user_created_at or datetime.utcnow()
+    }]
+    if ai_text:
+        rows.append({
+            "conversation_id": conversation_id,
+            "role": "assistant",
+            "content": ai_text,
+            "fingerprint": simhash(ai_text),
+            "created_at": datetime.utcnow()
+        })
+    return rows
+
+def save_chat_turn(db: Session, rows: List[dict], user_id: Optional[str] = None, channel_id: Optional[str] = None,
+                   claim_token: Optional[str] = None):
+    # Save the rows from chat_turn_rows, finishing the turn's claim
+    if user_id and channel_id:
+        lock_conversation(db, user_id, channel_id)
+    if claim_token:
+        reply = next((row["content"] for row in rows if row["role"] == "assistant"), None)
+        finish_turn_claim(db, rows[0]["conversation_id"], claim_token, reply)
+    if message_writer.running and message_writer.has_room(len(rows)):
+        # Commit whatever else the turn created; messages follow in a batch
+        with stage("commit"):
             db.commit()
-        
-        # Get recent conversation history from current conversation
-        recent_messages = db.query(MessageModel).filter(
-            MessageModel.conversation_id == conversation.id
-        ).order_by(MessageModel.created_at.desc()).limit(5).all()
-        
-        # Get important messages from past conversations (different channels)
-        past_conversations = db.query(ConversationModel).filter(
-            ConversationModel.user_id == message.user_id,
-            ConversationModel.id != conversation.id
-        ).order_by(ConversationModel.updated_at.desc()).limit(3).all()
-        
-        important_past_messages = []
-        for past_conv in past_conversations:
-            # Get the last message from each past conversation
-            past_msg = db.query(MessageModel).filter(
-                MessageModel.conversation_id == past_conv.id,
-                MessageModel.role == "assistant"  # Focus on AI responses as they contain summaries
-            ).order_by(MessageModel.created_at.desc()).first()
-            
-            if past_msg:
-                important_past_messages.append(past_msg)
-        
-        # Check for conversation loops
-        if len(recent_messages) >= 3:
-            # Check for repetitive AI responses
-            ai_messages = [msg for msg in recent_messages if msg.role == "assistant"]
-            if len(ai_messages) >= 2:
-                # Check if the last two AI responses are very similar
-                if ai_messages[0].content == ai_messages[1].content or (
-                    len(ai_messages[0].content) > 100 and 
-                    len(ai_messages[1].content) > 100 and
-                    ai_messages[0].content[:100] == ai_messages[1].content[:100]
-                ):
-                    logger.warning("Detected repetitive AI responses, providing a different response")
-                    return {
-                        "ai_response": "I notice I've been repeating myself, which isn't helpful. Let me address your question differently. What specific aspect of this topic would you like me to explore further?"
-                    }
-            
-            # Check user message patterns
-            user_messages = [msg.content for msg in recent_messages if msg.role == "user"]
-            loop_detected = False
-            for phrase in ["AI coach", "support you", "dive into", "let's focus", "break the cycle", "What specific", "what you're hoping", "I'm here to help"]:
-                matches = sum(1 for msg in user_messages if phrase.lower() in msg.lower())
-                if matches >= 2:
-                    loop_detected = True
-                    break
-            
-            if loop_detected:
-                return {
-                    "ai_response": "I've noticed we seem to be in a conversation loop. Let's talk about something specific. Tell me about your day or a specific topic you'd like to learn about. For example, you could say 'I want to learn Python' or 'Help me understand machine learning'."
-                }
-        
-        # Save user message
-        user_message = MessageModel(
-            conversation_id=conversation.id,
-            role="user",
-            content=message.message
-        )
-        db.add(user_message)
-        
-        # Get recent conversation as simple text
-        conversation_history = "\n".join(
-            [f"{'User' if msg.role == 'user' else 'AI'}: {msg.content}" for msg in reversed(recent_messages)]
+        message_writer.enqueue(rows)
+    else:
+        insert_messages(db, rows)
+        with stage("commit"):
+            db.commit()
+
+conversation_gate = ConversationGate()
+# Token buckets in front of the chat endpoints (CHAT_RATE_* settings)
+chat_rate_limiter = RateLimiter()
+
+def check_chat_rate(user_id: str):
+    wait = chat_rate_limiter.acquire(user_id)
+    if wait:
+        raise HTTPException(
+            status_code=429, detail="Too many messages, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))}
         )
 
-        # Get AI response from Gemini
-        try:
-            # Build a simple, clear prompt
-            simple_prompt = f"""
-You are an AI coach having a conversation with a user. Answer their questions directly and helpfully.
-    
-Previous messages:
-{conversation_history}
+def conversation_key(message: ChatMessage) -> str:
+    return f"{message.user_id}\x1f{message.channel_id}"
 
-User's latest question: {message.message}
+async def wait_for_turn_reply(conversation_id: int, token: str) -> Optional[str]:
+    # Polls the claim of an identical turn running in another worker until
+    # it is saved. None if that turn failed, went stale or saved no reply;
+    # the caller then claims the conversation again.
+    while True:
+        await asyncio.sleep(TURN_CLAIM_POLL_SECONDS)
+        async with db_session() as db:
+            claim = await run_db(db, load_turn_claim, conversation_id)
+        if claim is None or claim.token != token:
+            return None
+        if claim.completed_at is not None:
+            return claim.response or None
+        if claim.started_at < datetime.utcnow() - timedelta(seconds=TURN_CLAIM_TIMEOUT_SECONDS):
+            return None
 
-Important: If the user is asking about a specific topic like 'transformers', 'python', etc., 
-provide a direct, informative answer about that topic. Do not repeat an introduction.
-"""
+async def claim_chat_turn(message: ChatMessage):
+    # Prepares the turn once no other turn of the conversation is in
+    # progress in any worker. Returns (turn, None) for a turn this request
+    # runs (or a canned reply), or (None, reply) when an identical message
+    # in flight elsewhere supplied the reply.
+    message_hash = message_digest(normalize_text(message.message))
+    while True:
+        # Separate short sessions before and after the LLM call, so a slow
+        # Gemini reply holds neither a pooled connection nor a transaction
+        async with db_session() as db:
+            turn = await run_db(db, prepare_chat_turn, message, message_hash)
+            # Commit the claim and a new conversation now: an open write
+            # transaction would hold SQLite's write lock for the whole call
+            await run_db(db, commit_session)
+        if turn.claim == "run":
+            return turn, None
+        if turn.claim == "share":
+            reply = await wait_for_turn_reply(turn.conversation_id, turn.claim_token)
+            if reply is not None:
+                turn_claim_stats["shared"] += 1
+                return None, reply
+        else:
+            turn_claim_stats["waited"] += 1
+            await asyncio.sleep(TURN_CLAIM_POLL_SECONDS)
 
+async def release_chat_turn(turn: ChatTurn):
+    if not turn.claim_token:
+        return
+    try:
+        async with db_session() as db:
+            await run_db(db, release_turn_claim, turn.conversation_id, turn.claim_token)
+    except Exception as e:
+        logger.error(f"Error releasing turn claim of conversation {turn.conversation_id}: {str(e)}")
+
+async def run_chat_turn(message: ChatMessage, received_at: datetime) -> str:
+    # One turn, with its own session since it may be shared by several
+    # identical requests
+    # Check if user exists, create if not
+    try:
+        with stage("user"):
+            await ensure_user(message.user_id)
+    except Exception as e:
+        logger.error(f"Error creating user in Stream: {str(e)}")
+
+    with stage("context"):
+        turn, shared_reply = await claim_chat_turn(message)
+    if shared_reply is not None:
+        return shared_reply
+    if turn.canned_response:
+        return turn.canned_response
+    try:
+        return await complete_chat_turn(message, received_at, turn)
+    except BaseException:
+        await release_chat_turn(turn)
+        raise
+
+async def complete_chat_turn(message: ChatMessage, received_at: datetime, turn: ChatTurn) -> str:
+    # The LLM call and save of a claimed turn
+    # Identical prompts skip the LLM entirely
+    with stage("cache"):
+        ai_response = await response_cache.get(turn.cache_key)
+    if ai_response is None:
+        # Get AI response from Gemini
+        try:
             logger.debug(f"Sending simplified prompt to Gemini API")
-            response = gemini_client.generate_content(
-                contents=simple_prompt,
-                generation_config={
-                    "max_output_tokens": 1000,
-                    "temperature": 0.7,
-                    "top_p": 0.9
-                }
-            )
-            ai_response = response.text
+            # Runs on the LLM executor behind the concurrency gate so a slow
+            # Gemini response never blocks the event loop
+            with stage("llm"):
+                ai_response = await generate_text(gemini_client, turn.prompt)
             logger.debug(f"Received response from Gemini API: {len(ai_response)} chars")
+            await response_cache.set(turn.cache_key, ai_response)
         except Exception as e:
             logger.error(f"Error from Gemini API: {str(e)}")
             # Provide a fallback response
-            ai_response = "I'm having trouble processing your request right now. Could you try asking in a different way?"
+            ai_response = FALLBACK_AI_RESPONSE
+    else:
+        logger.debug("Serving AI response from cache")
+
+    with stage("save"):
+        rows = await run_in_threadpool(chat_turn_rows, turn.conversation_id, message.message, ai_response, received_at)
+        async with db_session() as db:
+            await run_db(db, save_chat_turn, rows, user_id=message.user_id, channel_id=message.channel_id,
+                         claim_token=turn.claim_token)
+    if turn.needs_summary:
+        run_in_background(update_conversation_summary(turn.conversation_id))
+    return ai_response
 
-        # Save AI response
-        ai_message = MessageModel(
-            conversation_id=conversation.id,
-            role="assistant",
-            content=ai_response
+@app.post("/chat/message/")
+async def handle_message(message: ChatMessage):
+    received_at = datetime.utcnow()
+    check_chat_rate(message.user_id)
+    try:
+        # Turns of one conversation run one at a time, and identical
+        # messages sent while one is in flight share its reply
+        with stage("memory_index"):
+            await load_memory_index(message.user_id)
+        key = conversation_key(message)
+        ai_response = await conversation_gate.run(
+            key, (key, normalize_text(message.message)), lambda: run_chat_turn(message, received_at)
         )
-        db.add(ai_message)
-        db.commit()
-        
         return {"ai_response": ai_response}
     except Exception as e:
         logger.error(f"Error generating AI response: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/memory/")
-async def update_user_memory(user_id: str, memory_data: dict, db: Session = Depends(get_db)):
+# For streamed replies, where the request-scoped session may already be
+# closed by the time the reply is complete
+async def save_chat_turn_detached(conversation_id: int, user_text: str, ai_text: Optional[str],
+                                  user_created_at: Optional[datetime] = None, user_id: Optional[str] = None,
+                                  channel_id: Optional[str] = None, turn: Optional[ChatTurn] = None):
+    # Shielded so a client disconnect can't cancel the save half way
+    with anyio.CancelScope(shield=True):
+        try:
+            rows = await run_in_threadpool(chat_turn_rows, conversation_id, user_text, ai_text, user_created_at)
+            async with db_session() as save_db:
+                await run_db(save_db, save_chat_turn, rows, user_id, channel_id,
+                             claim_token=turn.claim_token if turn else None)
+        except Exception as e:
+            logger.error(f"Error saving streamed response: {str(e)}")
+            if turn:
+                await release_chat_turn(turn)
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        return f"event: {event}\n{payload}"
+    return payload
+
+@app.post("/chat/message/stream/")
+async def handle_message_stream(message: ChatMessage):
+    received_at = datetime.utcnow()
+    check_chat_rate(message.user_id)
+    try:
+        # Check if user exists, create if not
+        try:
+            with stage("user"):
+                await ensure_user(message.user_id)
+        except Exception as e:
+            logger.error(f"Error creating user in Stream: {str(e)}")
+
+        with stage("memory_index"):
+            await load_memory_index(message.user_id)
+        # Serialized with other turns of the conversation while the context
+        # is read and the turn claimed; the stream itself isn't. The claim
+        # is committed in its own session, closed before streaming starts,
+        # and finished by the save once the stream ends.
+        with stage("context"):
+            turn, shared_reply = await conversation_gate.serialize(
+                conversation_key(message), lambda: claim_chat_turn(message)
+            )
+    except Exception as e:
+        logger.error(f"Error preparing AI response: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if shared_reply is not None:
+        # An identical message streamed in another worker, which saved it
+        async def shared_stream():
+            yield sse_event({"delta": shared_reply})
+            yield sse_event({"ai_response": shared_reply}, event="done")
+        return StreamingResponse(
+            shared_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    conversation_id = turn.conversation_id
+    canned_response = turn.canned_response
+    if not canned_response:
+        with stage("cache"):
+            canned_response = await response_cache.get(turn.cache_key)
+
+    async def event_stream():
+        if canned_response:
+            yield sse_event({"delta": canned_response})
+            yield sse_event({"ai_response": canned_response}, event="done")
+            if not turn.canned_response:
+                await save_chat_turn_detached(
+                    conversation_id, message.message, canned_response, received_at, message.user_id,
+                    message.channel_id, turn
+                )
+            return
+
+        parts = []
+        completed = False
+        try:
+            try:
+                async for chunk in stream_text(gemini_client, turn.prompt):
+                    parts.append(chunk)
+                    yield sse_event({"delta": chunk})
+                await response_cache.set(turn.cache_key, "".join(parts))
+            except Exception as e:
+                logger.error(f"Error from Gemini API while streaming: {str(e)}")
+                if not parts:
+                    parts.append(FALLBACK_AI_RESPONSE)
+                    yield sse_event({"delta": FALLBACK_AI_RESPONSE})
+            completed = True
+            yield sse_event({"ai_response": "".join(parts)}, event="done")
+        finally:
+            if not completed:
+                logger.info(f"Client disconnected from stream for conversation {conversation_id}")
+            # Persist once, with whatever the client actually received
+            await save_chat_turn_detached(
+                conversation_id, message.message, "".join(parts), received_at, message.user_id,
+                message.channel_id, turn
+            )
+            if turn.needs_summary:
+                run_in_background(update_conversation_summary(conversation_id))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def apply_memory_update(db: Session, user_id: str, memory_data: dict):
     user = db.query(UserModel).filter(UserModel.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -486,16 +1505,11 @@ async def update_user_memory(user_id: str, memory_data: dict, db: Session = Depe
         if "preferences" in memory_data:
             # Handle both SQLite and PostgreSQL
             if isinstance(memory_data["preferences"], dict):
-                if is_sqlite:
-                    # For SQLite, we need to replace the entire dictionary
-                    current_prefs = user.preferences if user.preferences else {}
-                    updated_prefs = {**current_prefs, **memory_data["preferences"]}
-                    user.preferences = updated_prefs
-                else:
-                    # For PostgreSQL, update method works
-                    if not user.preferences:
-                        user.preferences = {}
-                    user.preferences.update(memory_data["preferences"])
+                # Replace the whole dictionary: an in-place update isn't
+                # seen as a change, so nothing would be saved and updated_at
+                # (which /memory's ETag is built from) would stay the same
+                current_prefs = user.preferences if user.preferences else {}
+                user.preferences = {**current_prefs, **memory_data["preferences"]}
             else:
                 logger.warning(f"Invalid preferences format: {memory_data['preferences']}")
         
@@ -506,54 +1520,476 @@ async def update_user_memory(user_id: str, memory_data: dict, db: Session = Depe
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/memory/{user_id}")
-async def get_user_memory(user_id: str, db: Session = Depends(get_db)):
+@app.post("/memory/")
+async def update_user_memory(user_id: str, memory_data: dict, db: Session = Depends(get_db)):
+    return await run_db(db, apply_memory_update, user_id, memory_data)
+
+def load_memory_state(db: Session, user_id: str):
+    # (user updated_at, latest conversation updated_at, conversation count,
+    # message count), from one indexed query. The ETag is built from the
+    # user's updated_at and the counts: messages are only ever added, so a
+    # count changes with every commit whatever order concurrent turns commit
+    # in, where the latest timestamp might not. Archived messages are
+    # counted too, so archiving doesn't change the ETag.
+    archived = select(func.coalesce(func.sum(ConversationArchiveModel.message_count), 0)).join(
+        ConversationModel, ConversationModel.id == ConversationArchiveModel.conversation_id
+    ).where(ConversationModel.user_id == UserModel.id).correlate(UserModel).scalar_subquery()
+    row = db.query(
+        UserModel.updated_at,
+        func.max(ConversationModel.updated_at),
+        func.count(distinct(ConversationModel.id)),
+        func.count(MessageModel.id) + archived
+    ).outerjoin(
+        ConversationModel, ConversationModel.user_id == UserModel.id
+    ).outerjoin(
+        MessageModel, MessageModel.conversation_id == ConversationModel.id
+    ).filter(UserModel.id == user_id).group_by(UserModel.id, UserModel.updated_at).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    return tuple(row)
+
+def load_user_memory(db: Session, user_id: str, since: Optional[list] = None,
+                     message_count: Optional[int] = None):
+    # With since (user updated_at, {conversation id: highest message id} and
+    # the number of messages sent so far, from a previous response's sync
+    # cursor), only what changed after it: goals and preferences if they
+    # did, and for each conversation that changed, just the new messages.
+    # Also returns the highest message id of every conversation and the
+    # number of messages the client now holds, for the next cursor.
+    #
+    # A message can commit after one with a higher id in the same
+    # conversation (write-behind batches, or turns saved by different
+    # workers), and then sits below the high water. message_count, the
+    # user's message count read before this query, catches that: if it is
+    # more than the client would hold after this delta, something was
+    # skipped and the full payload is sent instead.
     user = db.query(UserModel).filter(UserModel.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if since:
+        user_since, seen, held = since
+    else:
+        user_since = None
+        seen = {}
+        held = 0
     
-    # Safely get the JSON fields
-    goals = []
-    preferences = {}
-    
-    try:
-        if user.goals:
-            goals = user.goals
-    except Exception as e:
-        logger.error(f"Error retrieving goals: {str(e)}")
+    result = {"delta": since is not None}
+    if not since or user_since is None or (user.updated_at and user.updated_at > user_since):
+        # Safely get the JSON fields
+        goals = []
+        preferences = {}
         
-    try:
-        if user.preferences:
-            preferences = user.preferences
-    except Exception as e:
-        logger.error(f"Error retrieving preferences: {str(e)}")
+        try:
+            if user.goals:
+                goals = user.goals
+        except Exception as e:
+            logger.error(f"Error retrieving goals: {str(e)}")
+            
+        try:
+            if user.preferences:
+                preferences = user.preferences
+        except Exception as e:
+            logger.error(f"Error retrieving preferences: {str(e)}")
+        result["goals"] = goals
+        result["preferences"] = preferences
     
     # Get all conversations for the user
     conversations = db.query(ConversationModel).filter(
         ConversationModel.user_id == user_id
     ).all()
     
-    # Get messages for each conversation
-    conversation_history = []
-    for conv in conversations:
-        try:
-            messages = db.query(MessageModel).filter(
-                MessageModel.conversation_id == conv.id
-            ).order_by(MessageModel.created_at).all()
-            
-            conversation_history.append({
-                "channel_id": conv.channel_id,
-                "messages": [{"role": msg.role, "content": msg.content} for msg in messages]
-            })
-        except Exception as e:
-            logger.error(f"Error retrieving messages for conversation {conv.id}: {str(e)}")
+    # Get messages for all conversations in one query
+    messages_by_conversation = {conv.id: [] for conv in conversations}
+    high_water = {conv.id: seen.get(conv.id, 0) for conv in conversations}
+    try:
+        if conversations:
+            query = db.query(MessageModel.id, MessageModel.conversation_id, MessageModel.role, MessageModel.content).filter(
+                MessageModel.conversation_id.in_(list(messages_by_conversation))
+            )
+            if any(high_water.values()):
+                query = query.filter(
+                    MessageModel.id > min(high_water.values()),
+                    MessageModel.id > case(high_water, value=MessageModel.conversation_id, else_=0)
+                )
+            messages = query.order_by(MessageModel.created_at, MessageModel.id).all()
+            for msg in messages:
+                messages_by_conversation[msg.conversation_id].append(
+                    {"role": msg.role, "content": msg.content}
+                )
+                high_water[msg.conversation_id] = max(high_water[msg.conversation_id], msg.id)
+        # Archived messages come before everything still in the messages
+        # table; a delta only needs them if some were archived unsynced
+        for conv in conversations:
+            after_id = seen.get(conv.id, 0)
+            if conv.archived_through_id is not None and conv.archived_through_id > after_id:
+                archived = [msg for msg in load_archived_messages(db, conv.id) if msg.id > after_id]
+                messages_by_conversation[conv.id][:0] = [
+                    {"role": msg.role, "content": msg.content} for msg in archived
+                ]
+                high_water[conv.id] = max([high_water[conv.id]] + [msg.id for msg in archived])
+    except Exception as e:
+        logger.error(f"Error retrieving messages for user {user_id}: {str(e)}")
     
+    held += sum(len(messages) for messages in messages_by_conversation.values())
+    if since and message_count is not None and message_count > held:
+        logger.info(f"Memory sync of user {user_id} skipped messages committed out of order; sending everything")
+        return load_user_memory(db, user_id)
+
+    result["conversation_history"] = [
+        {"channel_id": conv.channel_id, "messages": messages_by_conversation[conv.id]}
+        for conv in conversations
+        if not since or conv.id not in seen or messages_by_conversation[conv.id]
+    ]
+    return result, high_water, held
+
+def decode_sync_cursor(since: str) -> list:
+    # [etag, user updated_at or None, {conversation id: highest message id},
+    # messages sent]
+    values = decode_cursor(since)
+    if (
+        len(values) != 4 or not isinstance(values[0], str)
+        or not (values[1] is None or isinstance(values[1], str)) or not isinstance(values[2], dict)
+        or isinstance(values[3], bool) or not isinstance(values[3], int) or values[3] < 0
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    seen = {}
+    for conv_id, after_id in values[2].items():
+        if not conv_id.isdigit() or isinstance(after_id, bool) or not isinstance(after_id, int) or after_id < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        seen[int(conv_id)] = after_id
+    # Parsed here so a bad timestamp is a 400, not an error mid-query
+    user_since = cursor_datetime(values[1]) if values[1] is not None else None
+    return [values[0], user_since, seen, values[3]]
+
+@app.get("/memory/{user_id}")
+async def get_user_memory(user_id: str, request: Request, since: Optional[str] = None, db: Session = Depends(get_db)):
+    # Conditional on the cheap state query: unchanged memory is a 304
+    # (If-None-Match / If-Modified-Since, or a since cursor taken at the
+    # same state) without loading the payload
+    with stage("query"):
+        state = await run_db(db, load_memory_state, user_id)
+    user_updated_at, conversations_updated_at, conversation_count, message_count = state
+    etag = make_etag(user_updated_at, conversation_count, message_count)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = max(ts for ts in (user_updated_at, conversations_updated_at, datetime.min) if ts)
+    if last_modified > datetime.min:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    cursor = decode_sync_cursor(since) if since else None
+    if (cursor is not None and cursor[0] == etag) or (cursor is None and not_modified(request, etag, last_modified)):
+        return Response(status_code=304, headers=headers)
+
+    with stage("query"):
+        payload, high_water, held = await run_db(
+            db, load_user_memory, user_id, cursor[1:] if cursor else None, message_count
+        )
+    payload["sync"] = encode_cursor([
+        etag,
+        user_updated_at.isoformat() if user_updated_at else None,
+        {str(conv_id): after_id for conv_id, after_id in high_water.items()},
+        held
+    ])
+    with stage("serialize"):
+        return json_response(request, payload, headers)
+
+# Opaque keyset cursors for the paginated history API
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError("cursor must encode a list")
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def check_cursor(values: list, *types) -> list:
+    # A decoded cursor must hold exactly one value of each type, in order
+    if len(values) != len(types) or any(
+        isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(values, types)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def cursor_datetime(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def load_conversation_summaries(db: Session, user_id: str, limit: int, cursor: Optional[str]):
+    # Page of conversations, most recently active first
+    query = db.query(ConversationModel).filter(ConversationModel.user_id == user_id)
+    if cursor:
+        updated_at, conv_id = check_cursor(decode_cursor(cursor), str, int)
+        updated_at = cursor_datetime(updated_at)
+        query = query.filter(or_(
+            ConversationModel.updated_at < updated_at,
+            and_(ConversationModel.updated_at == updated_at, ConversationModel.id < conv_id)
+        ))
+    conversations = query.order_by(
+        ConversationModel.updated_at.desc(), ConversationModel.id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        next_cursor = encode_cursor([last.updated_at.isoformat(), last.id])
+
+    # Message counts plus first user / last message ids for the whole page
+    conv_ids = [conv.id for conv in conversations]
+    stats = {}
+    preview_ids = set()
+    if conv_ids:
+        rows = db.query(
+            MessageModel.conversation_id,
+            func.count(MessageModel.id),
+            func.min(case((MessageModel.role == "user", MessageModel.id))),
+            func.max(MessageModel.id)
+        ).filter(
+            MessageModel.conversation_id.in_(conv_ids)
+        ).group_by(MessageModel.conversation_id).all()
+        for conv_id, count, first_user_id, last_id in rows:
+            stats[conv_id] = (count, first_user_id, last_id)
+            preview_ids.update(i for i in (first_user_id, last_id) if i is not None)
+
+    previews = {}
+    if preview_ids:
+        for msg in db.query(MessageModel).filter(MessageModel.id.in_(preview_ids)).all():
+            previews[msg.id] = msg
+
+    # Archived conversations count and preview from their archive row
+    archives = {}
+    archived_ids = [conv.id for conv in conversations if conv.archived_through_id is not None]
+    if archived_ids:
+        for row in db.query(
+            ConversationArchiveModel.conversation_id,
+            ConversationArchiveModel.message_count,
+            ConversationArchiveModel.title,
+            ConversationArchiveModel.last_message
+        ).filter(ConversationArchiveModel.conversation_id.in_(archived_ids)).all():
+            archives[row.conversation_id] = row
+
+    summaries = []
+    for conv in conversations:
+        count, first_user_id, last_id = stats.get(conv.id, (0, None, None))
+        first_user = previews.get(first_user_id)
+        last = previews.get(last_id)
+        archive = archives.get(conv.id)
+        title = first_user.content[:100] if first_user else None
+        last_message = {
+            "role": last.role,
+            "content": last.content[:200],
+            "created_at": last.created_at.isoformat() if last.created_at else None
+        } if last else None
+        if archive:
+            count += archive.message_count or 0
+            title = archive.title or title
+            last_message = last_message or archive.last_message
+        summaries.append({
+            "channel_id": conv.channel_id,
+            "created_at": conv.created_at.isoformat() if conv.created_at else None,
+            "updated_at": conv.updated_at.isoformat() if conv.updated_at else None,
+            "message_count": count,
+            "title": title,
+            "last_message": last_message
+        })
+
+    return {"conversations": summaries, "next_cursor": next_cursor}
+
+@app.get("/history/{user_id}")
+async def get_conversation_summaries(
+    user_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return await run_db(db, load_conversation_summaries, user_id, limit, cursor)
+
+def load_conversation_messages(db: Session, user_id: str, channel_id: str, limit: int, cursor: Optional[str]):
+    conversation = db.query(ConversationModel).filter(
+        ConversationModel.user_id == user_id,
+        ConversationModel.channel_id == channel_id
+    ).first()
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Pages walk backwards from the newest message, through the messages
+    # table and then the conversation's archive, which holds everything
+    # older. Cursors are [id] in the messages table, ["archive", position]
+    # in the archive.
+    values = decode_cursor(cursor) if cursor else []
+    if values and values[0] == "archive":
+        check_cursor(values, str, int)
+        if values[1] < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif values:
+        check_cursor(values, int)
+    messages = []
+    if not values or values[0] != "archive":
+        query = db.query(MessageModel).filter(MessageModel.conversation_id == conversation.id)
+        if values:
+            before_id, = values
+            query = query.filter(MessageModel.id < before_id)
+        messages = query.order_by(MessageModel.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor([messages[-1].id])
+    elif conversation.archived_through_id is not None:
+        archived = load_archived_messages(db, conversation.id)
+        end = values[1] if values and values[0] == "archive" else len(archived)
+        start = max(0, end - (limit - len(messages)))
+        messages += archived[start:end][::-1]
+        if start > 0:
+            next_cursor = encode_cursor(["archive", start])
+
     return {
-        "goals": goals,
-        "preferences": preferences,
-        "conversation_history": conversation_history
+        "channel_id": channel_id,
+        "messages": [
+            {
+                "role": msg.role,
+                "content": msg.content,
+                "created_at": msg.created_at.isoformat() if msg.created_at else None
+            }
+            for msg in reversed(messages)
+        ],
+        "next_cursor": next_cursor
     }
 
+@app.get("/history/{user_id}/{channel_id}/messages")
+async def get_conversation_messages(
+    user_id: str,
+    channel_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return await run_db(db, load_conversation_messages, user_id, channel_id, limit, cursor)
+
+def search_user_messages(db: Session, user_id: str, q: str, limit: int, cursor: Optional[str]):
+    # Results are ranked rather than ordered by a key, so the cursor is an offset
+    offset = 0
+    if cursor:
+        offset, = check_cursor(decode_cursor(cursor), int)
+        if offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = search_messages(db, user_id, q, limit + 1, offset)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([offset + limit])
+
+    return {
+        "query": q,
+        "results": [
+            {
+                "channel_id": channel_id,
+                "role": role,
+                "created_at": created_at.isoformat() if created_at else None,
+                "snippet": format_snippet(snippet),
+                "score": round(float(score or 0), 4)
+            }
+            for _, channel_id, role, created_at, snippet, score in rows
+        ],
+        "next_cursor": next_cursor
+    }
+
+@app.get("/search/{user_id}")
+async def search_history(
+    user_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    with stage("query"):
+        return await run_db(db, search_user_messages, user_id, q, limit, cursor)
+
+@app.get("/stats/llm")
+async def get_llm_stats():
+    return {**llm_gate.snapshot(), "rate_limits": chat_rate_limiter.snapshot()}
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    return {
+        "responses": response_cache.snapshot(),
+        "known_users": known_users.snapshot(),
+        "known_channels": known_channels.snapshot(),
+        "conversations": conversation_gate.snapshot(),
+        "turn_claims": turn_claim_stats,
+        "retrieval": memory_index.snapshot()
+    }
+
+@app.get("/stats/db")
+async def get_db_stats():
+    engines = {"sync": pool_status(engine)}
+    if async_engine is not None:
+        engines["async"] = pool_status(async_engine.sync_engine)
+    return {
+        "async_sessions": AsyncSessionLocal is not None,
+        "pools": engines,
+        "checkout_wait": pool_stats.snapshot()
+    }
+
+@app.get("/stats/writes")
+async def get_write_stats():
+    return message_writer.snapshot()
+
+@app.get("/stats/archive")
+async def get_archive_stats():
+    return archive_worker.snapshot()
+
+def collect_runtime_stats():
+    # Existing stats, exported as gauges at scrape time
+    families = []
+    cache = response_cache.snapshot()
+    families.append(("ai_coach_response_cache", "Response cache counters", [
+        ({"stat": key}, cache[key]) for key in ("entries", "hits", "misses", "shared_hits", "sets", "errors", "evictions")
+    ]))
+    families.append(("ai_coach_registry", "Known user and channel registries", [
+        ({"registry": name, "stat": key}, value)
+        for name, registry in (("users", known_users), ("channels", known_channels))
+        for key, value in registry.snapshot().items() if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]))
+    families.append(("ai_coach_llm_gate", "LLM concurrency gate", [
+        ({"stat": key}, value) for key, value in llm_gate.stats.items()
+    ] + [({"stat": "breaker_open"}, int(llm_gate.breaker.state != "closed"))]))
+    families.append(("ai_coach_chat_rate_limit", "Chat requests allowed and turned away by rate limits", [
+        ({"stat": key}, value) for key, value in chat_rate_limiter.stats.items()
+    ]))
+    pools = [("sync", engine)] + ([("async", async_engine)] if async_engine is not None else [])
+    families.append(("ai_coach_db_pool", "Connection pool status", [
+        ({"engine": name, "stat": key}, value)
+        for name, pool_engine in pools
+        for key, value in pool_status(pool_engine).items() if key != "pool_class"
+    ]))
+    families.append(("ai_coach_db_checkout", "Connection checkout waits", [
+        ({"stat": key}, value) for key, value in pool_stats.snapshot().items()
+    ]))
+    writes = message_writer.snapshot()
+    families.append(("ai_coach_write_behind", "Write-behind queue", [
+        ({"stat": key}, writes[key]) for key in ("pending", "enqueued", "flushed", "batches", "errors", "dropped", "overflowed")
+    ]))
+    archived = archive_worker.snapshot()
+    families.append(("ai_coach_archive", "Conversation archiving", [
+        ({"stat": key}, archived[key])
+        for key in ("runs", "batches", "conversations", "messages", "raw_bytes", "compressed_bytes", "errors")
+    ]))
+    return families
+
+register_collector(collect_runtime_stats)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/favicon.ico")
 async def favicon():
     return {"status": "No favicon available"}
@@ -0,0 +1,214 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Adds a Server-Timing header with per-stage durations to every response
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    # Cumulative buckets as Prometheus expects; observe is a bisect and a
+    # few additions under a lock
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+request_seconds = Histogram(
+    "ai_coach_request_seconds", "Request latency by endpoint and status", labelnames=("endpoint", "status")
+)
+stage_seconds = Histogram(
+    "ai_coach_stage_seconds", "Time spent in each stage of a request", labelnames=("endpoint", "stage")
+)
+request_db_queries = Histogram(
+    "ai_coach_request_db_queries", "Database queries issued per request", buckets=COUNT_BUCKETS,
+    labelnames=("endpoint",)
+)
+llm_seconds = Histogram("ai_coach_llm_seconds", "Gemini call latency", labelnames=("mode", "outcome"))
+llm_output_chars = Histogram(
+    "ai_coach_llm_output_chars", "Characters in each Gemini reply", buckets=SIZE_BUCKETS, labelnames=("mode",)
+)
+db_queries_total = Counter("ai_coach_db_queries_total", "Database queries executed", labelnames=("engine",))
+
+METRICS = [request_seconds, stage_seconds, request_db_queries, llm_seconds, llm_output_chars, db_queries_total]
+
+# Callables returning [(name, help, [(labels dict, value)])], rendered as
+# gauges at scrape time so stats that already exist aren't tracked twice
+_collectors = []
+
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+
+class RequestTiming:
+    __slots__ = ("scope", "stages", "db_queries")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.stages = []
+        self.db_queries = 0
+
+    @property
+    def endpoint(self):
+        # Routing stores the matched endpoint in the scope before it runs
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__name__", "unmatched")
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages)
+
+
+_current_timing = contextvars.ContextVar("ai_coach_request_timing", default=None)
+
+
+class stage:
+    # with stage("llm"): ... records the block's duration against the
+    # current request. Also works in threadpool and run_sync code, which
+    # runs with a copy of the request's context.
+    __slots__ = ("name", "started_at")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started_at
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.stages.append((self.name, elapsed))
+            stage_seconds.observe(elapsed, (timing.endpoint, self.name))
+        return False
+
+
+def instrument_engine(engine, label):
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        db_queries_total.inc((label,))
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.db_queries += 1
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so streaming responses pass through untouched
+    def __init__(self, app, server_timing=SERVER_TIMING_HEADER):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(scope)
+        token = _current_timing.set(timing)
+        started_at = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.server_timing:
+                    header = f"{timing.server_timing()}, total;dur={(time.perf_counter() - started_at) * 1000:.1f}"
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.lstrip(", ").encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            endpoint = timing.endpoint
+            request_seconds.observe(time.perf_counter() - started_at, (endpoint, status[0]))
+            request_db_queries.observe(timing.db_queries, (endpoint,))
+            _current_timing.reset(token)
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {str(e)}")
+            continue
+        for name, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                names = tuple(labels)
+                lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {float(value)}")
+    return "\n".join(lines) + "\n"
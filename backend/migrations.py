@@ -0,0 +1,369 @@
+import logging
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import text, inspect
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations. Base.metadata.create_all only creates missing
+# tables, so anything that changes an existing table (indexes, columns)
+# goes here and is applied once per database, in order. Every step must be
+# safe to run against a database that create_all has just built.
+
+def _create_hot_path_indexes(conn, dialect):
+    # Conversations by user and channel get their unique index in migration 4
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_conversations_user_updated "
+        "ON conversations (user_id, updated_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created "
+        "ON messages (conversation_id, created_at)"
+    ))
+
+
+def _add_column(conn, table, column, ddl_type):
+    # create_all already adds the column on fresh databases
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _add_conversation_summaries(conn, dialect):
+    _add_column(conn, "conversations", "summary", "TEXT")
+    _add_column(conn, "conversations", "summarized_through_id", "INTEGER")
+
+
+def _add_message_fingerprints(conn, dialect):
+    # Existing rows stay NULL; the loop check fingerprints those on read
+    _add_column(conn, "messages", "fingerprint", "BIGINT")
+
+
+def _unique_conversation_per_channel(conn, dialect):
+    # Merge duplicate conversations into the oldest one, then enforce one
+    # conversation per (user_id, channel_id) so concurrent creators in
+    # different workers can't both insert
+    duplicate = (
+        "EXISTS (SELECT 1 FROM conversations d WHERE d.user_id = {c}.user_id "
+        "AND d.channel_id = {c}.channel_id AND d.id < {c}.id)"
+    )
+    conn.execute(text(
+        "UPDATE messages SET conversation_id = ("
+        "SELECT MIN(k.id) FROM conversations c JOIN conversations k "
+        "ON k.user_id = c.user_id AND k.channel_id = c.channel_id "
+        "WHERE c.id = messages.conversation_id) "
+        "WHERE conversation_id IN (SELECT c.id FROM conversations c WHERE " + duplicate.format(c="c") + ")"
+    ))
+    conn.execute(text("DELETE FROM conversations WHERE " + duplicate.format(c="conversations")))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_conversations_user_channel "
+        "ON conversations (user_id, channel_id)"
+    ))
+
+
+def _create_message_search_index(conn, dialect):
+    # Full-text index over message content, kept in sync by the database
+    if dialect == "postgresql":
+        # A plain tsvector column kept up to date by a trigger. Adding it
+        # doesn't touch existing rows, where a stored generated column would
+        # rewrite the table under an exclusive lock before the app can
+        # serve. build_search_index fills in older rows and builds the GIN
+        # index once the app is up.
+        conn.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector"))
+        conn.execute(text("DROP TRIGGER IF EXISTS messages_content_tsv ON messages"))
+        conn.execute(text(
+            "CREATE TRIGGER messages_content_tsv BEFORE INSERT OR UPDATE OF content ON messages "
+            "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(content_tsv, 'pg_catalog.english', content)"
+        ))
+        return
+    if dialect != "sqlite":
+        return
+    try:
+        # user_key is the hex-encoded owner, so a search can be narrowed to
+        # one user inside the index instead of after it
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts "
+            "USING fts5(content, user_key, tokenize='porter unicode61')"
+        ))
+    except Exception as e:
+        logger.warning(f"SQLite FTS5 is unavailable, search will scan messages: {str(e)}")
+        return
+    conn.execute(text("DELETE FROM messages_fts"))
+    conn.execute(text(
+        "INSERT INTO messages_fts (rowid, content, user_key) "
+        "SELECT m.id, m.content, hex(c.user_id) FROM messages m "
+        "JOIN conversations c ON c.id = m.conversation_id"
+    ))
+    index_new = (
+        "INSERT INTO messages_fts (rowid, content, user_key) "
+        "SELECT new.id, new.content, hex(user_id) FROM conversations WHERE id = new.conversation_id;"
+    )
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        + index_new + " END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "DELETE FROM messages_fts WHERE rowid = old.id; END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, conversation_id ON messages BEGIN "
+        "DELETE FROM messages_fts WHERE rowid = old.id; " + index_new + " END"
+    ))
+
+
+def _add_conversation_archive(conn, dialect):
+    # The conversation_archives table itself comes from create_all
+    _add_column(conn, "conversations", "archived_through_id", "INTEGER")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_conversations_updated ON conversations (updated_at)"
+    ))
+
+
+def _backfill_conversation_activity(conn, dialect):
+    # Before messages bumped it, updated_at kept the creation time. Archiving
+    # and the history order both read it as the last activity.
+    last_message = "(SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id)"
+    conn.execute(text(
+        f"UPDATE conversations SET updated_at = {last_message} "
+        f"WHERE {last_message} IS NOT NULL "
+        f"AND (updated_at IS NULL OR updated_at < {last_message})"
+    ))
+
+
+def _monotonic_message_ids(conn, dialect):
+    # Without AUTOINCREMENT, SQLite hands out the highest rowid again once it
+    # is deleted, and archiving deletes a conversation's messages, which may
+    # be the newest in the table. Everything that tracks messages by id
+    # would then skip the reused ones. Postgres sequences never go back.
+    if dialect != "sqlite":
+        return
+    table_sql = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+    )).scalar()
+    if "AUTOINCREMENT" not in table_sql.upper():
+        # SQLite can't alter a primary key: rebuild the table, keeping ids,
+        # and put back its indexes and triggers, which go with the old table
+        columns = [column for column in inspect(conn).get_columns("messages") if column["name"] != "id"]
+        names = ", ".join(column["name"] for column in columns)
+        definitions = ", ".join(
+            f"{column['name']} {column['type']}" + ("" if column["nullable"] else " NOT NULL")
+            for column in columns
+        )
+        attached = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+            "AND tbl_name = 'messages' AND sql IS NOT NULL ORDER BY type"
+        )).scalars().all()
+        conn.execute(text(
+            f"CREATE TABLE messages_rebuilt (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, {definitions}, "
+            "FOREIGN KEY(conversation_id) REFERENCES conversations (id))"
+        ))
+        conn.execute(text(f"INSERT INTO messages_rebuilt (id, {names}) SELECT id, {names} FROM messages"))
+        conn.execute(text("DROP TABLE messages"))
+        conn.execute(text("ALTER TABLE messages_rebuilt RENAME TO messages"))
+        for sql in attached:
+            conn.execute(text(sql))
+    # Ids of archived messages may already be past the highest one left
+    highest = conn.execute(text(
+        "SELECT MAX(COALESCE(archived_through_id, 0)) FROM conversations"
+    )).scalar() or 0
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', 0 "
+                      "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')"))
+    conn.execute(text(
+        "UPDATE sqlite_sequence SET seq = :highest WHERE name = 'messages' AND seq < :highest"
+    ), {"highest": highest})
+
+
+def _add_turn_claims(conn, dialect):
+    # The turn_claims table itself comes from create_all
+    pass
+
+
+MIGRATIONS = [
+    (1, "hot path indexes", _create_hot_path_indexes),
+    (2, "rolling conversation summaries", _add_conversation_summaries),
+    (3, "message fingerprints", _add_message_fingerprints),
+    (4, "unique conversation per channel", _unique_conversation_per_channel),
+    (5, "message full-text search", _create_message_search_index),
+    (6, "conversation archive", _add_conversation_archive),
+    (7, "backfill conversation activity", _backfill_conversation_activity),
+    (8, "monotonic message ids", _monotonic_message_ids),
+    (9, "turn claims", _add_turn_claims),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Arbitrary key for the Postgres advisory lock held while migrating, so
+# several workers starting at once don't race each other
+MIGRATION_LOCK_KEY = 72173001
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def get_schema_version(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        version = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+    return version or 0
+
+
+def run_migrations(engine):
+    dialect = engine.dialect.name
+    applied = []
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        _ensure_version_table(conn)
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info(f"Applying schema migration {version}: {name}")
+            migrate(conn, dialect)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()}
+            )
+            applied.append(version)
+
+    if applied:
+        logger.info(f"Schema migrated to version {applied[-1]}")
+    return applied
+
+
+SEARCH_INDEX_NAME = "ix_messages_content_tsv"
+SEARCH_BACKFILL_BATCH = 5000
+# Held by the worker filling in search vectors, so the others skip it
+SEARCH_INDEX_LOCK_KEY = 72173002
+
+
+def _index_state(conn, name):
+    # None if the index doesn't exist, else whether it is valid (a failed
+    # CREATE INDEX CONCURRENTLY leaves an invalid one behind)
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": name}).scalar()
+
+
+def build_search_index(engine, batch_size=SEARCH_BACKFILL_BATCH):
+    # Postgres only, run once the app is serving. Fills in content_tsv for
+    # messages from before migration 5 in short batches, then builds the GIN
+    # index with CREATE INDEX CONCURRENTLY, so neither holds up writes.
+    # Until it has finished, search misses those older messages. Returns
+    # whether the index is in place; False when another worker is building it.
+    if engine.dialect.name != "postgresql":
+        return True
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if _index_state(conn, SEARCH_INDEX_NAME):
+            return True
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SEARCH_INDEX_LOCK_KEY}).scalar():
+            return False
+        try:
+            # Rows saved from here on are filled in by the trigger
+            max_id = conn.execute(text("SELECT MAX(id) FROM messages")).scalar() or 0
+            for after_id in range(0, max_id, batch_size):
+                conn.execute(text(
+                    "UPDATE messages SET content_tsv = to_tsvector('english', coalesce(content, '')) "
+                    "WHERE id > :after_id AND id <= :until_id AND content_tsv IS NULL"
+                ), {"after_id": after_id, "until_id": after_id + batch_size})
+
+            if _index_state(conn, SEARCH_INDEX_NAME) is False:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {SEARCH_INDEX_NAME}"))
+            try:
+                # With btree_gin the index also holds conversation_id, so a
+                # search only reads the matches in the user's own conversations
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+                columns = "conversation_id, content_tsv"
+            except Exception as e:
+                logger.warning(f"btree_gin is unavailable, indexing message search vectors alone: {str(e)}")
+                columns = "content_tsv"
+            started_at = time.perf_counter()
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {SEARCH_INDEX_NAME} ON messages USING GIN ({columns})"
+            ))
+            logger.info(f"Built message search index in {time.perf_counter() - started_at:.1f}s")
+            return True
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SEARCH_INDEX_LOCK_KEY})
+
+
+# Hot queries and the index each one is expected to use
+PLAN_CHECKS = [
+    (
+        "conversation by user and channel",
+        "SELECT id FROM conversations WHERE user_id = :user_id AND channel_id = :channel_id",
+        {"user_id": "u", "channel_id": "c"},
+        "ux_conversations_user_channel",
+    ),
+    (
+        "conversation history page",
+        "SELECT id FROM conversations WHERE user_id = :user_id "
+        "ORDER BY updated_at DESC, id DESC LIMIT 21",
+        {"user_id": "u"},
+        "ix_conversations_user_updated",
+    ),
+    (
+        "recent messages in conversation",
+        "SELECT id FROM messages WHERE conversation_id = :conversation_id "
+        "ORDER BY created_at DESC, id DESC LIMIT 10",
+        {"conversation_id": 1},
+        "ix_messages_conversation_created",
+    ),
+]
+
+
+def explain(conn, dialect, sql, params):
+    if dialect == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+        return "\n".join(str(row[-1]) for row in rows)
+    rows = conn.execute(text(f"EXPLAIN {sql}"), params).fetchall()
+    return "\n".join(str(row[0]) for row in rows)
+
+
+def check_query_plans(engine, checks=None):
+    # Returns (name, plan) for every hot query whose plan does not use its
+    # expected index. An empty list means all plans are as expected.
+    dialect = engine.dialect.name
+    failures = []
+    with engine.connect() as conn:
+        with conn.begin():
+            if dialect == "postgresql":
+                # Small tables make a seq scan, or a sort over a few rows,
+                # look cheapest; rule both out so the check reflects which
+                # index the planner would pick at scale
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                conn.execute(text("SET LOCAL enable_sort = off"))
+            for name, sql, params, index_name in checks or PLAN_CHECKS:
+                plan = explain(conn, dialect, sql, params)
+                if index_name not in plan:
+                    failures.append((name, plan))
+    return failures
+
+
+if __name__ == "__main__":
+    # python migrations.py [--check-plans]
+    from main import engine, Base
+
+    Base.metadata.create_all(bind=engine)
+    applied = run_migrations(engine)
+    print(f"Schema version {get_schema_version(engine)} (applied: {applied or 'none'})")
+    if build_search_index(engine):
+        print("Message search index is in place")
+    if "--check-plans" in sys.argv:
+        failures = check_query_plans(engine)
+        for name, plan in failures:
+            print(f"Query plan check failed for {name}:\n{plan}")
+        if failures:
+            sys.exit(1)
+        print("All query plans use their expected indexes")
@@ -0,0 +1,129 @@
+import os
+
+# Token budget for the whole prompt sent to Gemini
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROFILE_TOKEN_LIMIT = 150
+SUMMARY_TOKEN_LIMIT = 350
+MEMORY_TOKEN_LIMIT = 250
+MESSAGE_TOKEN_LIMIT = 300
+
+INSTRUCTIONS = "You are an AI coach having a conversation with a user. Answer their questions directly and helpfully."
+
+CLOSING = """Important: If the user is asking about a specific topic like 'transformers', 'python', etc.,
+provide a direct, informative answer about that topic. Do not repeat an introduction."""
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for
+    # budgeting without pulling in a tokenizer
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - 3)].rstrip() + "..."
+
+
+def format_message(role, content):
+    return f"{'User' if role == 'user' else 'AI'}: {truncate_to_tokens(content, MESSAGE_TOKEN_LIMIT)}"
+
+
+def format_profile(goals, preferences):
+    lines = []
+    if goals:
+        lines.append("Goals: " + "; ".join(str(goal) for goal in goals))
+    if preferences:
+        lines.append("Preferences: " + "; ".join(f"{key}: {value}" for key, value in preferences.items()))
+    return truncate_to_tokens("\n".join(lines), PROFILE_TOKEN_LIMIT) if lines else ""
+
+
+class BuiltPrompt:
+    def __init__(self, text, context_lines, message_count):
+        self.text = text
+        # Everything besides the question that went into the prompt; used
+        # to key the response cache
+        self.context_lines = context_lines
+        self.message_count = message_count
+
+
+def build_prompt(message, recent_messages, summary=None, goals=None, preferences=None,
+                 memories=None, budget=PROMPT_TOKEN_BUDGET):
+    # recent_messages is newest first; memories are (role, content) pairs from
+    # other conversations, most relevant first. The question, instructions,
+    # profile and summary always go in, then memories up to their limit; recent turns fill whatever budget remains,
+    # newest first, so prompt size stays flat however long the conversation.
+    question = truncate_to_tokens(message, budget // 2)
+    remaining = budget - estimate_tokens(INSTRUCTIONS) - estimate_tokens(CLOSING) - estimate_tokens(question) - 20
+
+    context_lines = []
+    sections = []
+
+    profile = format_profile(goals, preferences)
+    if profile:
+        sections.append(f"About the user:\n{profile}")
+        context_lines.append(profile)
+        remaining -= estimate_tokens(profile)
+
+    if summary:
+        summary = truncate_to_tokens(summary, SUMMARY_TOKEN_LIMIT)
+        sections.append(f"Summary of the earlier conversation:\n{summary}")
+        context_lines.append(summary)
+        remaining -= estimate_tokens(summary)
+
+    memory_lines = []
+    memory_budget = min(MEMORY_TOKEN_LIMIT, remaining // 3)
+    for role, content in memories or []:
+        line = format_message(role, content)
+        cost = estimate_tokens(line) + 1
+        if cost > memory_budget:
+            break
+        memory_lines.append(line)
+        memory_budget -= cost
+        remaining -= cost
+    if memory_lines:
+        sections.append("Relevant messages from earlier conversations:\n" + "\n".join(memory_lines))
+        context_lines.extend(memory_lines)
+
+    history_lines = []
+    for msg in recent_messages:
+        line = format_message(msg.role, msg.content)
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        history_lines.append(line)
+        remaining -= cost
+    history_lines.reverse()
+    context_lines.extend(history_lines)
+
+    conversation_history = "\n".join(history_lines)
+    context = "".join(f"{section}\n\n" for section in sections)
+    text = f"""
+{INSTRUCTIONS}
+
+{context}Previous messages:
+{conversation_history}
+
+User's latest question: {question}
+
+{CLOSING}
+"""
+    return BuiltPrompt(text, context_lines, len(history_lines))
+
+
+def build_summary_prompt(previous_summary, messages):
+    transcript = "\n".join(format_message(msg.role, msg.content) for msg in messages)
+    previous = previous_summary or "(none yet)"
+    return f"""
+You maintain a running summary of a coaching conversation between a user and an AI coach.
+
+Current summary:
+{previous}
+
+New messages since that summary:
+{transcript}
+
+Rewrite the summary so it also covers the new messages. Keep the user's goals, questions,
+progress, and anything the coach promised or recommended. Use at most 150 words of plain prose.
+"""
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+KNOWN_USER_CACHE_SIZE = int(os.getenv("KNOWN_USER_CACHE_SIZE", "10000"))
+KNOWN_CHANNEL_CACHE_SIZE = int(os.getenv("KNOWN_CHANNEL_CACHE_SIZE", "10000"))
+
+
+class ProvisionRegistry:
+    # Size-bounded record of IDs (users, channels) already provisioned in
+    # the database and in Stream. Concurrent provisioning of the same ID
+    # shares one task.
+    def __init__(self, max_size=KNOWN_USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._known = OrderedDict()
+        self._pending = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "provisioned": 0, "errors": 0}
+
+    def __contains__(self, key):
+        return key in self._known
+
+    def __len__(self):
+        return len(self._known)
+
+    def add(self, key):
+        self._known[key] = True
+        self._known.move_to_end(key)
+        while len(self._known) > self.max_size:
+            self._known.popitem(last=False)
+
+    def discard(self, key):
+        self._known.pop(key, None)
+
+    async def _provision(self, key, provision):
+        try:
+            await provision()
+            self.add(key)
+            self.stats["provisioned"] += 1
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+    async def ensure(self, key, provision):
+        # provision is an async callable that creates the entry if needed
+        if key in self._known:
+            self._known.move_to_end(key)
+            self.stats["hits"] += 1
+            return
+
+        task = self._pending.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._provision(key, provision))
+            self._pending[key] = task
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded so one cancelled request doesn't cancel the others' wait
+        await asyncio.shield(task)
+
+    def snapshot(self):
+        return {
+            "entries": len(self._known),
+            "max_entries": self.max_size,
+            "in_flight": len(self._pending),
+            **self.stats
+        }
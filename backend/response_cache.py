@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Optional shared backend, e.g. redis://localhost:6379/0
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+
+def normalize_text(text):
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def make_cache_key(message, history_lines):
+    # history_lines is the same short history that goes into the prompt, so
+    # a hit can only return a reply generated for an equivalent prompt
+    parts = [normalize_text(line) for line in history_lines]
+    parts.append(normalize_text(message))
+    digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+    return f"ai_coach:reply:{digest}"
+
+
+class MemoryCacheBackend:
+    # In-process LRU with per-entry TTL. Also serves as the stand-in for a
+    # shared backend in local runs.
+    shared = False
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    shared = True
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        # Optional dependency, only needed when RESPONSE_CACHE_URL is set
+        import redis
+
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, decode_responses=True)
+        self.evictions = 0
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value):
+        self._client.set(key, value, ex=int(self.ttl))
+
+    def __len__(self):
+        return 0
+
+
+class ResponseCache:
+    # Local LRU in front of an optional shared backend. Failures in the
+    # shared backend are logged and treated as misses.
+    def __init__(self, local=None, shared=None, enabled=RESPONSE_CACHE_ENABLED):
+        self.enabled = enabled
+        self.local = local or MemoryCacheBackend()
+        self.shared = shared
+        self.stats = {"hits": 0, "misses": 0, "shared_hits": 0, "sets": 0, "errors": 0}
+
+    async def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                value = await loop.run_in_executor(None, self.shared.get, key)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Shared response cache read failed: {str(e)}")
+                value = None
+            if value is not None:
+                self.stats["shared_hits"] += 1
+                self.local.set(key, value)
+        if value is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return value
+
+    async def set(self, key, value):
+        if not self.enabled or not value:
+            return
+        self.local.set(key, value)
+        self.stats["sets"] += 1
+        if self.shared is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.shared.set, key, value)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Shared response cache write failed: {str(e)}")
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.local),
+            "max_entries": self.local.max_entries,
+            "ttl_seconds": self.local.ttl,
+            "evictions": self.local.evictions,
+            "shared_backend": type(self.shared).__name__ if self.shared is not None else None,
+            **self.stats
+        }
+
+
+def create_response_cache():
+    shared = None
+    if RESPONSE_CACHE_URL:
+        try:
+            shared = RedisCacheBackend(RESPONSE_CACHE_URL)
+            logger.info("Shared response cache configured")
+        except Exception as e:
+            logger.error(f"Error configuring shared response cache: {str(e)}")
+    return ResponseCache(shared=shared)
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Hashed vocabulary size. Messages are stored sparsely, so this only sizes
+# each user's document frequencies (4 bytes per dimension).
+RETRIEVAL_DIMENSIONS = int(os.getenv("RETRIEVAL_DIMENSIONS", "512"))
+RETRIEVAL_MAX_MESSAGES = int(os.getenv("RETRIEVAL_MAX_MESSAGES", "2000"))
+RETRIEVAL_MAX_USERS = int(os.getenv("RETRIEVAL_MAX_USERS", "500"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.2"))
+SNIPPET_CHARS = 300
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do for from has have how i if in is it its me my not of on or "
+    "so that the this to was we what when which who why will with you your".split()
+)
+
+
+@lru_cache(maxsize=65536)
+def _bucket(token, dimensions):
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % dimensions
+
+
+def term_vector(text, dimensions=RETRIEVAL_DIMENSIONS):
+    # Hashed bag of words with sublinear term frequency, as (buckets,
+    # weights) of its non-zero entries
+    counts = Counter(
+        _bucket(token, dimensions) for token in _TOKEN.findall((text or "").lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    )
+    buckets = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return buckets, np.log1p(weights)
+
+
+class UserIndex:
+    # Term vectors of one user's messages, stored sparsely: the non-zero
+    # buckets and weights of every message one after another in growable
+    # arrays, with the row each entry belongs to (a COO matrix in row
+    # order). Memory grows with the distinct terms of the messages, not
+    # with dimensions. doc_freq holds document frequencies for IDF. Rows
+    # are stored L2-normalised and IDF is applied on the query side only,
+    # so scoring is one gather and bincount over the entries, and adding a
+    # message never touches the other rows.
+    # high_water is the highest message id added, so the index can catch up
+    # on messages saved since (by this worker or any other).
+    def __init__(self, dimensions=RETRIEVAL_DIMENSIONS, capacity=RETRIEVAL_MAX_MESSAGES):
+        self.dimensions = dimensions
+        self.capacity = capacity
+        self.buckets = np.zeros(1024, dtype=np.int32)
+        self.weights = np.zeros(1024, dtype=np.float32)
+        self.rows = np.zeros(1024, dtype=np.int32)
+        self.entries = 0
+        self.conversation_ids = np.zeros(64, dtype=np.int64)
+        self.doc_freq = np.zeros(dimensions, dtype=np.float32)
+        self.snippets = []
+        self.count = 0
+        self.high_water = 0
+        self.lock = threading.Lock()
+
+    def add(self, message_id, conversation_id, role, content):
+        # Returns whether the message was new to the index
+        buckets, weights = term_vector(content, self.dimensions)
+        norm = float(np.linalg.norm(weights))
+        with self.lock:
+            # Concurrent catch-ups may fetch the same rows
+            if message_id <= self.high_water:
+                return False
+            self.high_water = message_id
+            if not norm:
+                return True
+            if self.count >= self.capacity:
+                self._drop_oldest(max(1, self.capacity // 4))
+            if self.count == len(self.conversation_ids):
+                self.conversation_ids = np.resize(self.conversation_ids, min(self.capacity, self.count * 2))
+            end = self.entries + len(buckets)
+            if end > len(self.buckets):
+                size = max(end, len(self.buckets) * 2)
+                self.buckets = np.resize(self.buckets, size)
+                self.weights = np.resize(self.weights, size)
+                self.rows = np.resize(self.rows, size)
+            self.buckets[self.entries:end] = buckets
+            self.weights[self.entries:end] = weights / norm
+            self.rows[self.entries:end] = self.count
+            self.entries = end
+            self.conversation_ids[self.count] = conversation_id
+            self.doc_freq[buckets] += 1
+            self.snippets.append((role, content[:SNIPPET_CHARS]))
+            self.count += 1
+        return True
+
+    def _drop_oldest(self, n):
+        cut = int(np.searchsorted(self.rows[:self.entries], n))
+        self.doc_freq -= np.bincount(self.buckets[:cut], minlength=self.dimensions)
+        kept = self.entries - cut
+        self.buckets[:kept] = self.buckets[cut:self.entries]
+        self.weights[:kept] = self.weights[cut:self.entries]
+        self.rows[:kept] = self.rows[cut:self.entries] - n
+        self.entries = kept
+        self.conversation_ids[:self.count - n] = self.conversation_ids[n:self.count]
+        del self.snippets[:n]
+        self.count -= n
+
+    def search(self, query, k=RETRIEVAL_TOP_K, exclude_conversation_id=None, min_score=RETRIEVAL_MIN_SCORE):
+        query_buckets, query_weights = term_vector(query, self.dimensions)
+        with self.lock:
+            if not self.count or not len(query_buckets):
+                return []
+            idf = np.log((self.count + 1.0) / (self.doc_freq + 1.0)) + 1.0
+            weighted = np.zeros(self.dimensions, dtype=np.float32)
+            weighted[query_buckets] = query_weights * idf[query_buckets]
+            weighted /= np.linalg.norm(weighted)
+            entries = slice(0, self.entries)
+            scores = np.bincount(
+                self.rows[entries], weights=self.weights[entries] * weighted[self.buckets[entries]],
+                minlength=self.count
+            )
+            if exclude_conversation_id is not None:
+                scores[self.conversation_ids[:self.count] == exclude_conversation_id] = -1.0
+            k = min(k, self.count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (float(scores[i]), self.snippets[i][0], self.snippets[i][1])
+                for i in top if scores[i] >= min_score
+            ]
+
+    def nbytes(self):
+        # Approximate memory held, snippets included
+        arrays = (self.buckets, self.weights, self.rows, self.conversation_ids, self.doc_freq)
+        return sum(array.nbytes for array in arrays) + sum(len(content) for _, content in self.snippets)
+
+    def __len__(self):
+        return self.count
+
+
+class RetrievalIndex:
+    # Per-user indexes, built from the database before a user's first search
+    # and brought up to date from it before every later one (see
+    # load_memory_index in main.py). Least recently used users are evicted
+    # past max_users.
+    def __init__(self, max_users=RETRIEVAL_MAX_USERS, enabled=RETRIEVAL_ENABLED):
+        self.max_users = max_users
+        self.enabled = enabled
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"builds": 0, "searches": 0, "indexed": 0, "search_seconds_total": 0.0}
+
+    def _get(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            return index
+
+    def high_water(self, user_id):
+        # Highest message id in the user's index, or None if it isn't built
+        index = self._get(user_id)
+        return index.high_water if index is not None else None
+
+    def build(self, user_id, rows):
+        # rows are (id, conversation_id, role, content), oldest first.
+        # CPU-bound for large histories, so run it off the event loop.
+        index = UserIndex()
+        for message_id, conversation_id, role, content in rows:
+            index.add(message_id, conversation_id, role, content)
+        with self._lock:
+            existing = self._users.get(user_id)
+            if existing is not None:
+                return existing
+            self._users[user_id] = index
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self.stats["builds"] += 1
+        return index
+
+    def extend(self, user_id, rows):
+        # Rows newer than the index's high water, in the same shape and
+        # order as for build. Only users with a loaded index; the rest are
+        # built from the database when they next search.
+        if not self.enabled:
+            return
+        index = self._get(user_id)
+        if index is None:
+            return
+        for message_id, conversation_id, role, content in rows:
+            if index.add(message_id, conversation_id, role, content):
+                self.stats["indexed"] += 1
+
+    def search(self, user_id, query, exclude_conversation_id=None, k=RETRIEVAL_TOP_K):
+        # Users without a built index get no results
+        if not self.enabled:
+            return []
+        index = self._get(user_id)
+        if index is None:
+            return []
+        started_at = time.perf_counter()
+        results = index.search(query, k=k, exclude_conversation_id=exclude_conversation_id)
+        self.stats["searches"] += 1
+        self.stats["search_seconds_total"] += time.perf_counter() - started_at
+        return results
+
+    def snapshot(self):
+        with self._lock:
+            messages = sum(len(index) for index in self._users.values())
+            memory_bytes = sum(index.nbytes() for index in self._users.values())
+            users = len(self._users)
+        return {
+            "enabled": self.enabled,
+            "users": users,
+            "max_users": self.max_users,
+            "messages": messages,
+            "bytes": memory_bytes,
+            "dimensions": RETRIEVAL_DIMENSIONS,
+            **self.stats
+        }
+
+
+memory_index = RetrievalIndex()
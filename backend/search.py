@@ -0,0 +1,122 @@
+import html
+import re
+
+from sqlalchemy import DateTime, Float, text
+
+# Message search over the database's full-text index: FTS5 on SQLite, a GIN
+# index on a trigger-maintained tsvector column on Postgres (both schema
+# migration 5). Without either (FTS5 missing, other databases) it falls
+# back to a substring scan of the user's messages.
+
+SNIPPET_WORDS = 24
+# Match markers the database puts around hits; replaced with <mark> after
+# the snippet is HTML-escaped, so message content can't inject markup
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_fts5_available = {}
+# Raw SQL results don't get column types; SQLite would return strings
+_RESULT_TYPES = {"created_at": DateTime, "score": Float}
+
+
+def has_fts5_index(db):
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _fts5_available:
+        _fts5_available[key] = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+        ).first() is not None
+    return _fts5_available[key]
+
+
+def fts5_match(user_id, query):
+    # Each word quoted so FTS5 operators in user input are taken literally;
+    # the last one matches as a prefix for search-as-you-type
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return f'user_key:"{user_id.encode("utf-8").hex()}" AND content:({" ".join(terms)})'
+
+
+def format_snippet(snippet):
+    escaped = html.escape(snippet or "")
+    return escaped.replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def _search_sqlite(db, user_id, query, limit, offset):
+    match = fts5_match(user_id, query)
+    if match is None:
+        return []
+    return db.execute(text(
+        "SELECT m.id, c.channel_id, m.role, m.created_at, "
+        "snippet(messages_fts, 0, :start, :end, '...', :words) AS snippet, "
+        "-bm25(messages_fts) AS score "
+        "FROM messages_fts "
+        "JOIN messages m ON m.id = messages_fts.rowid "
+        "JOIN conversations c ON c.id = m.conversation_id "
+        "WHERE messages_fts MATCH :match AND c.user_id = :user_id "
+        "ORDER BY bm25(messages_fts), m.id DESC LIMIT :limit OFFSET :offset"
+    ).columns(**_RESULT_TYPES), {
+        "start": _MARK_START, "end": _MARK_END, "words": SNIPPET_WORDS, "match": match,
+        "user_id": user_id, "limit": limit, "offset": offset
+    }).all()
+
+
+def _search_postgresql(db, user_id, query, limit, offset):
+    # Matches are found and ranked on the stored content_tsv column, starting
+    # from the user's conversations. Snippets are only built for the page.
+    return db.execute(text(
+        "SELECT r.id, r.channel_id, r.role, r.created_at, "
+        "ts_headline('english', r.content, r.q, :options) AS snippet, r.score "
+        "FROM ("
+        "SELECT m.id, c.channel_id, m.role, m.created_at, m.content, q, "
+        "ts_rank_cd(m.content_tsv, q) AS score "
+        "FROM conversations c "
+        "JOIN messages m ON m.conversation_id = c.id, "
+        "websearch_to_tsquery('english', :query) q "
+        "WHERE c.user_id = :user_id AND m.content_tsv @@ q "
+        "ORDER BY score DESC, m.id DESC LIMIT :limit OFFSET :offset"
+        ") r ORDER BY r.score DESC, r.id DESC"
+    ).columns(**_RESULT_TYPES), {
+        "options": f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=8, MaxFragments=2",
+        "query": query, "user_id": user_id, "limit": limit, "offset": offset
+    }).all()
+
+
+def _search_scan(db, user_id, query, limit, offset):
+    needle = query.strip().lower()
+    if not needle:
+        return []
+    pattern = "%" + needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    rows = db.execute(text(
+        "SELECT m.id, c.channel_id, m.role, m.created_at, m.content "
+        "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+        "WHERE c.user_id = :user_id AND lower(m.content) LIKE :pattern ESCAPE '\\' "
+        "ORDER BY m.id DESC LIMIT :limit OFFSET :offset"
+    ).columns(**_RESULT_TYPES), {"user_id": user_id, "pattern": pattern, "limit": limit, "offset": offset}).all()
+    results = []
+    for row in rows:
+        content = row.content or ""
+        at = content.lower().find(needle)
+        start = max(0, at - 80)
+        snippet = (
+            ("..." if start else "") + content[start:at]
+            + _MARK_START + content[at:at + len(needle)] + _MARK_END
+            + content[at + len(needle):at + len(needle) + 80]
+        )
+        results.append((row.id, row.channel_id, row.role, row.created_at, snippet, 1.0))
+    return results
+
+
+def search_messages(db, user_id, query, limit, offset):
+    # Returns (message id, channel_id, role, created_at, snippet, score),
+    # best match first
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return _search_postgresql(db, user_id, query, limit, offset)
+    if dialect == "sqlite" and has_fts5_index(db):
+        return _search_sqlite(db, user_id, query, limit, offset)
+    return _search_scan(db, user_id, query, limit, offset)
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main reads its settings at import time, so point it at a throwaway
+# database (or TEST_DATABASE_URL) before any test imports it
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+)
+os.environ["FAKE_BACKENDS"] = "true"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def llm_gate(monkeypatch):
+    # The app's lifespan shuts the shared gate's executor down, so tests
+    # that call the LLM after a TestClient run get a fresh one
+    import llm
+    gate = llm.LLMGate()
+    monkeypatch.setattr(llm, "llm_gate", gate)
+    yield gate
+    gate.shutdown()
@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import CircuitBreaker, RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_token_bucket_refills_up_to_its_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    bucket.tokens = 0
+    assert bucket.wait_seconds() == 0.5
+    clock.value += 0.25
+    bucket.refill(clock.value)
+    assert bucket.tokens == 0.5
+    assert bucket.wait_seconds() == 0.25
+    clock.value += 10
+    bucket.refill(clock.value)
+    assert bucket.tokens == 3
+    assert bucket.wait_seconds() == 0
+
+
+def test_rate_limiter_allows_a_burst_then_the_rate(clock):
+    limiter = RateLimiter(rate=1, burst=2, global_rate=0)
+    assert limiter.acquire("u") == 0
+    assert limiter.acquire("u") == 0
+    assert limiter.acquire("u") == 1.0
+    # Other users have their own bucket
+    assert limiter.acquire("v") == 0
+    clock.value += 1
+    assert limiter.acquire("u") == 0
+    assert limiter.stats == {"allowed": 4, "limited_user": 1, "limited_global": 0}
+
+
+def test_global_limit_does_not_spend_user_tokens(clock):
+    # Users refill too slowly to matter here
+    limiter = RateLimiter(rate=0.001, burst=2, global_rate=1, global_burst=1)
+    assert limiter.acquire("u") == 0
+    assert limiter.acquire("u") == 1.0
+    assert limiter.stats["limited_global"] == 1
+    clock.value += 1
+    # The refused request left u's second token in place
+    assert limiter.acquire("u") == 0
+
+
+def test_rate_limiter_forgets_least_recent_users(clock):
+    limiter = RateLimiter(rate=1, burst=1, global_rate=0, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key)
+    assert limiter.snapshot()["tracked_users"] == 2
+    # "a" was evicted, so it starts with a full bucket again
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("c") == 1.0
+
+
+def test_breaker_opens_on_failures_and_closes_after_a_good_probe(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, failure_ratio=0.5, cooldown=30)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats == {"opened": 1, "rejected": 1}
+
+    clock.value += 30
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["recent_calls"] == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_and_abandoned_probe_expires(clock):
+    breaker = CircuitBreaker(window=10, min_calls=2, failure_ratio=0.5, cooldown=30)
+    breaker.record(False)
+    breaker.record(False)
+    clock.value += 30
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.stats["opened"] == 2
+
+    clock.value += 30
+    assert breaker.allow()
+    # The probe never reports back; another is let through after the cooldown
+    clock.value += 29
+    assert not breaker.allow()
+    clock.value += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def archived_conversation(db, user_id, channel_id, turns):
+    # A conversation whose turns are long past the archiving cutoff, then
+    # archived. Its messages are the newest in the table, so archiving
+    # deletes the table's highest ids.
+    main.setup_schema()
+    main.insert_user(db, user_id, "Archive User", "learner")
+    conversation_id = main.create_conversation(db, user_id, channel_id).id
+    db.commit()
+    long_ago = main.datetime.utcnow() - timedelta(days=200)
+    for turn in range(1, turns + 1):
+        main.insert_and_commit_messages(db, [
+            {"conversation_id": conversation_id, "role": role, "content": f"{role} {turn}",
+             "fingerprint": None, "created_at": long_ago + timedelta(minutes=turn)}
+            for role in ("user", "assistant")
+        ])
+    cutoff = main.datetime.utcnow() - timedelta(days=main.ARCHIVE_AFTER_DAYS)
+    while main.archive_conversation_batch(db, 0, cutoff, 100) is not None:
+        pass
+    assert db.query(main.MessageModel).filter(main.MessageModel.conversation_id == conversation_id).count() == 0
+    return conversation_id
+
+
+def resume(db, conversation_id, *contents):
+    main.insert_and_commit_messages(db, [
+        {"conversation_id": conversation_id, "role": "user", "content": content,
+         "fingerprint": None, "created_at": main.datetime.utcnow()}
+        for content in contents
+    ])
+    return [row.id for row in db.query(main.MessageModel.id).filter(
+        main.MessageModel.conversation_id == conversation_id
+    ).order_by(main.MessageModel.id).all()]
+
+
+def test_memory_sync_after_a_conversation_is_archived_and_resumed():
+    db = main.SessionLocal()
+    try:
+        conversation_id = archived_conversation(db, "archive_sync_user", "archive-sync", 4)
+        with TestClient(main.app) as client:
+            # The user synced everything before it was archived
+            synced = client.get("/memory/archive_sync_user").json()
+            assert [msg["content"] for msg in synced["conversation_history"][0]["messages"]] == [
+                f"{role} {turn}" for turn in range(1, 5) for role in ("user", "assistant")
+            ]
+
+            archived_through_id = db.query(main.ConversationModel.archived_through_id).filter(
+                main.ConversationModel.id == conversation_id
+            ).scalar()
+            new_ids = resume(db, conversation_id, "back again", "still here")
+            assert min(new_ids) > archived_through_id
+
+            delta = client.get("/memory/archive_sync_user", params={"since": synced["sync"]})
+            assert delta.status_code == 200
+            assert delta.json()["conversation_history"] == [{"channel_id": "archive-sync", "messages": [
+                {"role": "user", "content": "back again"}, {"role": "user", "content": "still here"}
+            ]}]
+            assert client.get("/memory/archive_sync_user", params={"since": delta.json()["sync"]}).status_code == 304
+    finally:
+        db.close()
+
+
+def test_history_pages_walk_from_new_messages_into_the_archive():
+    db = main.SessionLocal()
+    try:
+        conversation_id = archived_conversation(db, "archive_page_user", "archive-page", 3)
+        resume(db, conversation_id, "new 1", "new 2")
+        with TestClient(main.app) as client:
+            pages = []
+            params = {"limit": 3}
+            while True:
+                page = client.get("/history/archive_page_user/archive-page/messages", params=params).json()
+                pages.append([msg["content"] for msg in page["messages"]])
+                if not page["next_cursor"]:
+                    break
+                params["cursor"] = page["next_cursor"]
+            summaries = client.get("/history/archive_page_user").json()["conversations"]
+    finally:
+        db.close()
+
+    # Each page oldest first, walking back from the newest message
+    assert pages == [
+        ["assistant 3", "new 1", "new 2"],
+        ["user 2", "assistant 2", "user 3"],
+        ["user 1", "assistant 1"],
+    ]
+    assert summaries[0]["message_count"] == 8
+    assert summaries[0]["title"] == "user 1"
+
+
+def test_resumed_conversation_context_includes_the_archived_tail():
+    db = main.SessionLocal()
+    try:
+        conversation_id = archived_conversation(db, "archive_context_user", "archive-context", 3)
+        resume(db, conversation_id, "picking this back up")
+        turn = main.prepare_chat_turn(db, main.ChatMessage(
+            user_id="archive_context_user", message="where were we?", channel_id="archive-context"
+        ))
+        db.rollback()
+        assert "User: user 1" in turn.prompt
+        assert "AI: assistant 3" in turn.prompt
+        assert "User: picking this back up" in turn.prompt
+        assert turn.prompt.index("AI: assistant 3") < turn.prompt.index("User: picking this back up")
+    finally:
+        db.close()
@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+import main
+
+
+class JsonRequest:
+    def __init__(self, body):
+        self.headers = {"content-type": "application/json"}
+        self._body = json.dumps(body).encode()
+
+    async def body(self):
+        return self._body
+
+
+class FailingStream:
+    def upsert_users(self, users):
+        raise RuntimeError("Stream is unavailable")
+
+
+def test_stream_failures_are_counted_apart_from_failed_users(monkeypatch):
+    main.setup_schema()
+    monkeypatch.setattr(main, "stream_client", FailingStream())
+    request = JsonRequest([
+        {"id": "bulk_user_1", "name": "Bulk One", "role": "learner"},
+        {"id": "bulk_user_2", "name": "Bulk Two", "role": "learner"},
+        {"id": "bulk_user_1", "name": "Bulk One Again", "role": "learner"},
+        {"name": "No Id"},
+    ])
+
+    async def scenario():
+        result = await main.create_users_bulk(request)
+        if main.async_engine is not None:
+            await main.async_engine.dispose()
+        return result
+
+    result = asyncio.run(scenario())
+    assert result["total"] == 4
+    assert result["created"] == 2
+    assert result["failed"] == 2
+    assert result["created"] + result["updated"] + result["failed"] == result["total"]
+    assert result["stream_failed"] == 2
+    saved = [user for user in result["results"] if user["status"] == "created"]
+    assert all(user["stream"] == "error" and "error" not in user for user in saved)
+    assert "bulk_user_1" not in main.known_users
@@ -0,0 +1,25 @@
+import asyncio
+
+import main
+
+
+def test_channel_with_a_coach_only_known_to_stream():
+    main.setup_schema()
+
+    async def scenario():
+        first = await main.create_channel(learner_id="channel_learner", coach_id="human_coach_7")
+        # A second call in a fresh worker finds the recorded channel
+        main.known_channels.discard("coach-human_coach_7-learner-channel_learner")
+        second = await main.create_channel(learner_id="channel_learner", coach_id="human_coach_7")
+        if main.async_engine is not None:
+            await main.async_engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second == {"channel_id": "coach-human_coach_7-learner-channel_learner"}
+    db = main.SessionLocal()
+    try:
+        assert main.channel_exists(db, "coach-human_coach_7-learner-channel_learner")
+        assert db.query(main.UserModel).filter(main.UserModel.id == "human_coach_7").first() is None
+    finally:
+        db.close()
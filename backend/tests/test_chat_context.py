@@ -0,0 +1,100 @@
+import main
+
+
+def start_conversation(db, user_id, channel_id):
+    main.setup_schema()
+    main.insert_user(db, user_id, "Context User", "learner")
+    conversation = main.create_conversation(db, user_id, channel_id)
+    db.commit()
+    return conversation.id
+
+
+def save_turns(db, conversation_id, first, last):
+    for turn in range(first, last + 1):
+        main.insert_and_commit_messages(db, [
+            {"conversation_id": conversation_id, "role": "user", "content": f"question {turn}",
+             "fingerprint": None, "created_at": main.datetime.utcnow()},
+            {"conversation_id": conversation_id, "role": "assistant", "content": f"answer {turn}",
+             "fingerprint": None, "created_at": main.datetime.utcnow()},
+        ])
+
+
+def test_messages_past_the_window_stay_in_the_prompt_until_summarized():
+    db = main.SessionLocal()
+    try:
+        conversation_id = start_conversation(db, "context_user", "context-channel")
+        # 16 messages: six have left the recent window, too few for a summary
+        save_turns(db, conversation_id, 1, 8)
+
+        turn = main.prepare_chat_turn(db, main.ChatMessage(
+            user_id="context_user", message="question 9", channel_id="context-channel"
+        ))
+        db.rollback()
+        assert "User: question 1" in turn.prompt
+        assert "AI: answer 8" in turn.prompt
+        assert turn.needs_summary
+
+        # Once summarized, the covered messages come from the summary instead
+        _, messages = main.load_messages_to_summarize(db, conversation_id)
+        assert [msg.content for msg in messages] == [
+            "question 1", "answer 1", "question 2", "answer 2", "question 3", "answer 3"
+        ]
+        main.store_summary(db, conversation_id, "The user asked questions one to three.", messages[-1].id)
+        db.expire_all()
+        turn = main.prepare_chat_turn(db, main.ChatMessage(
+            user_id="context_user", message="question 9", channel_id="context-channel"
+        ))
+        db.rollback()
+        assert "The user asked questions one to three." in turn.prompt
+        assert "User: question 3\n" not in turn.prompt
+        assert "User: question 4" in turn.prompt
+    finally:
+        db.close()
+
+
+class FlushingWriter:
+    # Flushes its first row when asked for its pending rows, just before or
+    # just after taking the snapshot
+    def __init__(self, rows, flush_first):
+        self.rows = rows
+        self.flush_first = flush_first
+
+    def flush(self):
+        if not self.rows:
+            return
+        db = main.SessionLocal()
+        try:
+            main.insert_and_commit_messages(db, [dict(self.rows.pop(0))])
+        finally:
+            db.close()
+
+    def pending(self, predicate):
+        if self.flush_first:
+            self.flush()
+        snapshot = [row for row in self.rows if predicate(row)]
+        if not self.flush_first:
+            self.flush()
+        return snapshot
+
+
+def test_messages_flushed_during_the_context_query_appear_once(monkeypatch):
+    db = main.SessionLocal()
+    try:
+        conversation_id = start_conversation(db, "flush_race_user", "flush-race")
+        save_turns(db, conversation_id, 1, 1)
+        for turn, flush_first in ((2, True), (3, False)):
+            now = main.datetime.utcnow()
+            queued = [
+                {"conversation_id": conversation_id, "role": role, "content": f"{role} {turn}",
+                 "fingerprint": None, "created_at": now}
+                for role in ("user", "assistant")
+            ]
+            writer = FlushingWriter(queued, flush_first)
+            monkeypatch.setattr(main, "message_writer", writer)
+            messages = main.load_context_messages(db, conversation_id)
+            assert [msg.content for msg in messages[:2]] == [f"assistant {turn}", f"user {turn}"]
+            assert messages[0].id is None and messages[1].id is not None
+            writer.flush()
+        assert len(main.load_context_messages(db, conversation_id)) == 6
+    finally:
+        db.close()
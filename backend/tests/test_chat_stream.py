@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from fakes import FakeGeminiModel, LatencyProfile
+
+
+class BrokenGemini:
+    # Fails before producing anything, like a rejected request
+    def generate_content(self, contents, generation_config=None, stream=False):
+        def chunks():
+            raise RuntimeError("model unavailable")
+            yield
+        return chunks()
+
+
+@pytest.fixture
+def stream_setup(monkeypatch, llm_gate):
+    main.setup_schema()
+    monkeypatch.setattr(main.response_cache, "enabled", False)
+
+
+def stream_reply(monkeypatch, gemini, channel_id, events_before_disconnect=None):
+    # The SSE events the client read, and the messages saved for the turn
+    monkeypatch.setattr(main, "gemini_client", gemini)
+    message = main.ChatMessage(user_id="stream_user", message="How should I warm up?", channel_id=channel_id)
+
+    async def scenario():
+        response = await main.handle_message_stream(message)
+        events = []
+        async for event in response.body_iterator:
+            events.append(event)
+            if len(events) == events_before_disconnect:
+                # The client goes away; closing the body is what Starlette does
+                await response.body_iterator.aclose()
+                break
+        if main.async_engine is not None:
+            await main.async_engine.dispose()
+        return events
+
+    events = asyncio.run(scenario())
+    db = main.SessionLocal()
+    try:
+        conversation_id = db.query(main.ConversationModel.id).filter(
+            main.ConversationModel.user_id == "stream_user", main.ConversationModel.channel_id == channel_id
+        ).scalar()
+        saved = [(row.role, row.content) for row in db.query(main.MessageModel.role, main.MessageModel.content).filter(
+            main.MessageModel.conversation_id == conversation_id
+        ).order_by(main.MessageModel.id).all()]
+    finally:
+        db.close()
+    return events, saved
+
+
+def event_data(event):
+    return json.loads(event.split("data: ", 1)[1])
+
+
+def test_streamed_reply_is_saved_once_in_full(monkeypatch, stream_setup):
+    events, saved = stream_reply(monkeypatch, FakeGeminiModel(profile=LatencyProfile()), "stream-full")
+    deltas = "".join(event_data(event)["delta"] for event in events[:-1])
+    assert events[-1].startswith("event: done")
+    assert event_data(events[-1])["ai_response"] == deltas
+    assert len(events) > 2
+    assert saved == [("user", "How should I warm up?"), ("assistant", deltas)]
+
+
+def test_disconnected_client_gets_its_partial_reply_saved(monkeypatch, stream_setup):
+    gemini = FakeGeminiModel(profile=LatencyProfile(latency_ms=200))
+    events, saved = stream_reply(monkeypatch, gemini, "stream-partial", events_before_disconnect=1)
+    received = event_data(events[0])["delta"]
+    assert saved == [("user", "How should I warm up?"), ("assistant", received)]
+    assert received.strip() and gemini.calls == 1
+
+
+def test_gemini_failure_before_the_first_chunk_streams_and_saves_the_fallback(monkeypatch, stream_setup):
+    events, saved = stream_reply(monkeypatch, BrokenGemini(), "stream-fallback")
+    assert [event_data(event) for event in events] == [
+        {"delta": main.FALLBACK_AI_RESPONSE}, {"ai_response": main.FALLBACK_AI_RESPONSE}
+    ]
+    assert saved == [("user", "How should I warm up?"), ("assistant", main.FALLBACK_AI_RESPONSE)]
@@ -0,0 +1,26 @@
+import pytest
+
+from clients import LazyClient
+
+
+def test_failed_build_is_not_retried_until_the_retry_window_passes():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("no route to host")
+        return "client"
+
+    client = LazyClient("Test", factory, retry_seconds=60)
+    # Truthiness never builds the client
+    assert client and calls == []
+    for _ in range(3):
+        with pytest.raises(Exception, match="no route to host"):
+            client.get()
+    assert len(calls) == 1
+    assert client.snapshot()["status"] == "error"
+
+    client.retry_seconds = 0
+    assert client.get() == "client"
+    assert len(calls) == 2 and client.snapshot()["status"] == "ready"
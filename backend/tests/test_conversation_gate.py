@@ -0,0 +1,160 @@
+import asyncio
+from datetime import timedelta
+
+import main
+from coalescing import ConversationGate
+from fakes import FakeGeminiModel, LatencyProfile
+
+
+def test_identical_requests_in_flight_share_one_run():
+    calls = []
+
+    async def scenario():
+        gate = ConversationGate()
+
+        async def turn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "reply"
+
+        results = await asyncio.gather(*(gate.run("conv", ("conv", "hello"), turn) for _ in range(3)))
+        # Finished turns aren't shared with later requests
+        results.append(await gate.run("conv", ("conv", "hello"), turn))
+        return results, gate.snapshot()
+
+    results, snapshot = asyncio.run(scenario())
+    assert results == ["reply"] * 4
+    assert len(calls) == 2
+    assert snapshot["coalesced"] == 2
+    assert snapshot["in_flight"] == 0 and snapshot["locked_conversations"] == 0
+
+
+def test_turns_run_one_at_a_time_per_conversation():
+    running = {"conv-a": 0, "conv-b": 0}
+    overlap = {"same": 0, "across": 0}
+
+    async def scenario():
+        gate = ConversationGate()
+
+        def turn(key):
+            async def run():
+                running[key] += 1
+                overlap["same"] = max(overlap["same"], running[key])
+                overlap["across"] = max(overlap["across"], sum(running.values()))
+                await asyncio.sleep(0.02)
+                running[key] -= 1
+                return key
+            return run
+
+        await asyncio.gather(*(
+            gate.run(key, (key, f"message {n}"), turn(key)) for n in range(3) for key in running
+        ))
+        return gate.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert overlap == {"same": 1, "across": 2}
+    assert snapshot["turns"] == 6 and snapshot["waited"] >= 4
+
+
+def test_turn_claims_serialize_and_share_across_workers():
+    main.setup_schema()
+    db = main.SessionLocal()
+    try:
+        main.insert_user(db, "claim_user", "Claim User", "learner")
+        conversation_id = main.create_conversation(db, "claim_user", "claim-channel").id
+        db.commit()
+
+        status, token = main.claim_turn(db, conversation_id, "hash-a")
+        db.commit()
+        assert status == "run"
+        assert main.claim_turn(db, conversation_id, "hash-a") == ("share", token)
+        assert main.claim_turn(db, conversation_id, "hash-b") == ("wait", None)
+
+        main.finish_turn_claim(db, conversation_id, token, "the reply")
+        db.commit()
+        claim = main.load_turn_claim(db, conversation_id)
+        assert claim.token == token and claim.response == "the reply"
+        # A finished claim goes to the next turn, even an identical message
+        status, second = main.claim_turn(db, conversation_id, "hash-a")
+        db.commit()
+        assert status == "run" and second != token
+
+        # A claim left behind by a worker that died is taken over
+        db.query(main.TurnClaimModel).filter(main.TurnClaimModel.conversation_id == conversation_id).update(
+            {"started_at": main.datetime.utcnow() - timedelta(seconds=main.TURN_CLAIM_TIMEOUT_SECONDS + 1)}
+        )
+        db.commit()
+        status, third = main.claim_turn(db, conversation_id, "hash-b")
+        db.commit()
+        assert status == "run"
+        # The old turn can no longer finish or release the claim
+        main.finish_turn_claim(db, conversation_id, second, "late reply")
+        main.release_turn_claim(db, conversation_id, second)
+        assert main.load_turn_claim(db, conversation_id).token == third
+
+        main.release_turn_claim(db, conversation_id, third)
+        assert main.load_turn_claim(db, conversation_id) is None
+    finally:
+        db.close()
+
+
+class RecordingGemini(FakeGeminiModel):
+    def __init__(self):
+        super().__init__(profile=LatencyProfile(latency_ms=200))
+        self.prompts = []
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        self.prompts.append(contents)
+        return super().generate_content(contents, generation_config, stream)
+
+
+def test_turns_on_two_workers_share_or_wait_for_the_claim(monkeypatch, llm_gate):
+    main.setup_schema()
+    gemini = RecordingGemini()
+    monkeypatch.setattr(main, "gemini_client", gemini)
+    monkeypatch.setattr(main.response_cache, "enabled", False)
+    monkeypatch.setattr(main, "TURN_CLAIM_POLL_SECONDS", 0.02)
+
+    def message(text):
+        return main.ChatMessage(user_id="two_worker_user", message=text, channel_id="two-workers")
+
+    async def scenario():
+        # run_chat_turn directly, as two workers would, without the
+        # in-process gate in front
+        now = main.datetime.utcnow()
+        first, double_send = await asyncio.gather(
+            main.run_chat_turn(message("How do I start running?"), now),
+            main.run_chat_turn(message("how do I start running"), now)
+        )
+        # A different message waits for the turn in progress, then sees it
+        other, follow_up = await asyncio.gather(
+            main.run_chat_turn(message("What shoes should I buy?"), now),
+            main.run_chat_turn(message("And how often?"), now)
+        )
+        if main.async_engine is not None:
+            await main.async_engine.dispose()
+        return first, double_send, other, follow_up
+
+    first, double_send, other, follow_up = asyncio.run(scenario())
+    assert first == double_send
+    # The double send called Gemini once; the other two ran one after the
+    # other, each seeing the turns saved before it
+    assert len(gemini.prompts) == 3
+    second, third = gemini.prompts[1:]
+    assert "start running" in second
+    earlier = "What shoes should I buy?" if "What shoes should I buy?" in second else "And how often?"
+    assert f"User: {earlier}" in third
+
+    db = main.SessionLocal()
+    try:
+        conversation = db.query(main.ConversationModel).filter(
+            main.ConversationModel.user_id == "two_worker_user"
+        ).one()
+        contents = [row.content for row in db.query(main.MessageModel.content).filter(
+            main.MessageModel.conversation_id == conversation.id
+        ).order_by(main.MessageModel.id).all()]
+    finally:
+        db.close()
+    # One stored turn for the double send, then the other two in turn
+    assert len(contents) == 6
+    assert contents[1] == first
@@ -0,0 +1,88 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+from main import encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def db():
+    main.setup_schema()
+    session = main.SessionLocal()
+    if not session.query(main.UserModel).filter(main.UserModel.id == "cursor_user").first():
+        main.insert_user(session, "cursor_user", "Cursor User", "learner")
+        conversation_id = main.create_conversation(session, "cursor_user", "cursor-channel").id
+        session.commit()
+        main.insert_and_commit_messages(session, [
+            {"conversation_id": conversation_id, "role": "user", "content": f"cursor message {n}",
+             "fingerprint": None, "created_at": main.datetime.utcnow()}
+            for n in range(5)
+        ])
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def assert_invalid(call, *args):
+    with pytest.raises(HTTPException) as raised:
+        call(*args)
+    assert raised.value.status_code == 400
+    assert raised.value.detail == "Invalid cursor"
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 json!", encode_cursor({"a": 1}), encode_cursor([]), encode_cursor(["2024-01-01T00:00:00"]),
+    encode_cursor([1, 2]), encode_cursor(["2024-01-01T00:00:00", True]), encode_cursor(["yesterday", 1]),
+    encode_cursor(["2024-01-01T00:00:00", 1, 2]),
+])
+def test_history_page_rejects_bad_cursors(db, cursor):
+    assert_invalid(main.load_conversation_summaries, db, "cursor_user", 10, cursor)
+
+
+@pytest.mark.parametrize("cursor", [
+    encode_cursor(["archive"]), encode_cursor(["archive", -1]), encode_cursor(["archive", "1"]),
+    encode_cursor(["1"]), encode_cursor([1, 2]), encode_cursor([True]), encode_cursor([1.5]),
+])
+def test_message_page_rejects_bad_cursors(db, cursor):
+    assert_invalid(main.load_conversation_messages, db, "cursor_user", "cursor-channel", 10, cursor)
+
+
+def test_message_pages_follow_their_cursors(db):
+    first = main.load_conversation_messages(db, "cursor_user", "cursor-channel", 3, None)
+    assert [msg["content"] for msg in first["messages"]] == [f"cursor message {n}" for n in (2, 3, 4)]
+    second = main.load_conversation_messages(db, "cursor_user", "cursor-channel", 3, first["next_cursor"])
+    assert [msg["content"] for msg in second["messages"]] == ["cursor message 0", "cursor message 1"]
+    assert second["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", [
+    encode_cursor([-1]), encode_cursor(["1"]), encode_cursor([1, 2]), encode_cursor([False]), encode_cursor([]),
+])
+def test_search_rejects_bad_cursors(db, cursor):
+    assert_invalid(main.search_user_messages, db, "cursor_user", "cursor", 10, cursor)
+
+
+def test_search_pages_follow_their_cursors(db):
+    first = main.search_user_messages(db, "cursor_user", "cursor", 3, None)
+    assert decode_cursor(first["next_cursor"]) == [3]
+    second = main.search_user_messages(db, "cursor_user", "cursor", 3, first["next_cursor"])
+    assert len(first["results"]) == 3 and len(second["results"]) == 2
+    assert second["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", [
+    encode_cursor(["etag", None, {}]), encode_cursor(["etag", None, {}, 5, 5]), encode_cursor([None, None, {}, 0]),
+    encode_cursor(["etag", 5, {}, 0]), encode_cursor(["etag", "not a date", {}, 0]),
+    encode_cursor(["etag", None, [], 0]), encode_cursor(["etag", None, {"x": 1}, 0]),
+    encode_cursor(["etag", None, {"1": -1}, 0]), encode_cursor(["etag", None, {"1": True}, 0]),
+    encode_cursor(["etag", None, {"1": "2"}, 0]), encode_cursor(["etag", None, {}, -1]),
+    encode_cursor(["etag", None, {}, True]), encode_cursor(["etag", None, {}, "5"]),
+])
+def test_memory_sync_rejects_bad_cursors(cursor):
+    assert_invalid(main.decode_sync_cursor, cursor)
+
+
+def test_memory_sync_cursor_round_trip():
+    cursor = encode_cursor(['W/"abc"', "2024-01-01T12:00:00", {"3": 41, "7": 0}, 12])
+    assert main.decode_sync_cursor(cursor) == ['W/"abc"', main.datetime(2024, 1, 1, 12), {3: 41, 7: 0}, 12]
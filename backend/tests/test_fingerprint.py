@@ -0,0 +1,29 @@
+import hashlib
+
+from fingerprint import FINGERPRINT_BITS, _shingles, is_near_duplicate, simhash
+
+
+def reference_simhash(text):
+    # Bit-by-bit definition; fingerprints already stored were made this way
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in _shingles(text or ""):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    return fingerprint - (1 << FINGERPRINT_BITS) if fingerprint >> (FINGERPRINT_BITS - 1) else fingerprint
+
+
+def test_simhash_matches_the_stored_definition():
+    texts = [
+        None, "", "hi", "two words", "Let's focus on Python basics first.",
+        " ".join(f"word{n % 37} topic{n % 11}" for n in range(1000)),
+    ]
+    for text in texts:
+        assert simhash(text) == reference_simhash(text)
+
+
+def test_repeated_reply_is_a_near_duplicate():
+    reply = "Start with the Python tutorial, then write a small script every day this week."
+    assert is_near_duplicate(simhash(reply), simhash(reply + "!"))
+    assert not is_near_duplicate(simhash(reply), simhash("Transformers use attention over the whole input sequence."))
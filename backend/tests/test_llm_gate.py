@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import CircuitBreaker
+from llm import LLMGate, LLMTimeoutError
+
+
+def test_timed_out_calls_keep_their_slot_until_they_return():
+    async def scenario():
+        gate = LLMGate(max_concurrency=2, timeout=0.2, queue_timeout=2, max_queue=10,
+                       breaker=CircuitBreaker(min_calls=100))
+        try:
+            slow = [asyncio.ensure_future(gate.run(time.sleep, 0.6)) for _ in range(2)]
+            for call in slow:
+                with pytest.raises(LLMTimeoutError):
+                    await call
+            # Both threads are still in the SDK call
+            assert gate.stats["in_flight"] == 2
+
+            # The next calls wait for those threads, then run normally
+            results = await asyncio.gather(*(gate.run(lambda n=n: n) for n in range(4)))
+            assert results == [0, 1, 2, 3]
+            assert gate.stats["timeouts"] == 2
+            assert gate.stats["completed"] == 4
+            assert gate.stats["in_flight"] == 0
+        finally:
+            gate.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_stream_frees_its_slot_when_the_producer_stops():
+    async def scenario():
+        gate = LLMGate(max_concurrency=1, timeout=1, queue_timeout=2, max_queue=10)
+
+        def chunks():
+            for n in range(100):
+                time.sleep(0.01)
+                yield n
+
+        try:
+            stream = gate.stream(chunks)
+            assert await stream.__anext__() == 0
+            await stream.aclose()
+            # Admitted once the producer thread notices and returns
+            assert await gate.run(lambda: "next") == "next"
+            assert gate.stats["in_flight"] == 0
+        finally:
+            gate.shutdown()
+
+    asyncio.run(scenario())
+
+
+class ServiceError(Exception):
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+def test_only_transient_errors_count_against_the_breaker():
+    async def scenario():
+        gate = LLMGate(max_concurrency=2, timeout=1, queue_timeout=2, max_queue=10,
+                       breaker=CircuitBreaker(window=4, min_calls=4, failure_ratio=0.5, cooldown=60))
+
+        def fail(code):
+            raise ServiceError(code)
+
+        def chunks(code):
+            yield "partial"
+            raise ServiceError(code)
+
+        try:
+            # Rejected requests: the service answered, so the breaker stays closed
+            for _ in range(3):
+                with pytest.raises(ServiceError):
+                    await gate.run(fail, 400)
+            with pytest.raises(ServiceError):
+                async for _ in gate.stream(lambda: chunks(400)):
+                    pass
+            assert gate.breaker.state == "closed"
+            assert gate.stats["errors"] == 4
+
+            # Overload and server errors do count: two of the last four opens it
+            with pytest.raises(ServiceError):
+                async for _ in gate.stream(lambda: chunks(500)):
+                    pass
+            assert gate.breaker.state == "closed"
+            with pytest.raises(ServiceError):
+                await gate.run(fail, 429)
+            assert gate.breaker.state == "open"
+        finally:
+            gate.shutdown()
+
+    asyncio.run(scenario())
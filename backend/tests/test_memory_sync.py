@@ -0,0 +1,84 @@
+import main
+from http_cache import make_etag
+
+
+def add_message(db, conversation_id, message_id, content):
+    db.execute(main.MessageModel.__table__.insert(), [{
+        "id": message_id, "conversation_id": conversation_id, "role": "user", "content": content,
+        "created_at": main.datetime.utcnow()
+    }])
+    db.commit()
+
+
+def memory_etag(db, user_id):
+    user_updated_at, _, conversation_count, message_count = main.load_memory_state(db, user_id)
+    return make_etag(user_updated_at, conversation_count, message_count)
+
+
+def test_delta_includes_messages_committed_out_of_id_order():
+    main.setup_schema()
+    db = main.SessionLocal()
+    try:
+        main.insert_user(db, "sync_user", "Sync User", "learner")
+        first = main.create_conversation(db, "sync_user", "sync-a").id
+        second = main.create_conversation(db, "sync_user", "sync-b").id
+        db.commit()
+        base = (db.query(main.func.max(main.MessageModel.id)).scalar() or 0) + 100
+        add_message(db, first, base, "hello")
+
+        # Turns in two channels: the later id commits first
+        add_message(db, second, base + 2, "from channel b")
+        payload, high_water, held = main.load_user_memory(db, "sync_user")
+        etag = memory_etag(db, "sync_user")
+        assert high_water == {first: base, second: base + 2}
+        assert held == 2
+
+        add_message(db, first, base + 1, "from channel a")
+        assert memory_etag(db, "sync_user") != etag
+
+        user_since = db.query(main.UserModel.updated_at).filter(main.UserModel.id == "sync_user").scalar()
+        payload, high_water, held = main.load_user_memory(db, "sync_user", [user_since, high_water, held])
+        assert payload["conversation_history"] == [
+            {"channel_id": "sync-a", "messages": [{"role": "user", "content": "from channel a"}]}
+        ]
+        assert "goals" not in payload
+        assert high_water == {first: base + 1, second: base + 2}
+        assert held == 3
+    finally:
+        db.close()
+
+
+def test_a_late_commit_below_the_high_water_gets_the_full_payload():
+    main.setup_schema()
+    db = main.SessionLocal()
+    try:
+        main.insert_user(db, "late_sync_user", "Sync User", "learner")
+        conversation_id = main.create_conversation(db, "late_sync_user", "late-sync").id
+        db.commit()
+        base = (db.query(main.func.max(main.MessageModel.id)).scalar() or 0) + 100
+        add_message(db, conversation_id, base, "first")
+
+        # Two turns of one conversation saved by different workers (or
+        # write-behind batches): the later id commits first
+        add_message(db, conversation_id, base + 2, "third")
+        count = main.load_memory_state(db, "late_sync_user")[3]
+        payload, high_water, held = main.load_user_memory(db, "late_sync_user")
+        assert high_water == {conversation_id: base + 2} and held == 2
+        add_message(db, conversation_id, base + 1, "second")
+
+        since = [None, high_water, held]
+        count = main.load_memory_state(db, "late_sync_user")[3]
+        payload, high_water, held = main.load_user_memory(db, "late_sync_user", since, count)
+        assert payload["delta"] is False
+        assert [msg["content"] for msg in payload["conversation_history"][0]["messages"]] == [
+            "first", "third", "second"
+        ]
+        assert held == 3
+
+        # Back in step: the next delta is empty
+        since = [None, high_water, held]
+        count = main.load_memory_state(db, "late_sync_user")[3]
+        payload, _, held = main.load_user_memory(db, "late_sync_user", since, count)
+        assert payload["delta"] is True and payload["conversation_history"] == [] and held == 3
+    finally:
+        db.close()
@@ -0,0 +1,90 @@
+import asyncio
+
+import response_cache
+from response_cache import MemoryCacheBackend, ResponseCache, make_cache_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingBackend:
+    shared = True
+
+    def get(self, key):
+        raise ConnectionError("shared cache unreachable")
+
+    def set(self, key, value):
+        raise ConnectionError("shared cache unreachable")
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    backend = MemoryCacheBackend(max_entries=10, ttl=60)
+    backend.set("key", "reply")
+
+    clock.now += 59
+    assert backend.get("key") == "reply"
+    clock.now += 2
+    assert backend.get("key") is None
+    # Dropped on the read that found it expired
+    assert len(backend) == 0
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+    backend.set("a", "1")
+    backend.set("b", "2")
+    assert backend.get("a") == "1"
+    backend.set("c", "3")
+
+    assert backend.get("b") is None
+    assert backend.get("a") == "1" and backend.get("c") == "3"
+    assert backend.evictions == 1
+    # Overwriting an entry doesn't evict anything
+    backend.set("c", "4")
+    assert backend.evictions == 1 and backend.get("c") == "4"
+
+
+def test_counters_track_local_and_shared_hits():
+    shared = MemoryCacheBackend(max_entries=10, ttl=60)
+    first = ResponseCache(local=MemoryCacheBackend(max_entries=10, ttl=60), shared=shared, enabled=True)
+    second = ResponseCache(local=MemoryCacheBackend(max_entries=10, ttl=60), shared=shared, enabled=True)
+    key = make_cache_key("How do I start?", ["User: hi", "AI: hello"])
+
+    async def scenario():
+        assert await first.get(key) is None
+        await first.set(key, "Start small.")
+        # Another worker: a shared hit, copied into its local cache
+        assert await second.get(key) == "Start small."
+        assert await second.get(key) == "Start small."
+        assert await first.get(key) == "Start small."
+
+    asyncio.run(scenario())
+    assert first.stats == {"hits": 1, "misses": 1, "shared_hits": 0, "sets": 1, "errors": 0}
+    assert second.stats == {"hits": 2, "misses": 0, "shared_hits": 1, "sets": 0, "errors": 0}
+    assert len(second.local) == 1
+    assert first.snapshot()["shared_backend"] == "MemoryCacheBackend"
+
+
+def test_failing_shared_backend_is_a_miss():
+    cache = ResponseCache(local=MemoryCacheBackend(max_entries=10, ttl=60), shared=FailingBackend(), enabled=True)
+
+    async def scenario():
+        assert await cache.get("key") is None
+        # The write still lands in the local cache
+        await cache.set("key", "reply")
+        assert await cache.get("key") == "reply"
+
+    asyncio.run(scenario())
+    assert cache.stats == {"hits": 1, "misses": 1, "shared_hits": 0, "sets": 1, "errors": 2}
+
+
+def test_equivalent_prompts_share_a_key():
+    assert make_cache_key("How do I start?", ["User:  Hi"]) == make_cache_key("how do i start", ["user: hi"])
+    assert make_cache_key("How do I start?", ["User: hi"]) != make_cache_key("How do I start?", ["User: bye"])
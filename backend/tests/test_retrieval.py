@@ -0,0 +1,90 @@
+import asyncio
+
+import numpy as np
+
+import main
+from retrieval import RetrievalIndex, UserIndex, term_vector
+
+
+def test_index_catches_up_on_messages_saved_elsewhere(monkeypatch):
+    index = RetrievalIndex(max_users=10, enabled=True)
+    monkeypatch.setattr(main, "memory_index", index)
+    main.setup_schema()
+    db = main.SessionLocal()
+
+    async def scenario():
+        main.insert_user(db, "retrieval_user", "Retrieval User", "learner")
+        first = main.create_conversation(db, "retrieval_user", "retrieval-a").id
+        second = main.create_conversation(db, "retrieval_user", "retrieval-b").id
+        db.commit()
+        main.insert_and_commit_messages(db, main.chat_turn_rows(first, "How do I learn Python decorators?", "Start with functions."))
+
+        await main.load_memory_index("retrieval_user")
+        assert len(index._get("retrieval_user")) == 2
+
+        # Saved by another worker after this one built the index
+        main.insert_and_commit_messages(db, main.chat_turn_rows(second, "Explain gradient descent for neural networks", None))
+        assert index.search("retrieval_user", "gradient descent", exclude_conversation_id=first) == []
+
+        await main.load_memory_index("retrieval_user")
+        results = index.search("retrieval_user", "gradient descent", exclude_conversation_id=first)
+        assert [content for _, _, content in results] == ["Explain gradient descent for neural networks"]
+
+        # Nothing new: the index is unchanged
+        await main.load_memory_index("retrieval_user")
+        assert len(index._get("retrieval_user")) == 3
+        if main.async_engine is not None:
+            await main.async_engine.dispose()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        db.close()
+
+
+def test_extend_skips_rows_already_indexed():
+    index = RetrievalIndex(max_users=10, enabled=True)
+    index.build("u", [(1, 10, "user", "python basics")])
+    rows = [(2, 10, "assistant", "use loops"), (3, 11, "user", "pandas dataframes")]
+    index.extend("u", rows)
+    index.extend("u", rows)
+    assert len(index._get("u")) == 3
+    assert index.high_water("u") == 3
+    assert index.stats["indexed"] == 2
+
+
+def test_sparse_scores_match_dense_cosine_similarity():
+    index = UserIndex(dimensions=64)
+    texts = ["python decorators wrap functions", "gradient descent on neural networks",
+             "python list comprehensions", "neural networks learn with gradient descent and python"]
+    for message_id, content in enumerate(texts, start=1):
+        index.add(message_id, 1, "user", content)
+
+    def dense(text):
+        vector = np.zeros(64, dtype=np.float32)
+        buckets, weights = term_vector(text, 64)
+        vector[buckets] = weights
+        return vector
+
+    matrix = np.stack([dense(text) for text in texts])
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    idf = np.log((len(texts) + 1.0) / ((matrix > 0).sum(axis=0) + 1.0)) + 1.0
+    query = dense("python gradient descent") * idf
+    expected = matrix @ (query / np.linalg.norm(query))
+
+    results = index.search("python gradient descent", k=4, min_score=-1)
+    assert [content for _, _, content in results] == [texts[i] for i in np.argsort(-expected)]
+    assert np.allclose([score for score, _, _ in results], np.sort(expected)[::-1], atol=1e-5)
+
+
+def test_full_index_drops_its_oldest_messages():
+    index = UserIndex(dimensions=128, capacity=8)
+    for message_id in range(1, 11):
+        index.add(message_id, message_id, "user", f"topic{message_id} shared words")
+    # Full at 8: the oldest quarter went to make room for message 9
+    assert len(index) == 8
+    assert [content for _, content in index.snippets] == [f"topic{n} shared words" for n in range(3, 11)]
+    assert index.doc_freq.sum() == sum(len(term_vector(f"topic{n} shared words", 128)[0]) for n in range(3, 11))
+    assert index.search("topic1") == []
+    assert [content for _, _, content in index.search("topic10")] == ["topic10 shared words"]
+    assert index.search("topic10", exclude_conversation_id=10) == []
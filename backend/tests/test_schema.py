@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, inspect, text
+
+import main
+from migrations import LATEST_SCHEMA_VERSION, MIGRATIONS, check_query_plans, get_schema_version, run_migrations
+
+# Tables as the first release's create_all built them on SQLite, before any
+# migration existed
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id VARCHAR NOT NULL,
+        name VARCHAR,
+        role VARCHAR,
+        goals JSON,
+        preferences JSON,
+        created_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE conversations (
+        id INTEGER NOT NULL,
+        user_id VARCHAR,
+        channel_id VARCHAR,
+        created_at DATETIME,
+        updated_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE messages (
+        id INTEGER NOT NULL,
+        conversation_id INTEGER,
+        role VARCHAR,
+        content TEXT,
+        created_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(conversation_id) REFERENCES conversations (id)
+    )""",
+]
+
+
+def test_setup_schema_uses_expected_indexes():
+    main.setup_schema()
+    assert get_schema_version(main.engine) == LATEST_SCHEMA_VERSION
+    assert check_query_plans(main.engine) == []
+    # A current database needs no more work
+    assert main.setup_schema() == []
+
+
+def test_upgrade_from_baseline_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    now = datetime(2024, 1, 1)
+    # The baseline never moved updated_at past the creation time
+    later = now + timedelta(days=120)
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(
+            text("INSERT INTO users (id, name, role, goals, preferences, created_at, updated_at) "
+                 "VALUES ('u1', 'U', 'learner', '[]', '{}', :t, :t)"),
+            {"t": now}
+        )
+        # Two conversations for one channel, as concurrent first messages
+        # could create before the unique index
+        conn.execute(
+            text("INSERT INTO conversations (id, user_id, channel_id, created_at, updated_at) VALUES (:id, 'u1', 'c1', :t, :t)"),
+            [{"id": 1, "t": now}, {"id": 2, "t": now}]
+        )
+        conn.execute(
+            text("INSERT INTO messages (conversation_id, role, content, created_at) VALUES (:c, :r, :m, :t)"),
+            [
+                {"c": 1, "r": "user", "m": "first question", "t": now},
+                {"c": 1, "r": "assistant", "m": "first answer", "t": now},
+                {"c": 2, "r": "user", "m": "second question", "t": later},
+            ]
+        )
+
+    main.Base.metadata.create_all(bind=engine)
+    applied = run_migrations(engine)
+
+    assert applied == [version for version, _, _ in MIGRATIONS]
+    assert get_schema_version(engine) == LATEST_SCHEMA_VERSION
+    assert run_migrations(engine) == []
+    assert check_query_plans(engine) == []
+
+    # Each index is created once, by the migration that needs it
+    assert {index["name"] for index in inspect(engine).get_indexes("conversations")} == {
+        "ux_conversations_user_channel", "ix_conversations_user_updated", "ix_conversations_updated"
+    }
+    assert {index["name"] for index in inspect(engine).get_indexes("messages")} == {
+        "ix_messages_conversation_created"
+    }
+    columns = {column["name"] for column in inspect(engine).get_columns("conversations")}
+    assert {"summary", "summarized_through_id", "archived_through_id"} <= columns
+    assert "fingerprint" in {column["name"] for column in inspect(engine).get_columns("messages")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id, name, role FROM users")).all() == [("u1", "U", "learner")]
+        assert conn.execute(text("SELECT id FROM conversations")).scalars().all() == [1]
+        assert conn.execute(
+            text("SELECT conversation_id, content FROM messages ORDER BY id")
+        ).all() == [(1, "first question"), (1, "first answer"), (1, "second question")]
+        updated_at = conn.execute(text("SELECT updated_at FROM conversations WHERE id = 1")).scalar()
+        assert str(updated_at) == str(later)
+
+    # The rebuilt messages table never hands out a deleted id again, and its
+    # search triggers came with it
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM messages WHERE id = 3"))
+        conn.execute(text("INSERT INTO messages (conversation_id, role, content) VALUES (1, 'user', 'third question')"))
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT MAX(id) FROM messages")).scalar() == 4
+        assert conn.execute(
+            text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'question' ORDER BY rowid")
+        ).scalars().all() == [1, 4]
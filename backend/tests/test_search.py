@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, text
+
+import main
+from migrations import SEARCH_INDEX_NAME, build_search_index
+from search import search_messages, format_snippet
+
+
+def save(db, conversation_id, *contents):
+    main.insert_and_commit_messages(db, [
+        {"conversation_id": conversation_id, "role": "user", "content": content,
+         "fingerprint": None, "created_at": main.datetime.utcnow()}
+        for content in contents
+    ])
+
+
+def test_search_finds_only_the_users_messages_best_match_first():
+    main.setup_schema()
+    db = main.SessionLocal()
+    try:
+        for user_id in ("search_user", "search_other"):
+            main.insert_user(db, user_id, "Search User", "learner")
+        mine = main.create_conversation(db, "search_user", "search-a").id
+        theirs = main.create_conversation(db, "search_other", "search-b").id
+        db.commit()
+        save(db, mine, "Gradient descent updates the weights step by step",
+             "Decorators wrap a function", "gradient descent, gradient checks and gradient clipping")
+        save(db, theirs, "My gradient descent notes")
+
+        rows = search_messages(db, "search_user", "gradient", 10, 0)
+        assert [row[1] for row in rows] == ["search-a", "search-a"]
+        assert "clipping" in rows[0][4]
+        assert "<mark>" in format_snippet(rows[0][4]).lower()
+        assert rows[0][5] >= rows[1][5]
+        # Offsets page through the same ranking
+        assert search_messages(db, "search_user", "gradient", 1, 1) == rows[1:]
+        assert search_messages(db, "search_user", "transformers", 10, 0) == []
+    finally:
+        db.close()
+
+
+def test_postgres_search_vectors_are_filled_in_before_the_index_is_built():
+    main.setup_schema()
+    if main.engine.dialect.name != "postgresql":
+        return
+    db = main.SessionLocal()
+    try:
+        main.insert_user(db, "backfill_user", "Backfill User", "learner")
+        conversation_id = main.create_conversation(db, "backfill_user", "backfill").id
+        db.commit()
+        save(db, conversation_id, "Kettlebell swings for beginners", "More kettlebell drills", "Rest days")
+        # As if these rows predated migration 5, before the index was built
+        with main.engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}"))
+            conn.execute(text("UPDATE messages SET content_tsv = NULL WHERE conversation_id = :id"),
+                         {"id": conversation_id})
+        assert search_messages(db, "backfill_user", "kettlebell", 10, 0) == []
+
+        assert build_search_index(main.engine, batch_size=2)
+        assert len(search_messages(db, "backfill_user", "kettlebell", 10, 0)) == 2
+        # Already in place: nothing more to do
+        assert build_search_index(main.engine)
+        inspector = inspect(main.engine)
+        assert SEARCH_INDEX_NAME in {index["name"] for index in inspector.get_indexes("messages")}
+    finally:
+        db.close()
@@ -0,0 +1,36 @@
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+import main
+
+
+def test_app_serves_while_the_database_is_down_and_gets_ready_once_it_is_up(monkeypatch):
+    attempts = []
+    setup_schema = main.setup_schema
+
+    def flaky_setup_schema():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OperationalError("SELECT version FROM schema_migrations", {}, Exception("connection refused"))
+        return setup_schema()
+
+    monkeypatch.setattr(main, "setup_schema", flaky_setup_schema)
+    monkeypatch.setattr(main, "backoff_delay", lambda attempt, base, cap: 0.05)
+    monkeypatch.setattr(main, "readiness", main.Readiness())
+
+    with TestClient(main.app) as client:
+        assert client.get("/").status_code == 200
+        statuses = []
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            response = client.get("/ready")
+            statuses.append((response.status_code, response.json()["schema"]))
+            if response.status_code == 200:
+                break
+            time.sleep(0.02)
+
+    assert statuses[0] == (503, False)
+    assert statuses[-1] == (200, True)
+    assert len(attempts) == 3
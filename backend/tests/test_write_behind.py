@@ -0,0 +1,92 @@
+import asyncio
+
+from write_behind import WriteBehindQueue
+
+
+def make_queue(fail, **options):
+    # flush_fn raises while fail(batch) is true; written rows are recorded
+    written = []
+
+    async def flush_fn(batch):
+        if fail(batch):
+            raise RuntimeError("write failed")
+        written.extend(batch)
+
+    # Long interval and large batches, so only the test's own flush() calls write
+    options = {"batch_size": 1000, "flush_interval": 60, "retry_max_seconds": 200, "enabled": True, **options}
+    return WriteBehindQueue(flush_fn, **options), written
+
+
+def test_failed_batch_is_retried_in_order_with_backoff():
+    attempts = []
+
+    async def scenario():
+        queue, written = make_queue(lambda batch: attempts.append(len(batch)) or len(attempts) <= 2, max_attempts=5)
+        queue.start()
+        queue.enqueue(["a", "b"])
+        assert await queue.flush() == 0
+        assert queue.pending(lambda row: True) == ["a", "b"]
+        assert queue.retry_delay() == 120
+
+        queue.enqueue(["c"])
+        assert await queue.flush() == 0
+        # Capped at retry_max_seconds
+        assert queue.retry_delay() == 200
+
+        assert await queue.flush() == 3
+        assert written == ["a", "b", "c"]
+        assert queue.snapshot()["retry_attempt"] == 0
+        assert queue.stats["errors"] == 2
+        await queue.close()
+
+    asyncio.run(scenario())
+    assert attempts == [2, 3, 3]
+
+
+def test_rows_that_keep_failing_are_set_aside():
+    async def scenario():
+        queue, written = make_queue(lambda batch: "bad" in batch, max_attempts=2)
+        queue.start()
+        queue.enqueue(["r1", "bad", "r3", "r4"])
+        assert await queue.flush() == 0
+        # Out of attempts: written in halves down to single rows
+        assert await queue.flush() == 3
+        assert written == ["r1", "r3", "r4"]
+        assert list(queue.dead_letters) == ["bad"]
+        assert queue.stats["dropped"] == 1
+        assert len(queue) == 0
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_batch_is_kept_when_no_row_can_be_written():
+    async def scenario():
+        queue, written = make_queue(lambda batch: True, max_attempts=2)
+        queue.start()
+        queue.enqueue(["r1", "r2"])
+        assert await queue.flush() == 0
+        assert await queue.flush() == 0
+        # Looks like an outage rather than bad rows: nothing is dropped
+        assert queue.pending(lambda row: True) == ["r1", "r2"]
+        assert not queue.dead_letters
+        assert queue.snapshot()["retry_attempt"] == 1
+        # Shutdown gives up on rows it can't write rather than hanging
+        await queue.close()
+        assert len(queue) == 2
+
+    asyncio.run(scenario())
+
+
+def test_has_room_bounds_the_buffer():
+    async def scenario():
+        queue, _ = make_queue(lambda batch: False, max_pending=3)
+        queue.start()
+        queue.enqueue(["r1", "r2"])
+        assert queue.has_room(1)
+        assert not queue.has_room(2)
+        assert queue.stats["overflowed"] == 2
+        await queue.close()
+        assert len(queue) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "250"))
+# Attempts at a failed batch, with exponential backoff between them, before
+# it is split up to find the rows that can't be written
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+WRITE_BEHIND_RETRY_MAX_SECONDS = float(os.getenv("WRITE_BEHIND_RETRY_MAX_SECONDS", "30"))
+# Rows buffered before callers are told to write their own (has_room)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+
+
+class WriteBehindQueue:
+    # Buffers rows in memory and hands them to flush_fn in batches from a
+    # background task, on whichever comes first of batch_size rows or
+    # flush_interval seconds. flush_fn is a coroutine function, or a blocking
+    # function run on the default executor. Rows stay visible through
+    # pending() until they are committed.
+    #
+    # A failed batch goes back to the front of the buffer and is retried
+    # with backoff. After max_attempts it is written in halves, down to
+    # single rows, and rows that still fail on their own are set aside in
+    # dead_letters. If no part of it can be written the database is more
+    # likely down than the rows bad, so it is kept and retried again.
+    def __init__(self, flush_fn, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000.0, enabled=MESSAGE_WRITE_BEHIND,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS, retry_max_seconds=WRITE_BEHIND_RETRY_MAX_SECONDS,
+                 max_pending=WRITE_BEHIND_MAX_PENDING):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.max_attempts = max_attempts
+        self.retry_max_seconds = retry_max_seconds
+        self.max_pending = max_pending
+        self.dead_letters = deque(maxlen=1000)
+        self._failures = 0
+        self._buffer = []
+        self._in_flight = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._flush_lock = None
+        self._task = None
+        self._closing = False
+        self.stats = {
+            "enqueued": 0, "flushed": 0, "batches": 0, "errors": 0, "dropped": 0, "overflowed": 0,
+            "last_flush_seconds": 0.0
+        }
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task = self._loop.create_task(self._run())
+        logger.info(f"Write-behind enabled (batch {self.batch_size}, interval {self.flush_interval}s)")
+
+    def has_room(self, count):
+        # False once max_pending rows are waiting; the caller then writes
+        # its rows itself, so a stalled database slows requests down rather
+        # than growing the buffer without bound
+        if len(self) + count <= self.max_pending:
+            return True
+        self.stats["overflowed"] += count
+        return False
+
+    def enqueue(self, rows):
+        # Safe to call from any thread
+        with self._lock:
+            self._buffer.extend(rows)
+            size = len(self._buffer)
+        self.stats["enqueued"] += len(rows)
+        if size >= self.batch_size:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def pending(self, predicate):
+        # Rows not yet committed (buffered or being flushed) matching predicate
+        with self._lock:
+            return [row for row in self._in_flight + self._buffer if predicate(row)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buffer) + len(self._in_flight)
+
+    async def _run(self):
+        while not self._closing:
+            if self._failures:
+                # Backing off; a full buffer doesn't cut the wait short
+                await asyncio.sleep(self.retry_delay())
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def retry_delay(self):
+        return min(self.retry_max_seconds, self.flush_interval * (2 ** self._failures))
+
+    async def _write(self, batch):
+        if asyncio.iscoroutinefunction(self.flush_fn):
+            await self.flush_fn(batch)
+        else:
+            await self._loop.run_in_executor(None, self.flush_fn, batch)
+
+    async def _write_isolating(self, batch):
+        # Writes what it can of batch in halves; returns (rows written,
+        # rows that failed on their own with their errors)
+        try:
+            await self._write(batch)
+            return len(batch), []
+        except Exception as e:
+            if len(batch) == 1:
+                return 0, [(batch[0], e)]
+        middle = len(batch) // 2
+        written_left, failed_left = await self._write_isolating(batch[:middle])
+        written_right, failed_right = await self._write_isolating(batch[middle:])
+        return written_left + written_right, failed_left + failed_right
+
+    async def flush(self):
+        async with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch, self._buffer = self._buffer, []
+                self._in_flight = batch
+
+            started_at = time.perf_counter()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                self._failures += 1
+                self.stats["errors"] += 1
+                logger.error(f"Write-behind flush of {len(batch)} rows failed (attempt {self._failures}): {str(e)}")
+                if self._failures < self.max_attempts:
+                    self._requeue(batch)
+                    return 0
+                written, failed = await self._write_isolating(batch)
+                if not written:
+                    # Nothing went through: start a new round of retries
+                    self._failures = 1
+                    self._requeue(batch)
+                    return 0
+                for row, error in failed:
+                    logger.error(f"Write-behind dropped a row that can't be written: {str(error)}")
+                    self.dead_letters.append(row)
+                self.stats["dropped"] += len(failed)
+                dropped = {id(row) for row, _ in failed}
+                batch = [row for row in batch if id(row) not in dropped]
+
+            self._failures = 0
+            with self._lock:
+                self._in_flight = []
+            self.stats["flushed"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_flush_seconds"] = time.perf_counter() - started_at
+            return len(batch)
+
+    def _requeue(self, batch):
+        # Back in front, so ordering is kept for the retry
+        with self._lock:
+            self._buffer = batch + self._buffer
+            self._in_flight = []
+
+    async def close(self):
+        # Stop the background task and drain whatever is still buffered
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+        while len(self):
+            if not await self.flush():
+                break
+        remaining = len(self)
+        if remaining:
+            logger.error(f"Write-behind shut down with {remaining} unsaved rows")
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "pending": len(self),
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval,
+            "max_pending": self.max_pending,
+            "retry_attempt": self._failures,
+            **self.stats
+        }
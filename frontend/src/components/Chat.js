@@ -22,6 +22,18 @@ const customTheme = {
   '--font-family': '-apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif',
 };
 
+// Sidebar entries for a page of conversation summaries
+const toSidebarConversations = (summaries) => summaries
+  .filter(summary => summary.channel_id && summary.message_count > 0)
+  .map(summary => ({
+    channel_id: summary.channel_id,
+    // The sidebar derives its title and date from the first user message
+    messages: summary.title
+      ? [{ role: 'user', content: summary.title, created_at: summary.created_at }]
+      : [],
+    channel_metadata: { created_at: summary.created_at }
+  }));
+
 // Custom Channel Header
 const CustomChannelHeader = () => {
   const { channel } = useChannelStateContext();
@@ -159,6 +171,9 @@ const ChatComponent = ({ userId, userName }) => {
   const [text, setText] = useState('');
   const [showQuickReplies, setShowQuickReplies] = useState(true);
   const [previousConversations, setPreviousConversations] = useState([]);
+  // Cursor for the next page of conversation summaries, null once all are loaded
+  const [conversationsCursor, setConversationsCursor] = useState(null);
+  const [loadingMoreConversations, setLoadingMoreConversations] = useState(false);
   const [showPreviousConversations, setShowPreviousConversations] = useState(true);
   const [isClientConnected, setIsClientConnected] = useState(false);
   const [connectionStatus, setConnectionStatus] = useState('');
@@ -183,66 +198,66 @@ const ChatComponent = ({ userId, userName }) => {
     console.log('Fetching previous conversations for user:', userId);
     
     try {
-      const response = await axios.get(`${API_URL}/memory/${userId}`);
+      // Summaries only; message pages are loaded per channel when needed.
+      // Later pages are loaded from the sidebar with loadMoreConversations.
+      const response = await axios.get(`${API_URL}/history/${userId}`, {
+        params: { limit: 50 }
+      });
       console.log('Previous conversations API response:', response.data);
       
-      if (response.data && Array.isArray(response.data.conversation_history)) {
-        const channelGroups = {};
-        
-        response.data.conversation_history.forEach(convo => {
-          if (convo.channel_id && convo.messages && convo.messages.length > 0) {
-            if (!channelGroups[convo.channel_id]) {
-              channelGroups[convo.channel_id] = {
-                channel_id: convo.channel_id,
-                messages: [...convo.messages],
-                channel_metadata: convo.channel_metadata || {}
-              };
-            } else {
-              channelGroups[convo.channel_id].messages = [
-                ...channelGroups[convo.channel_id].messages,
-                ...convo.messages
-              ];
-            }
-          }
-        });
-        
-        const groupedConversations = Object.values(channelGroups);
-        const sortedConversations = groupedConversations.sort((a, b) => {
-          const aCreatedAt = a.channel_metadata?.created_at;
-          const bCreatedAt = b.channel_metadata?.created_at;
-          
-          if (aCreatedAt && bCreatedAt) return new Date(bCreatedAt) - new Date(aCreatedAt);
-          
-          const aTimestamp = a.channel_id.match(/\d{13}/);
-          const bTimestamp = b.channel_id.match(/\d{13}/);
-          
-          if (aTimestamp && bTimestamp) return parseInt(bTimestamp[0]) - parseInt(aTimestamp[0]);
-          
-          const aDate = a.messages?.[0]?.created_at ? new Date(a.messages[0].created_at) : new Date(0);
-          const bDate = b.messages?.[0]?.created_at ? new Date(b.messages[0].created_at) : new Date(0);
-          
-          return bDate - aDate;
-        });
-        
-        console.log('Sorted and grouped conversations:', sortedConversations.length, 'conversations found');
-        const validConversations = sortedConversations.filter(
-          conv => conv.messages && conv.messages.length > 0 && conv.channel_id
-        );
+      if (response.data && Array.isArray(response.data.conversations)) {
+        const validConversations = toSidebarConversations(response.data.conversations);
         
+        console.log('Loaded conversation summaries:', validConversations.length, 'conversations found');
         setPreviousConversations(validConversations);
+        setConversationsCursor(response.data.next_cursor || null);
         return validConversations;
       } else {
         console.warn('Invalid conversation history data format:', response.data);
         setPreviousConversations([]);
+        setConversationsCursor(null);
         return [];
       }
     } catch (error) {
       console.error('Error fetching previous conversations:', error);
       setPreviousConversations([]);
+      setConversationsCursor(null);
       return [];
     }
   }, [userId]);
 
+  // Fetch the next page of previous conversations and append it
+  const loadMoreConversations = useCallback(async () => {
+    if (!userId || !conversationsCursor || loadingMoreConversations) {
+      return;
+    }
+    
+    setLoadingMoreConversations(true);
+    try {
+      const response = await axios.get(`${API_URL}/history/${userId}`, {
+        params: { limit: 50, cursor: conversationsCursor }
+      });
+      
+      if (response.data && Array.isArray(response.data.conversations)) {
+        const more = toSidebarConversations(response.data.conversations);
+        setPreviousConversations(prev => {
+          // A conversation that moved between pages is only listed once
+          const seen = new Set(prev.map(conversation => conversation.channel_id));
+          return prev.concat(more.filter(conversation => !seen.has(conversation.channel_id)));
+        });
+        setConversationsCursor(response.data.next_cursor || null);
+      } else {
+        console.warn('Invalid conversation history data format:', response.data);
+        setConversationsCursor(null);
+      }
+    } catch (error) {
+      // Keep the cursor so the user can try again
+      console.error('Error loading more conversations:', error);
+    } finally {
+      setLoadingMoreConversations(false);
+    }
+  }, [userId, conversationsCursor, loadingMoreConversations]);
+
   // Helper function to create new channel - with better error handling and connection validation
   // eslint-disable-next-line no-unused-vars
   const createNewChannelHelper = useCallback(async (client) => {
@@ -1027,6 +1042,9 @@ const ChatComponent = ({ userId, userName }) => {
         onRefresh={fetchPreviousConversations}
         onNewChat={handleNewChat}
         isLoading={loadingPreviousChats}
+        hasMore={!!conversationsCursor}
+        onLoadMore={loadMoreConversations}
+        isLoadingMore={loadingMoreConversations}
       />
       
     <div className="chat-container">
@@ -1,7 +1,7 @@
 import React from 'react';
 
 // Previous Conversations component
-const PreviousConversations = ({ conversations, onConversationSelect, isOpen, toggleOpen, onRefresh, onNewChat, isLoading }) => {
+const PreviousConversations = ({ conversations, onConversationSelect, isOpen, toggleOpen, onRefresh, onNewChat, isLoading, hasMore, onLoadMore, isLoadingMore }) => {
   // Don't return null even when empty, so the sidebar is always visible
   const isEmpty = !conversations || conversations.length === 0;
 
@@ -100,6 +100,18 @@ const PreviousConversations = ({ conversations, onConversationSelect, isOpen, to
             );
           })
         )}
+        
+        {!isLoading && hasMore && (
+          <div className="load-more-conversations-container">
+            <button
+              className="load-more-conversations-button"
+              onClick={onLoadMore}
+              disabled={isLoadingMore}
+            >
+              {isLoadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );